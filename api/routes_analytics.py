@@ -1,7 +1,9 @@
 from typing import Optional
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Query
+from fastapi.responses import PlainTextResponse
 
+from core import llm_cache, metrics, quota
 from storage import repository
 
 router = APIRouter(prefix="/api", tags=["analytics"])
@@ -12,6 +14,28 @@ def get_analytics(deck_type: Optional[str] = None):
     return repository.get_analytics(deck_type=deck_type)
 
 
+@router.get("/analytics/timeseries")
+def get_analytics_timeseries(
+    deck_type: Optional[str] = None,
+    topic: Optional[str] = None,
+    days: int = Query(30, ge=1, le=3650),
+):
+    """Cards created per day, by current status."""
+    return repository.get_analytics_timeseries(deck_type=deck_type, topic=topic, days=days)
+
+
+@router.get("/analytics/runs")
+def get_run_analytics(deck_type: Optional[str] = None, limit: int = Query(50, ge=1, le=500)):
+    """Recent generation runs with how their cards were reviewed."""
+    return repository.get_run_analytics(deck_type=deck_type, limit=limit)
+
+
+@router.get("/analytics/parsing")
+def get_parse_stats(deck_type: Optional[str] = None):
+    """Rows dropped/repaired by the card parser, per output format (json/pipe)."""
+    return repository.get_parse_stats(deck_type=deck_type)
+
+
 @router.get("/deck-types")
 def list_deck_types():
     types = repository.get_all_deck_types()
@@ -22,3 +46,20 @@ def list_deck_types():
         }
         for t in types
     ]
+
+
+@router.get("/llm-cache")
+def get_llm_cache_stats():
+    return llm_cache.stats()
+
+
+@router.get("/quota")
+def get_quota():
+    """Remaining Gemini request/token quota for today and the current minute."""
+    return quota.QUOTA.status()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Stage and request latency histograms in Prometheus text format."""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
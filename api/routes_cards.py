@@ -1,14 +1,18 @@
 import logging
+import shutil
+import uuid
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, File, HTTPException, Query, Request, UploadFile
+from fastapi.responses import FileResponse, Response
 from pydantic import BaseModel
 
-from core import media
+from core import deck_registry, jobs, media
 from core.cards import Card
-from export.genanki_export import export_cards
+from core.config import DATA_DIR
+from export import artifacts
+from export.genanki_export import export_delta
 from storage import repository
 
 logger = logging.getLogger(__name__)
@@ -19,27 +23,70 @@ class CardUpdate(BaseModel):
     status: str  # ACCEPTED, REJECTED
 
 
+class CardsStatusUpdate(BaseModel):
+    statuses: Dict[int, str]  # card id -> ACCEPTED, REJECTED, ...
+
+
 class ExportRequest(BaseModel):
     card_ids: List[int]
     deck_name: str = "Great Works of Art"
+    background: bool = False  # queue as a job; download from /api/jobs/{id}/download
+    refetch_missing: bool = False  # re-download images whose file is missing
+
+
+class DeltaExportRequest(BaseModel):
+    deck_type: str = "artwork"
+    deck_name: str = "Great Works of Art"
+    background: bool = False
+    refetch_missing: bool = False
+
+UPLOADS_DIR = DATA_DIR / "uploads"
+
+
+def _card_to_dict(c: Card) -> dict:
+    return {
+        "id": c.id,
+        "deck_type": c.deck_type,
+        "fields": c.fields_json,
+        "image_filename": c.image_filename,
+        "audio_filename": c.audio_filename,
+        "status": c.status,
+        "source_topic": c.source_topic,
+        "created_at": str(c.created_at) if c.created_at else None,
+    }
 
 
 @router.get("/cards")
 def list_cards(deck_type: Optional[str] = None, status: Optional[str] = None):
     cards = repository.get_cards(deck_type=deck_type, status=status)
-    return [
-        {
-            "id": c.id,
-            "deck_type": c.deck_type,
-            "fields": c.fields_json,
-            "image_filename": c.image_filename,
-            "audio_filename": c.audio_filename,
-            "status": c.status,
-            "source_topic": c.source_topic,
-            "created_at": str(c.created_at) if c.created_at else None,
-        }
-        for c in cards
-    ]
+    return [_card_to_dict(c) for c in cards]
+
+
+@router.get("/cards/search")
+def search_cards(
+    q: str,
+    deck_type: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+):
+    """Ranked full-text search over card Title, Artist, Period/Movement, Location and Note."""
+    # Fetch one extra row to know whether another page exists
+    cards = repository.search_cards(q, deck_type=deck_type, status=status, limit=limit + 1, offset=offset)
+    return {
+        "query": q,
+        "offset": offset,
+        "limit": limit,
+        "has_more": len(cards) > limit,
+        "cards": [_card_to_dict(c) for c in cards[:limit]],
+    }
+
+
+@router.patch("/cards")
+def update_cards(update: CardsStatusUpdate):
+    """Set the status of many cards in one request and one transaction."""
+    updated = repository.update_cards_statuses(update.statuses)
+    return {"requested": len(update.statuses), "updated": updated}
 
 
 @router.patch("/cards/{card_id}")
@@ -104,28 +151,146 @@ def clear_generated_cards(status: str = "GENERATED,REJECTED,DUPLICATE", deck_typ
     return {"deleted": total}
 
 
-@router.post("/export")
-def export_to_apkg(req: ExportRequest):
-    """Export accepted cards to .apkg file."""
-    all_cards = repository.get_cards()
-    selected = [c for c in all_cards if c.id in req.card_ids]
+def _artifact_summary(artifact: dict) -> dict:
+    return {
+        "artifact": artifact["key"],
+        "status": "READY",
+        "filename": artifact["filename"],
+        "card_count": artifact["card_count"],
+        "size_bytes": artifact["size_bytes"],
+        "media": artifact["manifest"],
+        "download": f"/api/exports/artifacts/{artifact['key']}/download",
+    }
+
+
+def _artifact_response(artifact: dict, request: Request) -> Response:
+    """The package file with the artifact key as ETag (304 when the client
+    already has it; Range requests are handled by FileResponse)."""
+    etag = f'"{artifact["key"]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    manifest = artifact["manifest"]
+    return FileResponse(
+        path=str(artifacts.artifact_path(artifact)),
+        media_type="application/octet-stream",
+        filename=artifact["filename"],
+        headers={
+            "ETag": etag,
+            "Cache-Control": "private, no-cache",
+            "X-Media-Missing": str(len(manifest.get("missing_cards", []))),
+            "X-Media-Refetched": str(manifest.get("refetched", 0)),
+        },
+    )
 
+
+@router.post("/export")
+def export_to_apkg(req: ExportRequest, request: Request):
+    """Export cards to an .apkg file. An identical selection whose cards
+    haven't changed is served from the cached artifact instead of rebuilt.
+    With background=true an already built artifact is returned at once;
+    otherwise a job builds it and its result names the artifact."""
+    selected = repository.get_cards(card_ids=req.card_ids)
     if not selected:
         raise HTTPException(status_code=400, detail="No cards found for given IDs")
 
     deck_type_name = selected[0].deck_type
-    dt = repository.get_deck_type(deck_type_name)
+    dt = deck_registry.get_deck_type(deck_type_name)
     if not dt:
         raise HTTPException(status_code=400, detail=f"Unknown deck type: {deck_type_name}")
 
-    output_path = export_cards(selected, dt, deck_name=req.deck_name)
+    if req.background:
+        artifact = artifacts.get_artifact(artifacts.artifact_key(selected, dt, req.deck_name), touch=True)
+        if artifact:
+            repository.mark_cards_exported(selected)
+            return _artifact_summary(artifact)
+        # The key is only final once built (refetched images change it): the job result carries it
+        job_id = jobs.submit("export", {
+            "card_ids": req.card_ids, "deck_name": req.deck_name, "refetch_missing": req.refetch_missing,
+        })
+        return {"job_id": job_id, "status": jobs.QUEUED}
+
+    artifact = artifacts.build_artifact(selected, dt, deck_name=req.deck_name, refetch_missing=req.refetch_missing)
+    repository.mark_cards_exported(selected)
+    return _artifact_response(artifact, request)
+
+
+@router.get("/exports/artifacts/{key}")
+def get_export_artifact(key: str):
+    artifact = artifacts.get_artifact(key)
+    if not artifact:
+        raise HTTPException(status_code=404, detail="Export artifact not found (not built yet, or expired)")
+    return _artifact_summary(artifact)
 
-    # Mark as exported
-    for c in selected:
-        repository.update_card_status(c.id, "EXPORTED")
+
+@router.get("/exports/artifacts/{key}/download")
+def download_export_artifact(key: str, request: Request):
+    """Download a built package; supports ETag revalidation and Range requests."""
+    artifact = artifacts.get_artifact(key, touch=True)
+    if not artifact:
+        raise HTTPException(status_code=404, detail="Export artifact not found (not built yet, or expired)")
+    return _artifact_response(artifact, request)
+
+
+@router.post("/export/delta")
+def export_delta_apkg(req: DeltaExportRequest):
+    """Export only cards accepted, or edited since they were exported.
+    Notes keep stable GUIDs, so Anki updates edited cards in place."""
+    dt = deck_registry.get_deck_type(req.deck_type)
+    if not dt:
+        raise HTTPException(status_code=400, detail=f"Unknown deck type: {req.deck_type}")
+
+    if req.background:
+        job_id = jobs.submit("export", {
+            "delta": True, "deck_type": req.deck_type, "deck_name": req.deck_name,
+            "refetch_missing": req.refetch_missing,
+        })
+        return {"job_id": job_id, "status": jobs.QUEUED}
+
+    output_path, cards = export_delta(dt, deck_name=req.deck_name, refetch_missing=req.refetch_missing)
+    if output_path is None:
+        raise HTTPException(status_code=409, detail="Nothing changed since the last export")
+    repository.mark_cards_exported(cards)
 
     return FileResponse(
         path=str(output_path),
         media_type="application/octet-stream",
         filename=output_path.name,
     )
+
+
+@router.get("/exports")
+def list_exports(deck_type: Optional[str] = None, limit: int = Query(20, ge=1, le=200)):
+    """The exports ledger, newest first."""
+    return repository.list_exports(deck_type=deck_type, limit=limit)
+
+
+@router.post("/import")
+def import_deck(
+    deck_type: str = "artwork",
+    compute_embeddings: bool = True,
+    incremental: bool = False,
+    with_media: bool = True,
+    workers: int = Query(2, ge=1, le=16),
+    file: UploadFile = File(...),
+):
+    """Upload an existing .apkg and import it as a background job.
+    incremental=true only reads notes changed since the last import;
+    workers is the number of embedding batches in flight."""
+    if not deck_registry.get_deck_type(deck_type):
+        raise HTTPException(status_code=400, detail=f"Unknown deck type: {deck_type}")
+
+    UPLOADS_DIR.mkdir(exist_ok=True)
+    path = UPLOADS_DIR / f"{uuid.uuid4().hex}.apkg"
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file.file, f)
+
+    job_id = jobs.submit("import", {
+        "path": str(path),
+        "deck_type": deck_type,
+        "compute_embeddings": compute_embeddings,
+        "incremental": incremental,
+        "with_media": with_media,
+        "workers": workers,
+        "delete_after": True,
+    })
+    return {"job_id": job_id, "status": jobs.QUEUED}
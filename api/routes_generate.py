@@ -1,306 +1,380 @@
+import asyncio
+import json
 import logging
+import threading
+from typing import AsyncIterator, Awaitable, Callable, List
 
-from fastapi import APIRouter, File, UploadFile
+from fastapi import APIRouter, File, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from core import agents, embeddings, media, parsing
-from core.cards import Card, GenerationRun
+from core import agents, context, deck_registry, embeddings, generation, jobs, llm_cache, parsing
+from core.cards import DeckType
 from storage import repository
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api", tags=["generate"])
 
+# How often a running generation checks whether its HTTP client went away
+_DISCONNECT_POLL_SECONDS = 1.0
+# Comment line sent on idle event streams so proxies keep the connection open
+_SSE_KEEPALIVE_SECONDS = 15.0
+
+
+async def _cancel_on_disconnect(request: Request, work: Awaitable[dict]) -> dict:
+    """Await work, cancelling it if the client disconnects first so an
+    abandoned request stops spending Gemini quota."""
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=_DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected; cancelling %s", request.url.path)
+                return {"error": "Client disconnected"}
+    finally:
+        task.cancel()
+
+
+async def _generate_llm_cards_async(
+    topic: str,
+    deck_type: str,
+    dt: DeckType,
+    missing_concepts: str,
+    persona: str,
+    count: int,
+    existing_cards: list[dict],
+    existing_embeddings: list,
+    use_cache: bool = True,
+) -> dict:
+    """generation.generate_llm_cards on the async client: Agent 2 and the
+    card embeddings are awaited; dedup and saving run in the threadpool."""
+    field_names = deck_registry.field_names(dt)
+    field_config = deck_registry.entry_for(dt).field_config
+
+    raw = await agents.generate_cards_async(
+        missing_concepts, count, field_config, persona=persona, use_cache=use_cache
+    )
+    parsed, parse_stats = parsing.parse_cards(raw, field_names)
+    card_embeddings = await embeddings.get_embeddings_async(
+        [embeddings.card_text_for_embedding(card_fields) for card_fields in parsed]
+    )
 
-def _fetch_image_for_artwork(card_id: int, artwork: dict, fields: dict) -> str | None:
-    """Download image for an artwork card, using Wikidata URL when available.
-
-    Returns filename or None.
-    """
-    image_url = artwork.get("image_url") or fields.get("Image Source", "")
-    title = fields.get("Title", "")
-    artist = fields.get("Artist", "")
+    run_id, saved_cards = await run_in_threadpool(
+        generation.save_llm_cards, parsed, topic, deck_type, dt, persona,
+        existing_cards, existing_embeddings, parse_stats, card_embeddings,
+    )
+    if run_id is None:
+        return {"error": "Generation failed", "raw_output": raw}
 
-    # Try Wikidata URL directly first (fastest, most reliable)
-    if image_url:
-        result = media.download_image(image_url)
-        if result:
-            filename, _ = result
-            repository.update_card_media(card_id, image_filename=filename)
-            return filename
+    return {
+        "run_id": run_id,
+        "persona": persona,
+        "gap_analysis": missing_concepts,
+        "cards": saved_cards,
+        "parse": parse_stats,
+        "llm_cache": llm_cache.stats(),
+    }
 
-    # Fall back to multi-source search
-    if title or artist:
-        urls, _ = media.search_images(title=title, artist=artist)
-        if urls:
-            result = media.download_image(urls)
-            if result:
-                filename, _ = result
-                repository.update_card_media(card_id, image_filename=filename)
-                return filename
 
-    return None
+class _StreamClosed(Exception):
+    """Raised from a pipeline callback once its event stream has been closed."""
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _event_stream(
+    pipeline: Callable[[generation.ProgressCallback, generation.EventCallback], dict],
+) -> StreamingResponse:
+    """Run a generation pipeline in a worker thread and stream its events to
+    the client as Server-Sent Events: progress, card, image, then done (the
+    result summary without the card list) or error. When the client goes
+    away the next callback raises, so the pipeline stops at the next card."""
+
+    async def events() -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        closed = threading.Event()
+
+        def emit(event: str, data: dict):
+            if closed.is_set():
+                raise _StreamClosed()
+            # Serialise now: the pipeline may still update data after emitting it
+            loop.call_soon_threadsafe(queue.put_nowait, _sse(event, data))
+
+        def on_progress(done: int, total: int, message: str):
+            emit("progress", {"done": done, "total": total, "message": message})
+
+        def run():
+            try:
+                result = pipeline(on_progress, emit)
+                if result.get("error"):
+                    emit("error", result)
+                else:
+                    summary = {k: v for k, v in result.items() if k != "cards"}
+                    summary["cards_saved"] = len(result.get("cards", []))
+                    emit("done", summary)
+            except _StreamClosed:
+                logger.info("Event stream closed; generation stopped")
+            except Exception as e:
+                logger.exception("Streamed generation failed")
+                if not closed.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, _sse("error", {"error": str(e)}))
+            finally:
+                if not closed.is_set():
+                    loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        worker = threading.Thread(target=run, name="generate-events", daemon=True)
+        worker.start()
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), _SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is None:
+                    break
+                yield item
+        finally:
+            closed.set()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 class GenerateRequest(BaseModel):
     topic: str
     count: int = 3
     deck_type: str = "artwork"
+    stream: bool = False  # LLM decks: save cards as Gemini streams them
+    no_cache: bool = False  # LLM decks: bypass the response cache
+    background: bool = False  # queue as a job and return its id immediately
+
+
+class BatchGenerateRequest(BaseModel):
+    topics: List[str]
+    count: int = 3  # cards per topic
+    deck_type: str
+    no_cache: bool = False
 
 
 class ArtistRequest(BaseModel):
     artist_name: str
     deck_type: str = "artwork"
     limit: int = 0
+    background: bool = False
 
 
 @router.post("/generate")
-def generate_cards(req: GenerateRequest):
+async def generate_cards(req: GenerateRequest, request: Request):
     """Generate cards. Artwork decks use Wikidata; other decks use LLM."""
 
-    dt = repository.get_deck_type(req.deck_type)
+    dt = deck_registry.get_deck_type(req.deck_type)
     if not dt:
         return {"error": f"Unknown deck type: {req.deck_type}"}
 
-    # Artwork decks: use Wikidata (no LLM, no hallucinations)
+    if req.background:
+        job_id = jobs.submit("generate", {
+            "topic": req.topic, "deck_type": req.deck_type, "count": req.count, "no_cache": req.no_cache,
+        })
+        return {"job_id": job_id, "status": jobs.QUEUED}
+
     if req.deck_type == "artwork":
-        from core.wikidata import query_artworks_by_topic, artworks_to_card_fields, base_title
-
-        artworks = query_artworks_by_topic(req.topic, limit=req.count)
-        if not artworks:
-            return {"error": f"No artworks found on Wikidata for '{req.topic}'"}
-
-        existing_cards = repository.get_cards(deck_type=req.deck_type)
-        existing_titles = {base_title(c.fields_json.get("Title", "")) for c in existing_cards}
-        new_artworks = [a for a in artworks if base_title(a["title"]) not in existing_titles]
-
-        if not new_artworks:
-            return {
-                "cards": [],
-                "message": "All artworks are already in the deck",
-                "total_found": len(artworks),
-                "skipped": len(artworks),
-            }
-
-        card_fields_list = artworks_to_card_fields(new_artworks)
-        saved_cards = []
-        for i, (art, fields) in enumerate(zip(new_artworks, card_fields_list)):
-            card = Card(
-                deck_type=req.deck_type, fields_json=fields,
-                source_topic=req.topic, status="GENERATED",
-            )
-            card_id = repository.save_card(card)
-
-            # Auto-fetch image
-            img_filename = _fetch_image_for_artwork(card_id, art, fields)
-            logger.info("[%d/%d] %s → %s", i + 1, len(new_artworks),
-                        fields.get("Title", "?"), img_filename or "no image")
-
-            saved_cards.append({
-                "id": card_id,
-                "fields": fields,
-                "status": "GENERATED",
-                "has_free_image": bool(fields.get("Image Source")),
-                "image_filename": img_filename,
-            })
-
-        return {
-            "cards": saved_cards,
-            "total_found": len(artworks),
-            "skipped": len(artworks) - len(new_artworks),
-            "new": len(new_artworks),
-        }
-
-    # Non-artwork decks: LLM pipeline
-    field_names = [f["name"] for f in dt.fields_schema]
-    field_config = {f["name"]: f["type"] for f in dt.fields_schema}
-
-    existing_cards, existing_embeddings = repository.get_existing_cards_with_embeddings(req.deck_type)
-    existing_text = ", ".join(c.get("Title", "") for c in existing_cards if c.get("Title"))
-    if not existing_text:
-        existing_text = "No existing cards found."
-
-    missing_concepts, persona = agents.analyze_knowledge_gaps(
-        req.topic, existing_text, num=req.count
-    )
+        return await run_in_threadpool(
+            generation.generate_artwork_cards, req.topic, req.deck_type, req.count
+        )
 
-    raw = agents.generate_cards(missing_concepts, req.count, field_config, persona=persona)
-    parsed = parsing.smart_parse(raw, field_names)
+    return await _cancel_on_disconnect(request, _generate_for_topic(req, dt))
 
-    if not parsed:
-        return {"error": "Generation failed", "raw_output": raw}
 
-    run = GenerationRun(
-        topic=req.topic, deck_name=dt.name, deck_type=req.deck_type,
-        persona=persona, total_generated=len(parsed),
+@generation.timed_pipeline
+async def _generate_for_topic(req: GenerateRequest, dt: DeckType) -> dict:
+    """Non-artwork decks: LLM pipeline."""
+    existing_cards, existing_embeddings = await run_in_threadpool(
+        repository.get_existing_cards_with_embeddings, req.deck_type
+    )
+    existing_text = await run_in_threadpool(
+        context.select_existing_context, req.topic, req.deck_type, existing_cards, existing_embeddings
+    )
+
+    missing_concepts, persona = await agents.analyze_knowledge_gaps_async(
+        req.topic, existing_text, num=req.count, use_cache=not req.no_cache
     )
-    run_id = repository.create_run(run)
-
-    saved_cards = []
-    for card_fields in parsed:
-        card_text = embeddings.card_text_for_embedding(card_fields)
-        emb = embeddings.get_embedding(card_text)
-        is_dup, reason = embeddings.is_duplicate(
-            card_fields, existing_cards, existing_embeddings, new_embedding=emb
+
+    if req.stream:
+        # Streaming parses and saves line by line on the sync client
+        return await run_in_threadpool(
+            generation.generate_llm_cards, req.topic, req.deck_type, dt, missing_concepts, persona, req.count,
+            existing_cards, existing_embeddings, stream=True, use_cache=not req.no_cache,
         )
+    return await _generate_llm_cards_async(
+        req.topic, req.deck_type, dt, missing_concepts, persona, req.count,
+        existing_cards, existing_embeddings, use_cache=not req.no_cache,
+    )
 
-        status = "DUPLICATE" if is_dup else "GENERATED"
-        card = Card(
-            deck_type=req.deck_type, fields_json=card_fields,
-            source_topic=req.topic, run_id=run_id, status=status,
+
+@router.get("/generate/events")
+def generate_events(topic: str, count: int = 3, deck_type: str = "artwork", no_cache: bool = False):
+    """/api/generate as a Server-Sent Events stream: each card is sent as soon
+    as it is saved (artwork images follow in "image" events)."""
+    dt = deck_registry.get_deck_type(deck_type)
+    if not dt:
+        return {"error": f"Unknown deck type: {deck_type}"}
+
+    def pipeline(on_progress, on_event) -> dict:
+        if deck_type == "artwork":
+            return generation.generate_artwork_cards(topic, deck_type, count, on_progress, on_event)
+        return generation.generate_for_topic(
+            topic, deck_type, dt, count, use_cache=not no_cache,
+            on_progress=on_progress, stream=True, on_event=on_event,
         )
-        card_id = repository.save_card(card, embedding=emb)
 
-        saved_cards.append({
-            "id": card_id,
-            "fields": card_fields,
-            "status": status,
-            "duplicate_reason": reason if is_dup else None,
-        })
+    return _event_stream(pipeline)
 
-        if not is_dup:
-            existing_cards.append(card_fields)
-            existing_embeddings.append(emb)
 
-    return {
-        "run_id": run_id,
-        "persona": persona,
-        "gap_analysis": missing_concepts,
-        "cards": saved_cards,
-    }
+@router.get("/generate/artist/events")
+def generate_artist_events(artist_name: str, deck_type: str = "artwork", limit: int = 0):
+    """/api/generate/artist as a Server-Sent Events stream."""
+    dt = deck_registry.get_deck_type(deck_type)
+    if not dt:
+        return {"error": f"Unknown deck type: {deck_type}"}
 
+    def pipeline(on_progress, on_event) -> dict:
+        return generation.generate_artist_cards(artist_name, deck_type, limit, on_progress, on_event)
 
-@router.post("/generate/artist")
-def generate_from_artist(req: ArtistRequest):
-    """Look up real paintings by artist on Wikidata and create cards."""
-    from core.wikidata import query_artist_artworks, artworks_to_card_fields, base_title
+    return _event_stream(pipeline)
+
+
+@router.post("/generate/batch")
+async def generate_batch(req: BatchGenerateRequest, request: Request):
+    """Generate cards for several topics with one gap-analysis call and one
+    generation call in total (LLM decks only). Each topic gets its own run."""
+    topics = [t.strip() for t in req.topics if t.strip()]
+    if not topics:
+        return {"error": "No topics given"}
+    if req.deck_type == "artwork":
+        return {"error": "Batch mode is for LLM decks; artwork topics are looked up on Wikidata via /api/generate"}
 
-    dt = repository.get_deck_type(req.deck_type)
+    dt = deck_registry.get_deck_type(req.deck_type)
     if not dt:
         return {"error": f"Unknown deck type: {req.deck_type}"}
 
-    artworks = query_artist_artworks(req.artist_name)
-    if not artworks:
-        return {"error": f"No artworks found on Wikidata for '{req.artist_name}'"}
+    return await _cancel_on_disconnect(request, _generate_for_topics(req, dt, topics))
 
-    if req.limit > 0:
-        artworks = artworks[:req.limit]
 
-    # Filter out paintings already in the deck (fuzzy title match)
-    existing_cards = repository.get_cards(deck_type=req.deck_type)
-    existing_titles = {base_title(c.fields_json.get("Title", "")) for c in existing_cards}
+@generation.timed_pipeline
+async def _generate_for_topics(req: BatchGenerateRequest, dt: DeckType, topics: list[str]) -> dict:
+    field_names = deck_registry.field_names(dt)
+    field_config = deck_registry.entry_for(dt).field_config
+    use_cache = not req.no_cache
 
-    new_artworks = [a for a in artworks if base_title(a["title"]) not in existing_titles]
+    existing_cards, existing_embeddings = await run_in_threadpool(
+        repository.get_existing_cards_with_embeddings, req.deck_type
+    )
+    existing_texts = [
+        await run_in_threadpool(
+            context.select_existing_context, topic, req.deck_type, existing_cards, existing_embeddings
+        )
+        for topic in topics
+    ]
 
-    if not new_artworks:
-        return {
-            "cards": [],
-            "message": "All paintings from this artist are already in the deck",
-            "total_found": len(artworks),
-            "skipped": len(artworks),
-        }
+    gaps = await agents.analyze_knowledge_gaps_batch_async(
+        topics, existing_texts, num=req.count, use_cache=use_cache
+    )
+    topic_gaps = [(topic, gap, persona) for topic, (gap, persona) in zip(topics, gaps)]
+    raw = await agents.generate_cards_batch_async(topic_gaps, req.count, field_config, use_cache=use_cache)
+    sections = parsing.split_topic_sections(raw, len(topics))
+
+    results = []
+    for i, (topic, missing_concepts, persona) in enumerate(topic_gaps, 1):
+        parse_stats = parsing.new_parse_stats("pipe")
+        parsed = parsing.smart_parse(sections.get(i, ""), field_names, parse_stats)
+        card_embeddings = await embeddings.get_embeddings_async(
+            [embeddings.card_text_for_embedding(card_fields) for card_fields in parsed]
+        )
+        run_id, saved_cards = await run_in_threadpool(
+            generation.save_llm_cards, parsed, topic, req.deck_type, dt, persona,
+            existing_cards, existing_embeddings, parse_stats, card_embeddings,
+        )
+        results.append({
+            "topic": topic,
+            "run_id": run_id,
+            "persona": persona,
+            "gap_analysis": missing_concepts,
+            "cards": saved_cards,
+            "parse": parse_stats,
+        })
 
-    card_fields_list = artworks_to_card_fields(new_artworks, req.artist_name)
+    if not any(r["cards"] for r in results):
+        return {"error": "Generation failed", "raw_output": raw}
+    return {"topics": results, "llm_cache": llm_cache.stats()}
 
-    # Save cards + auto-fetch images
-    saved_cards = []
-    for i, (art, fields) in enumerate(zip(new_artworks, card_fields_list)):
-        card = Card(
-            deck_type=req.deck_type, fields_json=fields,
-            source_topic=req.artist_name, status="GENERATED",
-        )
-        card_id = repository.save_card(card)
-
-        # Auto-fetch image
-        img_filename = _fetch_image_for_artwork(card_id, art, fields)
-        logger.info("[%d/%d] %s → %s", i + 1, len(new_artworks),
-                    fields.get("Title", "?"), img_filename or "no image")
-
-        saved_cards.append({
-            "id": card_id,
-            "fields": fields,
-            "status": "GENERATED",
-            "has_free_image": bool(fields.get("Image Source")),
-            "image_filename": img_filename,
+
+@router.post("/generate/artist")
+def generate_from_artist(req: ArtistRequest):
+    """Look up real paintings by artist on Wikidata and create cards."""
+    dt = deck_registry.get_deck_type(req.deck_type)
+    if not dt:
+        return {"error": f"Unknown deck type: {req.deck_type}"}
+
+    if req.background:
+        job_id = jobs.submit("generate_artist", {
+            "artist_name": req.artist_name, "deck_type": req.deck_type, "limit": req.limit,
         })
+        return {"job_id": job_id, "status": jobs.QUEUED}
 
-    return {
-        "cards": saved_cards,
-        "total_found": len(artworks),
-        "skipped": len(artworks) - len(new_artworks),
-        "new": len(new_artworks),
-    }
+    return generation.generate_artist_cards(req.artist_name, req.deck_type, req.limit)
 
 
 @router.post("/generate/from-file")
 async def generate_from_file(
+    request: Request,
     topic: str,
     count: int = 3,
     deck_type: str = "artwork",
+    stream: bool = False,
+    no_cache: bool = False,
     file: UploadFile = File(...),
 ):
     """Generate cards from an uploaded file."""
     from core.ingestion import extract_text
 
-    dt = repository.get_deck_type(deck_type)
+    dt = deck_registry.get_deck_type(deck_type)
     if not dt:
         return {"error": f"Unknown deck type: {deck_type}"}
 
-    field_names = [f["name"] for f in dt.fields_schema]
-    field_config = {f["name"]: f["type"] for f in dt.fields_schema}
-
-    existing_cards, existing_embeddings = repository.get_existing_cards_with_embeddings(deck_type)
-    existing_text = ", ".join(c.get("Title", "") for c in existing_cards if c.get("Title"))
-    if not existing_text:
-        existing_text = "No existing cards found."
-
     file_bytes = await file.read()
-    file_text = extract_text(file_bytes, file.filename)
-
-    missing_concepts, persona = agents.analyze_knowledge_gaps(
-        topic, existing_text, source_text=file_text, num=count
-    )
+    file_text = await run_in_threadpool(extract_text, file_bytes, file.filename)
 
-    raw = agents.generate_cards(missing_concepts, count, field_config, persona=persona)
-    parsed = parsing.smart_parse(raw, field_names)
-
-    if not parsed:
-        return {"error": "Generation failed", "raw_output": raw}
-
-    run = GenerationRun(
-        topic=topic, deck_name=dt.name, deck_type=deck_type,
-        persona=persona, total_generated=len(parsed),
-    )
-    run_id = repository.create_run(run)
-
-    saved_cards = []
-    for card_fields in parsed:
-        card_text = embeddings.card_text_for_embedding(card_fields)
-        emb = embeddings.get_embedding(card_text)
-        is_dup, reason = embeddings.is_duplicate(
-            card_fields, existing_cards, existing_embeddings, new_embedding=emb
+    @generation.timed_pipeline
+    async def work() -> dict:
+        existing_cards, existing_embeddings = await run_in_threadpool(
+            repository.get_existing_cards_with_embeddings, deck_type
         )
-
-        status = "DUPLICATE" if is_dup else "GENERATED"
-        card = Card(
-            deck_type=deck_type, fields_json=card_fields,
-            source_topic=topic, run_id=run_id, status=status,
+        existing_text = await run_in_threadpool(
+            context.select_existing_context, topic, deck_type, existing_cards, existing_embeddings
         )
-        card_id = repository.save_card(card, embedding=emb)
 
-        saved_cards.append({
-            "id": card_id,
-            "fields": card_fields,
-            "status": status,
-            "duplicate_reason": reason if is_dup else None,
-        })
+        missing_concepts, persona = await agents.analyze_knowledge_gaps_async(
+            topic, existing_text, source_text=file_text, num=count, use_cache=not no_cache
+        )
 
-        if not is_dup:
-            existing_cards.append(card_fields)
-            existing_embeddings.append(emb)
+        if stream:
+            return await run_in_threadpool(
+                generation.generate_llm_cards, topic, deck_type, dt, missing_concepts, persona, count,
+                existing_cards, existing_embeddings, stream=True, use_cache=not no_cache,
+            )
+        return await _generate_llm_cards_async(
+            topic, deck_type, dt, missing_concepts, persona, count,
+            existing_cards, existing_embeddings, use_cache=not no_cache,
+        )
 
-    return {
-        "run_id": run_id,
-        "persona": persona,
-        "gap_analysis": missing_concepts,
-        "cards": saved_cards,
-    }
+    return await _cancel_on_disconnect(request, work())
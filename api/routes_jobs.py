@@ -0,0 +1,70 @@
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+
+from core import jobs
+from storage import repository
+
+router = APIRouter(prefix="/api", tags=["jobs"])
+
+
+class JobRequest(BaseModel):
+    kind: str  # generate, generate_artist, import, export
+    params: dict = {}
+
+
+def _get_job_or_404(job_id: int):
+    job = repository.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/jobs")
+def submit_job(req: JobRequest):
+    """Queue a background job; poll GET /api/jobs/{id} for progress."""
+    try:
+        job_id = jobs.submit(req.kind, req.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"job_id": job_id, "status": jobs.QUEUED}
+
+
+@router.get("/jobs")
+def list_jobs(
+    status: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+):
+    return repository.list_jobs(status=status, kind=kind, limit=limit)
+
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    return _get_job_or_404(job_id)
+
+
+@router.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: int):
+    """Cancel a queued job, or stop a running one at its next progress update."""
+    _get_job_or_404(job_id)
+    if not repository.request_job_cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return repository.get_job(job_id)
+
+
+@router.get("/jobs/{job_id}/download")
+def download_job_result(job_id: int):
+    """Download the .apkg written by a finished export job."""
+    job = _get_job_or_404(job_id)
+    if job.kind != "export" or job.status != jobs.SUCCEEDED or not job.result:
+        raise HTTPException(status_code=409, detail="No export file for this job")
+    if not job.result.get("path"):
+        raise HTTPException(status_code=404, detail="Nothing was exported")
+    path = Path(job.result["path"])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Export file no longer exists")
+    return FileResponse(path=str(path), media_type="application/octet-stream", filename=path.name)
@@ -6,7 +6,11 @@ Usage:
     python cli.py generate "Impressionism" -n 10
     python cli.py artist "Claude Monet"
     python cli.py list
+    python cli.py search "water lilies"
+    python cli.py status
     python cli.py export
+    python cli.py worker
+    python cli.py jobs
 """
 
 import argparse
@@ -14,12 +18,12 @@ import json
 import logging
 import sys
 
-import storage.database  # triggers init_db()
-
-from core import agents, embeddings, media, parsing
+from core import (
+    agents, context, deck_registry, embeddings, generation, jobs, llm_cache, media, metrics, parsing, quota,
+)
 from core.cards import Card, GenerationRun
 from core.config import settings
-from export.genanki_export import export_cards
+from export.genanki_export import export_cards, export_cards_parts, export_delta
 from storage import repository
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
@@ -58,9 +62,9 @@ def _fetch_images_and_export(saved_cards, dt, deck_type_name, deck_name, source_
 
         found = 0
         not_found = 0
+        repository.update_cards_media({card_id: filename for card_id, (filename, _) in results.items() if filename})
         for card_id, (filename, verified) in results.items():
             if filename:
-                repository.update_card_media(card_id, image_filename=filename)
                 for card in saved_cards:
                     if card.id == card_id:
                         card.image_filename = filename
@@ -87,8 +91,7 @@ def _fetch_images_and_export(saved_cards, dt, deck_type_name, deck_name, source_
         accepted_cards = repository.get_cards(deck_type=deck_type_name, status="ACCEPTED")
         if accepted_cards:
             path = export_cards(accepted_cards, dt, deck_name=deck_name)
-            for c in accepted_cards:
-                repository.update_card_status(c.id, "EXPORTED")
+            repository.mark_cards_exported(accepted_cards)
             print(f"\nExported to: {path}")
             print("Import this file into Anki: File > Import")
         else:
@@ -146,14 +149,27 @@ def _display_and_accept_artworks(new_artworks, card_fields_list, dt, deck_type_n
 
 def cmd_generate(args):
     deck_type_name = args.deck_type
-    dt = repository.get_deck_type(deck_type_name)
+    dt = deck_registry.get_deck_type(deck_type_name)
     if not dt:
         print(f"Error: Unknown deck type '{deck_type_name}'")
         sys.exit(1)
 
+    if args.topics_file:
+        if deck_type_name == "artwork":
+            print("Error: --topics-file is for LLM decks; artwork topics are looked up on Wikidata one at a time.")
+            sys.exit(1)
+        if not settings.google_api_key:
+            print("Error: GOOGLE_API_KEY not set. Add it to your .env file.")
+            sys.exit(1)
+        _generate_batch(args, dt)
+        return
+    if not args.topic:
+        print("Error: give a topic, or --topics-file for several.")
+        sys.exit(1)
+
     # For artwork decks: use Wikidata (no LLM, no hallucinations)
     if deck_type_name == "artwork":
-        from core.wikidata import query_artworks_by_topic, artworks_to_card_fields, base_title
+        from core.wikidata import query_artworks_by_topic, artworks_to_card_fields
 
         print(f"\nSearching Wikidata for '{args.topic}'...")
         artworks = query_artworks_by_topic(args.topic, limit=args.count)
@@ -167,10 +183,11 @@ def cmd_generate(args):
         print(f"Found {len(artworks)} artworks ({with_img} with free images).")
 
         # Dedup against existing deck
-        existing_cards = repository.get_cards(deck_type=deck_type_name)
-        existing_titles = {base_title(c.fields_json.get("Title", "")) for c in existing_cards}
+        existing_titles = repository.find_existing_titles(
+            deck_type_name, [parsing.base_title(a["title"]) for a in artworks]
+        )
 
-        new_artworks = [a for a in artworks if base_title(a["title"]) not in existing_titles]
+        new_artworks = [a for a in artworks if parsing.base_title(a["title"]) not in existing_titles]
         skipped = len(artworks) - len(new_artworks)
         if skipped:
             print(f"Skipped {skipped} already in deck.")
@@ -191,13 +208,15 @@ def cmd_generate(args):
         print("Error: GOOGLE_API_KEY not set. Add it to your .env file.")
         sys.exit(1)
 
-    field_names = [f["name"] for f in dt.fields_schema]
-    field_config = {f["name"]: f["type"] for f in dt.fields_schema}
+    field_names = deck_registry.field_names(dt)
+    field_config = deck_registry.entry_for(dt).field_config
 
+    use_embeddings = not args.no_embeddings
     existing_cards, existing_embeddings = repository.get_existing_cards_with_embeddings(deck_type_name)
-    existing_text = ", ".join(c.get("Title", "") for c in existing_cards if c.get("Title"))
-    if not existing_text:
-        existing_text = "No existing cards found."
+    existing_text = context.select_existing_context(
+        args.topic, deck_type_name, existing_cards, existing_embeddings,
+        use_embeddings=use_embeddings,
+    )
 
     print(f"\nExisting cards in '{deck_type_name}': {len(existing_cards)}")
 
@@ -209,30 +228,120 @@ def cmd_generate(args):
         print(f"Loaded file: {args.file} ({len(file_text)} chars)")
 
     print(f"\nAnalyzing knowledge gaps for '{args.topic}'...")
+    use_cache = not args.no_cache
     missing_concepts, persona = agents.analyze_knowledge_gaps(
-        args.topic, existing_text, source_text=file_text, num=args.count
+        args.topic, existing_text, source_text=file_text, num=args.count, use_cache=use_cache
     )
     print(f"Persona: {persona}")
     print(f"Gap Analysis:\n{missing_concepts}\n")
 
     print(f"Generating {args.count} cards as {persona}...")
-    raw = agents.generate_cards(missing_concepts, args.count, field_config, persona=persona)
-    parsed = parsing.smart_parse(raw, field_names)
+    if args.stream:
+        parser = parsing.StreamParser(field_names)
+        parsed = parser.parse_stream(
+            agents.generate_cards_stream(
+                missing_concepts, args.count, field_config, persona=persona, use_cache=use_cache
+            )
+        )
+    else:
+        raw = agents.generate_cards(
+            missing_concepts, args.count, field_config, persona=persona, use_cache=use_cache
+        )
+        parsed, parse_stats = parsing.parse_cards(raw, field_names)
 
-    if not parsed:
+    if args.stream:
+        parse_stats = parser.stats  # filled in as _save_llm_cards consumes the stream
+    run_id, saved = _save_llm_cards(
+        parsed, args.topic, deck_type_name, dt, persona,
+        existing_cards, existing_embeddings, use_embeddings, parse_stats, echo=args.stream,
+    )
+    if run_id is None:
+        print("Generation failed. Raw output:")
+        print(parser.raw if args.stream else raw)
+        sys.exit(1)
+
+    _print_cache_stats()
+    accepted_card_objs = _review_llm_cards(saved, dt)
+    if accepted_card_objs:
+        _fetch_images_and_export(accepted_card_objs, dt, deck_type_name, args.deck_name, args.topic)
+
+
+def _generate_batch(args, dt):
+    """LLM decks: one gap-analysis call and one generation call for every topic in --topics-file."""
+    deck_type_name = dt.name
+    with open(args.topics_file, encoding="utf-8") as f:
+        topics = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    if not topics:
+        print(f"No topics found in {args.topics_file}.")
+        return
+
+    field_names = deck_registry.field_names(dt)
+    field_config = deck_registry.entry_for(dt).field_config
+    use_embeddings = not args.no_embeddings
+    use_cache = not args.no_cache
+
+    existing_cards, existing_embeddings = repository.get_existing_cards_with_embeddings(deck_type_name)
+    existing_texts = [
+        context.select_existing_context(
+            topic, deck_type_name, existing_cards, existing_embeddings, use_embeddings=use_embeddings,
+        )
+        for topic in topics
+    ]
+    print(f"\nExisting cards in '{deck_type_name}': {len(existing_cards)}")
+
+    print(f"\nAnalyzing knowledge gaps for {len(topics)} topics in one request...")
+    gaps = agents.analyze_knowledge_gaps_batch(topics, existing_texts, num=args.count, use_cache=use_cache)
+    topic_gaps = [(topic, gap, persona) for topic, (gap, persona) in zip(topics, gaps)]
+    for topic, gap, persona in topic_gaps:
+        print(f"\n[{topic}] Persona: {persona}")
+        print(gap)
+
+    print(f"\nGenerating {args.count} cards for each of {len(topics)} topics in one request...")
+    raw = agents.generate_cards_batch(topic_gaps, args.count, field_config, use_cache=use_cache)
+    sections = parsing.split_topic_sections(raw, len(topics))
+
+    saved = []
+    for i, (topic, _, persona) in enumerate(topic_gaps, 1):
+        parse_stats = parsing.new_parse_stats("pipe")
+        parsed = parsing.smart_parse(sections.get(i, ""), field_names, parse_stats)
+        run_id, topic_saved = _save_llm_cards(
+            parsed, topic, deck_type_name, dt, persona,
+            existing_cards, existing_embeddings, use_embeddings, parse_stats,
+        )
+        if run_id is None:
+            print(f"  [{topic}] no cards parsed")
+        saved.extend(topic_saved)
+
+    if not saved:
         print("Generation failed. Raw output:")
         print(raw)
         sys.exit(1)
 
-    run = GenerationRun(
-        topic=args.topic, deck_name=dt.name, deck_type=deck_type_name,
-        persona=persona, total_generated=len(parsed),
-    )
-    run_id = repository.create_run(run)
+    _print_cache_stats()
+    accepted_card_objs = _review_llm_cards(saved, dt)
+    if accepted_card_objs:
+        _fetch_images_and_export(accepted_card_objs, dt, deck_type_name, args.deck_name, "batch")
 
-    use_embeddings = not getattr(args, 'no_embeddings', False)
+
+def _save_llm_cards(parsed, topic, deck_type_name, dt, persona,
+                    existing_cards, existing_embeddings, use_embeddings, parse_stats=None, echo=False):
+    """Embed (optionally), dedup and save parsed LLM cards under a new run.
+
+    Returns (run_id, saved) where saved is a list of (Card, is_dup, reason);
+    run_id is None if nothing was parsed. Dropped/repaired rows from
+    parse_stats are recorded on the run and reported.
+    """
+    field_names = deck_registry.field_names(dt)
+    run_id = None
     saved = []
     for i, card_fields in enumerate(parsed):
+        if run_id is None:
+            run = GenerationRun(
+                topic=topic, deck_name=dt.name, deck_type=deck_type_name, persona=persona,
+            )
+            run_id = repository.create_run(run)
+            metrics.note_run(run_id)
+
         emb = None
         if use_embeddings:
             card_text = embeddings.card_text_for_embedding(card_fields)
@@ -245,16 +354,37 @@ def cmd_generate(args):
         status = "DUPLICATE" if is_dup else "GENERATED"
         card = Card(
             deck_type=deck_type_name, fields_json=card_fields,
-            source_topic=args.topic, run_id=run_id, status=status,
+            source_topic=topic, run_id=run_id, status=status,
         )
         card_id = repository.save_card(card, embedding=emb)
         card.id = card_id
         saved.append((card, is_dup, reason))
+        if echo:
+            dup_tag = " [DUPLICATE]" if is_dup else ""
+            print(f"  [{i + 1}] {card_fields.get('Title') or card_fields.get(field_names[0], '?')}{dup_tag}")
 
         if not is_dup:
             existing_cards.append(card_fields)
             existing_embeddings.append(emb)
 
+    if run_id is not None:
+        repository.update_run_generated(run_id, len(saved), parse_stats)
+    if parse_stats and (parse_stats["dropped"] or parse_stats["repaired"]):
+        print(f"  [{topic}] {parse_stats['mode']} output: {parse_stats['dropped']} rows dropped, "
+              f"{parse_stats['repaired']} repaired")
+    return run_id, saved
+
+
+def _print_cache_stats():
+    cache_stats = llm_cache.stats()
+    if cache_stats["enabled"]:
+        print(f"LLM cache: {cache_stats['session_hits']} hits, {cache_stats['session_misses']} misses "
+              f"({cache_stats['entries']} cached responses)")
+
+
+def _review_llm_cards(saved, dt):
+    """Display generated cards, let the user accept/reject, and record acceptance
+    per run. Returns the accepted Card objects."""
     print(f"\n{'='*60}")
     print(f"Generated {len(saved)} cards:\n")
 
@@ -273,7 +403,7 @@ def cmd_generate(args):
     non_dups = [(i, s) for i, s in enumerate(saved) if not s[1]]
     if not non_dups:
         print("All cards are duplicates. Nothing to accept.")
-        return
+        return []
 
     print(f"{len(non_dups)} non-duplicate cards available.")
     answer = input("Accept all? [Y/n/pick] ").strip().lower()
@@ -288,21 +418,19 @@ def cmd_generate(args):
                 accepted_ids.append(card.id)
     else:
         print("No cards accepted.")
-        return
+        return []
 
+    accepted_per_run = {card.run_id: 0 for card, _, _ in saved}
+    repository.update_cards_status(accepted_ids, "ACCEPTED")
     for card, is_dup, _ in saved:
         if card.id in accepted_ids:
-            repository.update_card_status(card.id, "ACCEPTED")
+            accepted_per_run[card.run_id] += 1
 
-    accepted_count = len(accepted_ids)
-    repository.update_run_accepted(run_id, accepted_count)
-    print(f"\nAccepted {accepted_count} cards.")
-
-    if accepted_count == 0:
-        return
+    for run_id, accepted_count in accepted_per_run.items():
+        repository.update_run_accepted(run_id, accepted_count)
+    print(f"\nAccepted {len(accepted_ids)} cards.")
 
-    accepted_card_objs = [card for card, is_dup, _ in saved if card.id in accepted_ids]
-    _fetch_images_and_export(accepted_card_objs, dt, deck_type_name, args.deck_name, args.topic)
+    return [card for card, is_dup, _ in saved if card.id in accepted_ids]
 
 
 def cmd_list(args):
@@ -320,6 +448,47 @@ def cmd_list(args):
         print()
 
 
+def cmd_search(args):
+    offset = (args.page - 1) * args.limit
+    cards = repository.search_cards(
+        args.query, deck_type=args.deck_type, status=args.status,
+        limit=args.limit, offset=offset,
+    )
+    if not cards:
+        print("No matching cards.")
+        return
+
+    print(f"\nResults {offset + 1}-{offset + len(cards)} for '{args.query}':\n")
+    for card in cards:
+        print(f"  [{card.id}] ({card.status}) {card.fields_json.get('Title', card.fields_json.get('Topic', '?'))}")
+        print(f"       Artist: {card.fields_json.get('Artist', '-')}")
+        movement = card.fields_json.get("Period/Movement")
+        if movement:
+            print(f"       Movement: {movement}")
+        print()
+    if len(cards) == args.limit:
+        print(f"More results: --page {args.page + 1}")
+
+
+def cmd_status(args):
+    """Show remaining Gemini quota and response-cache stats."""
+    status = quota.QUOTA.status()
+    print(f"\nGemini quota for {status['day']} (resets at midnight Pacific):\n")
+    for kind, label in ((quota.LLM, "LLM"), (quota.EMBEDDING, "Embeddings")):
+        q = status[kind]
+        limit = q["rpd_limit"] or "unlimited"
+        remaining = q["rpd_remaining"] if q["rpd_remaining"] is not None else "unlimited"
+        print(f"  {label}: {q['requests_today']}/{limit} requests today, {remaining} remaining")
+        print(f"       ~{q['tokens_today']} tokens today; "
+              f"{q['rpm_available'] if q['rpm_available'] is not None else 'unlimited'} requests available this minute")
+        if q["paused_for_seconds"]:
+            print(f"       Paused for {q['paused_for_seconds']}s after a rate limit")
+
+    cache_stats = llm_cache.stats()
+    state = "enabled" if cache_stats["enabled"] else "disabled (set LLM_CACHE_ENABLED=true)"
+    print(f"\n  LLM cache: {state}, {cache_stats['entries']} responses, {cache_stats['total_hits']} hits all-time")
+
+
 def cmd_import(args):
     from core.apkg_import import import_apkg
 
@@ -328,6 +497,10 @@ def cmd_import(args):
         args.file,
         deck_type=args.deck_type,
         compute_embeddings=not args.no_embeddings,
+        incremental=args.incremental,
+        with_media=not args.no_media,
+        batch_size=args.batch_size,
+        workers=args.workers,
     )
     if "error" in stats:
         print(f"Error: {stats['error']}")
@@ -336,10 +509,10 @@ def cmd_import(args):
 
 def cmd_artist(args):
     """Look up an artist's real paintings on Wikidata and create cards."""
-    from core.wikidata import query_artist_artworks, artworks_to_card_fields, base_title
+    from core.wikidata import query_artist_artworks, artworks_to_card_fields
 
     deck_type_name = args.deck_type
-    dt = repository.get_deck_type(deck_type_name)
+    dt = deck_registry.get_deck_type(deck_type_name)
     if not dt:
         print(f"Error: Unknown deck type '{deck_type_name}'")
         sys.exit(1)
@@ -360,10 +533,11 @@ def cmd_artist(args):
         print(f"Showing first {args.limit}.")
 
     # Dedup against existing deck (fuzzy title match)
-    existing_cards = repository.get_cards(deck_type=deck_type_name)
-    existing_titles = {base_title(c.fields_json.get("Title", "")) for c in existing_cards}
+    existing_titles = repository.find_existing_titles(
+        deck_type_name, [parsing.base_title(a["title"]) for a in artworks]
+    )
 
-    new_artworks = [a for a in artworks if base_title(a["title"]) not in existing_titles]
+    new_artworks = [a for a in artworks if parsing.base_title(a["title"]) not in existing_titles]
     skipped = len(artworks) - len(new_artworks)
     if skipped:
         print(f"Skipped {skipped} already in deck.")
@@ -409,21 +583,74 @@ def cmd_repair_ids(args):
 
 
 def cmd_export(args):
-    dt = repository.get_deck_type(args.deck_type)
+    dt = deck_registry.get_deck_type(args.deck_type)
     if not dt:
         print(f"Error: Unknown deck type '{args.deck_type}'")
         sys.exit(1)
 
-    status = args.status or "ACCEPTED"
-    cards = repository.get_cards(deck_type=args.deck_type, status=status)
-    if not cards:
-        print(f"No {status} cards to export.")
+    if args.delta:
+        path, cards = export_delta(dt, deck_name=args.deck_name, refetch_missing=args.refetch_missing)
+        if not cards:
+            print("Nothing accepted or edited since the last export.")
+            return
+    else:
+        status = args.status or "ACCEPTED"
+        cards = repository.get_cards(deck_type=args.deck_type, status=status)
+        if not cards:
+            print(f"No {status} cards to export.")
+            return
+        max_part_bytes = int(args.max_part_mb * 1024 * 1024) if args.max_part_mb else None
+        paths, manifest = export_cards_parts(
+            cards, dt, deck_name=args.deck_name, max_part_bytes=max_part_bytes,
+            refetch_missing=args.refetch_missing,
+        )
+        path = ", ".join(str(p) for p in paths)
+        print(f"Media: {manifest['unique_files']} files ({manifest['bytes'] / 1e6:.1f} MB), "
+              f"{manifest['duplicates']} duplicates merged, {manifest['refetched']} re-fetched")
+        if manifest["missing_cards"]:
+            print(f"Warning: {len(manifest['missing_cards'])} cards have no usable image: "
+                  f"{', '.join(str(i) for i in manifest['missing_cards'][:20])}")
+
+    repository.mark_cards_exported(cards)
+    print(f"Exported {len(cards)} cards to: {path}")
+
+
+def cmd_worker(args):
+    """Run background jobs queued by the API server (set JOB_WORKERS=0 there)."""
+    pool = jobs.WorkerPool(args.workers)
+    pool.start()
+    print(f"Worker running with {args.workers} threads (job kinds: {', '.join(jobs.kinds())}). Ctrl+C to stop.")
+    try:
+        pool.wait()
+    except KeyboardInterrupt:
+        print("\nStopping; running jobs will be requeued if they don't finish.")
+        pool.stop()
+
+
+def cmd_jobs(args):
+    """List recent background jobs, or cancel one."""
+    if args.cancel:
+        if repository.request_job_cancel(args.cancel):
+            print(f"Cancellation requested for job {args.cancel}.")
+        else:
+            print(f"Job {args.cancel} not found or already finished.")
         return
 
-    path = export_cards(cards, dt, deck_name=args.deck_name)
-    for c in cards:
-        repository.update_card_status(c.id, "EXPORTED")
-    print(f"Exported {len(cards)} cards to: {path}")
+    job_list = repository.list_jobs(status=args.status, limit=args.limit)
+    if not job_list:
+        print("No jobs.")
+        return
+    for job in job_list:
+        progress = f"{job.progress_done}/{job.progress_total}" if job.progress_total else ""
+        detail = job.error or job.progress_message or ""
+        print(f"  #{job.id:<5} {job.kind:<16} {job.status:<10} {progress:<9} {detail[:60]}")
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
 
 
 def main():
@@ -433,24 +660,46 @@ def main():
     # generate
     gen = subparsers.add_parser("generate", aliases=["gen"],
         help="Generate cards (artwork: Wikidata, other: LLM)")
-    gen.add_argument("topic", help="Topic, movement, museum, or period (e.g. 'Impressionism', 'Louvre', '1800s')")
+    gen.add_argument("topic", nargs="?",
+        help="Topic, movement, museum, or period (e.g. 'Impressionism', 'Louvre', '1800s')")
+    gen.add_argument("--topics-file",
+        help="File with one topic per line: all topics in 2 LLM calls total (LLM decks only)")
     gen.add_argument("--count", "-n", type=int, default=30, help="Max results (default: 30)")
     gen.add_argument("--file", "-f", help="Source file (PDF/TXT) for context (LLM only)")
     gen.add_argument("--deck-type", "-t", default="artwork", help="Deck type (default: artwork)")
     gen.add_argument("--deck-name", "-d", default="Great Works of Art", help="Deck name in Anki")
     gen.add_argument("--audio-lang", default="en", help="Audio language (default: en)")
     gen.add_argument("--no-embeddings", action="store_true", help="Skip embedding API calls (LLM only)")
+    gen.add_argument("--no-cache", action="store_true", help="Bypass the LLM response cache (LLM only)")
+    gen.add_argument("--stream", action="store_true",
+                     help="Stream generation and save each card as it arrives (LLM only)")
 
     # list
     ls = subparsers.add_parser("list", aliases=["ls"], help="List generated cards")
     ls.add_argument("--deck-type", "-t", default="artwork")
     ls.add_argument("--status", "-s", help="Filter by status")
 
+    # search
+    srch = subparsers.add_parser("search", help="Full-text search over card fields")
+    srch.add_argument("query", help="Words to match in Title, Artist, Movement, Location or Note")
+    srch.add_argument("--deck-type", "-t", default="artwork")
+    srch.add_argument("--status", "-s", help="Filter by status")
+    srch.add_argument("--limit", "-n", type=int, default=20, help="Results per page (default: 20)")
+    srch.add_argument("--page", "-p", type=int, default=1, help="Page number (default: 1)")
+
+    # status
+    subparsers.add_parser("status", help="Show remaining Gemini quota and cache stats")
+
     # import
     imp = subparsers.add_parser("import", help="Import existing .apkg for dedup awareness")
     imp.add_argument("file", help="Path to .apkg file")
     imp.add_argument("--deck-type", "-t", default="artwork")
     imp.add_argument("--no-embeddings", action="store_true", help="Skip embedding computation")
+    imp.add_argument("--incremental", action="store_true",
+                     help="Only read notes changed since the last import; mark removed notes DELETED")
+    imp.add_argument("--no-media", action="store_true", help="Don't copy the deck's images into data/media")
+    imp.add_argument("--batch-size", type=_positive_int, default=100, help="Notes per embedding request and insert (default: 100)")
+    imp.add_argument("--workers", "-w", type=_positive_int, default=2, help="Embedding batches in flight at once (default: 2)")
 
     # artist (Wikidata lookup)
     art = subparsers.add_parser("artist", help="Look up real paintings by artist name (via Wikidata)")
@@ -475,13 +724,34 @@ def main():
     exp.add_argument("--deck-type", "-t", default="artwork")
     exp.add_argument("--deck-name", "-d", default="Great Works of Art")
     exp.add_argument("--status", "-s", default="ACCEPTED", help="Status to export (default: ACCEPTED)")
+    exp.add_argument("--delta", action="store_true",
+                     help="Only cards accepted, or edited since they were exported")
+    exp.add_argument("--max-part-mb", type=float, default=None,
+                     help="Split into several .apkg files of about this size (notes + media)")
+    exp.add_argument("--refetch-missing", action="store_true",
+                     help="Re-download images whose file is missing from data/media")
+
+    # worker
+    wrk = subparsers.add_parser("worker", help="Run queued background jobs (generation, import, export)")
+    wrk.add_argument("--workers", "-w", type=_positive_int, default=2, help="Worker threads (default: 2)")
+
+    # jobs
+    jbs = subparsers.add_parser("jobs", help="List background jobs")
+    jbs.add_argument("--status", "-s", help="Filter by status (QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED)")
+    jbs.add_argument("--limit", "-n", type=int, default=20)
+    jbs.add_argument("--cancel", type=int, metavar="JOB_ID", help="Cancel a queued or running job")
 
     args = parser.parse_args()
 
     if args.command in ("generate", "gen"):
-        cmd_generate(args)
+        with generation.run_timings():
+            cmd_generate(args)
     elif args.command in ("list", "ls"):
         cmd_list(args)
+    elif args.command == "search":
+        cmd_search(args)
+    elif args.command == "status":
+        cmd_status(args)
     elif args.command == "import":
         cmd_import(args)
     elif args.command == "artist":
@@ -492,6 +762,10 @@ def main():
         cmd_repair_ids(args)
     elif args.command == "export":
         cmd_export(args)
+    elif args.command == "worker":
+        cmd_worker(args)
+    elif args.command == "jobs":
+        cmd_jobs(args)
     else:
         parser.print_help()
 
@@ -1,62 +1,146 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
-import time
+from typing import Iterator
 
 from google import genai
+from core import llm_cache, metrics, parsing, quota
 from core.config import settings
+from core.gemini import get_client
 
 logger = logging.getLogger(__name__)
 
-_client = None
 
+def _cached_response(prompt: str, use_cache: bool, config: dict | None = None) -> tuple[str | None, str | None]:
+    """Return (cache_key, cached_text). cache_key is None when caching is off."""
+    if not llm_cache.is_enabled(use_cache):
+        return None, None
+    key = llm_cache.cache_key(settings.gemini_model, prompt, config)
+    cached = llm_cache.lookup(key)
+    if cached is not None:
+        logger.info("LLM cache hit (%s...)", key[:12])
+    return key, cached
+
+
+def _generate_with_retry(
+    client: genai.Client,
+    prompt: str,
+    max_retries: int = 3,
+    use_cache: bool = True,
+    priority: int = quota.PRIORITY_INTERACTIVE,
+    config: dict | None = None,
+) -> str:
+    """Generate content with automatic retry on rate limits.
+    config is passed through as the GenerateContentConfig (e.g. a response schema)."""
+    key, cached = _cached_response(prompt, use_cache, config)
+    if cached is not None:
+        return cached
 
-def _get_client() -> genai.Client | None:
-    global _client
-    if not settings.google_api_key:
-        return None
-    if _client is None:
-        _client = genai.Client(api_key=settings.google_api_key)
-    return _client
+    for attempt in range(max_retries):
+        quota.QUOTA.acquire(quota.LLM, tokens=quota.estimate_tokens(prompt), priority=priority)
+        try:
+            response = client.models.generate_content(
+                model=settings.gemini_model, contents=prompt, config=config
+            )
+            if key and response.text:
+                llm_cache.store(key, settings.gemini_model, response.text)
+            return response.text
+        except Exception as e:
+            wait = _rate_limit_wait(str(e), attempt)
+            if wait is None:
+                raise
+            logger.info("Rate limited. Waiting %ds before retry %d/%d...", wait, attempt + 1, max_retries)
+            print(f"  Rate limited. Waiting {wait}s before retry {attempt + 1}/{max_retries}...")
+            # Pause every LLM caller, not just this thread; the next acquire() waits it out
+            quota.QUOTA.backoff(quota.LLM, wait)
+    raise Exception("Max retries exceeded due to rate limiting")
 
 
-def _generate_with_retry(client: genai.Client, prompt: str, max_retries: int = 3) -> str:
-    """Generate content with automatic retry on rate limits."""
+async def _generate_with_retry_async(
+    client: genai.Client,
+    prompt: str,
+    max_retries: int = 3,
+    use_cache: bool = True,
+    priority: int = quota.PRIORITY_INTERACTIVE,
+    config: dict | None = None,
+) -> str:
+    """_generate_with_retry on the client's asyncio interface. Cancelling the
+    awaiting task abandons the request (and its place in the quota queue)."""
+    key, cached = await asyncio.to_thread(_cached_response, prompt, use_cache, config)
+    if cached is not None:
+        return cached
+
     for attempt in range(max_retries):
+        await quota.QUOTA.acquire_async(quota.LLM, tokens=quota.estimate_tokens(prompt), priority=priority)
         try:
-            response = client.models.generate_content(
-                model=settings.gemini_model, contents=prompt
+            response = await client.aio.models.generate_content(
+                model=settings.gemini_model, contents=prompt, config=config
             )
+            if key and response.text:
+                await asyncio.to_thread(llm_cache.store, key, settings.gemini_model, response.text)
             return response.text
         except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "RESOURCE_EXHAUSTED" in error_str:
-                match = re.search(r"retryDelay.*?(\d+)s", error_str)
-                wait = int(match.group(1)) + 2 if match else 30 * (attempt + 1)
-                logger.info("Rate limited. Waiting %ds before retry %d/%d...", wait, attempt + 1, max_retries)
-                print(f"  Rate limited. Waiting {wait}s before retry {attempt + 1}/{max_retries}...")
-                time.sleep(wait)
-            else:
+            wait = _rate_limit_wait(str(e), attempt)
+            if wait is None:
                 raise
+            logger.info("Rate limited. Waiting %ds before retry %d/%d...", wait, attempt + 1, max_retries)
+            quota.QUOTA.backoff(quota.LLM, wait)
     raise Exception("Max retries exceeded due to rate limiting")
 
 
-def analyze_knowledge_gaps(
-    topic: str,
-    existing_cards_text: str,
-    source_text: str | None = None,
-    num: int = 3,
-) -> tuple[str, str]:
-    """
-    Combined Agent 0+1: Identifies expert persona AND analyzes gaps in a single call.
-    Returns (gap_analysis, persona).
-    Saves 1 API call vs the previous 2-call approach.
+def _rate_limit_wait(error_str: str, attempt: int) -> int | None:
+    """Seconds to wait before retrying a rate-limited call, or None if it wasn't a rate limit."""
+    if "429" not in error_str and "RESOURCE_EXHAUSTED" not in error_str:
+        return None
+    match = re.search(r"retryDelay.*?(\d+)s", error_str)
+    return int(match.group(1)) + 2 if match else 30 * (attempt + 1)
+
+
+def _generate_stream_with_retry(
+    client: genai.Client,
+    prompt: str,
+    max_retries: int = 3,
+    use_cache: bool = True,
+    priority: int = quota.PRIORITY_INTERACTIVE,
+) -> Iterator[str]:
+    """Stream generated text chunks, retrying on rate limits.
+
+    A retry is only possible before the first chunk arrives; once text has
+    been yielded the caller may already have acted on it. Cache hits are
+    yielded as a single chunk.
     """
-    client = _get_client()
-    if not client:
-        return "Error: No API Key", "Expert"
+    key, cached = _cached_response(prompt, use_cache)
+    if cached is not None:
+        yield cached
+        return
 
+    for attempt in range(max_retries):
+        quota.QUOTA.acquire(quota.LLM, tokens=quota.estimate_tokens(prompt), priority=priority)
+        parts = []
+        try:
+            for chunk in client.models.generate_content_stream(
+                model=settings.gemini_model, contents=prompt
+            ):
+                if chunk.text:
+                    parts.append(chunk.text)
+                    yield chunk.text
+            if key and parts:
+                llm_cache.store(key, settings.gemini_model, "".join(parts))
+            return
+        except Exception as e:
+            wait = _rate_limit_wait(str(e), attempt)
+            if parts or wait is None:
+                raise
+            logger.info("Rate limited. Waiting %ds before retry %d/%d...", wait, attempt + 1, max_retries)
+            print(f"  Rate limited. Waiting {wait}s before retry {attempt + 1}/{max_retries}...")
+            # Pause every LLM caller, not just this thread; the next acquire() waits it out
+            quota.QUOTA.backoff(quota.LLM, wait)
+    raise Exception("Max retries exceeded due to rate limiting")
+
+
+def _gap_analysis_prompt(topic: str, existing_cards_text: str, source_text: str | None, num: int) -> str:
     if source_text:
         prompt = f"""
         You are an expert educator. First, determine the best expert persona for this topic,
@@ -113,39 +197,156 @@ def analyze_knowledge_gaps(
         PERSONA: [Job Title]
         [Bulleted list of {num} missing concepts]
         """
+    return prompt
+
+
+@metrics.timed("llm", call="gap_analysis")
+def analyze_knowledge_gaps(
+    topic: str,
+    existing_cards_text: str,
+    source_text: str | None = None,
+    num: int = 3,
+    use_cache: bool = True,
+) -> tuple[str, str]:
+    """
+    Combined Agent 0+1: Identifies expert persona AND analyzes gaps in a single call.
+    Returns (gap_analysis, persona).
+    Saves 1 API call vs the previous 2-call approach.
+    """
+    client = get_client()
+    if not client:
+        return "Error: No API Key", "Expert"
 
+    prompt = _gap_analysis_prompt(topic, existing_cards_text, source_text, num)
     try:
-        raw = _generate_with_retry(client, prompt).strip()
-
-        # Parse persona from first line
-        persona = "Expert Tutor"
-        lines = raw.split("\n", 1)
-        first_line = lines[0].strip()
-        if first_line.upper().startswith("PERSONA:"):
-            persona = first_line.split(":", 1)[1].strip().strip("*").strip()
-            gap_analysis = lines[1].strip() if len(lines) > 1 else raw
-        else:
-            gap_analysis = raw
+        raw = _generate_with_retry(client, prompt, use_cache=use_cache).strip()
+        return _split_persona(raw)
+    except Exception as e:
+        return f"Error analyzing gaps: {e}", "Expert"
 
-        return gap_analysis, persona
+
+@metrics.timed("llm", call="gap_analysis")
+async def analyze_knowledge_gaps_async(
+    topic: str,
+    existing_cards_text: str,
+    source_text: str | None = None,
+    num: int = 3,
+    use_cache: bool = True,
+) -> tuple[str, str]:
+    """analyze_knowledge_gaps for async callers; cancellable."""
+    client = get_client()
+    if not client:
+        return "Error: No API Key", "Expert"
+
+    prompt = _gap_analysis_prompt(topic, existing_cards_text, source_text, num)
+    try:
+        raw = (await _generate_with_retry_async(client, prompt, use_cache=use_cache)).strip()
+        return _split_persona(raw)
     except Exception as e:
         return f"Error analyzing gaps: {e}", "Expert"
 
 
-def generate_cards(
-    missing_concepts: str,
-    num: int,
-    field_config: dict[str, str],
-    persona: str = "Expert Tutor",
-) -> str:
-    """Agent 2: The Content Creator. Returns raw pipe-separated card text."""
-    client = _get_client()
+def _split_persona(raw: str) -> tuple[str, str]:
+    """Parse the "PERSONA: ..." first line off a gap analysis. Returns (gap_analysis, persona)."""
+    persona = "Expert Tutor"
+    lines = raw.split("\n", 1)
+    first_line = lines[0].strip()
+    if first_line.upper().startswith("PERSONA:"):
+        persona = first_line.split(":", 1)[1].strip().strip("*").strip()
+        gap_analysis = lines[1].strip() if len(lines) > 1 else raw
+    else:
+        gap_analysis = raw
+    return gap_analysis, persona
+
+
+@metrics.timed("llm", call="gap_analysis_batch")
+def analyze_knowledge_gaps_batch(
+    topics: list[str],
+    existing_cards_texts: list[str],
+    num: int = 3,
+    use_cache: bool = True,
+) -> list[tuple[str, str]]:
+    """
+    Agent 0+1 for several topics in ONE call: a persona and gap analysis per topic.
+    existing_cards_texts[i] is the existing-cards context for topics[i].
+    Returns [(gap_analysis, persona), ...] in topic order.
+    """
+    client = get_client()
     if not client:
-        return "Error: No API Key"
+        return [("Error: No API Key", "Expert")] * len(topics)
+
+    prompt = _gap_analysis_batch_prompt(topics, existing_cards_texts, num)
+    try:
+        raw = _generate_with_retry(client, prompt, use_cache=use_cache)
+    except Exception as e:
+        return [(f"Error analyzing gaps: {e}", "Expert")] * len(topics)
+    return _split_batch_gaps(raw, len(topics))
+
+
+@metrics.timed("llm", call="gap_analysis_batch")
+async def analyze_knowledge_gaps_batch_async(
+    topics: list[str],
+    existing_cards_texts: list[str],
+    num: int = 3,
+    use_cache: bool = True,
+) -> list[tuple[str, str]]:
+    """analyze_knowledge_gaps_batch for async callers; cancellable."""
+    client = get_client()
+    if not client:
+        return [("Error: No API Key", "Expert")] * len(topics)
+
+    prompt = _gap_analysis_batch_prompt(topics, existing_cards_texts, num)
+    try:
+        raw = await _generate_with_retry_async(client, prompt, use_cache=use_cache)
+    except Exception as e:
+        return [(f"Error analyzing gaps: {e}", "Expert")] * len(topics)
+    return _split_batch_gaps(raw, len(topics))
+
+
+def _gap_analysis_batch_prompt(topics: list[str], existing_cards_texts: list[str], num: int) -> str:
+    sections = "\n".join(
+        f"""
+        {parsing.topic_marker(i)}
+        TOPIC: "{topic}"
+        THE USER ALREADY KNOWS:
+        '''
+        {existing}
+        '''
+        """
+        for i, (topic, existing) in enumerate(zip(topics, existing_cards_texts), 1)
+    )
+    prompt = f"""
+        You are an expert educator. For EACH of the {len(topics)} topics below, determine the best
+        expert persona for that topic, then perform a gap analysis AS that persona.
+        {sections}
+        TASK (for each topic separately):
+        1. State your chosen expert persona (e.g., "PERSONA: Art History Professor")
+        2. Then: Identify {num} SPECIFIC "Knowledge Gaps" or new examples (e.g. Artworks)
+           missing from the user's knowledge of that topic.
+
+        RULES:
+        1. Suggest advanced angles, edge cases, or comparisons specific to each field.
+        2. Do NOT repeat what the user already knows.
+        3. Start each topic's answer with its marker line exactly as given (e.g. "{parsing.topic_marker(1)}").
+
+        OUTPUT FORMAT (repeat for every topic, in order):
+        {parsing.topic_marker(1)}
+        PERSONA: [Job Title]
+        [Bulleted list of {num} missing concepts]
+        """
+    return prompt
+
+
+def _split_batch_gaps(raw: str, num_topics: int) -> list[tuple[str, str]]:
+    sections_by_topic = parsing.split_topic_sections(raw, num_topics)
+    results = []
+    for i in range(1, num_topics + 1):
+        section = sections_by_topic.get(i, "").strip()
+        results.append(_split_persona(section) if section else ("Error: topic missing from batch response", "Expert"))
+    return results
 
-    fields_list = list(field_config.keys())
-    structure_example = "|".join(f"{f}" for f in fields_list)
 
+def _field_instructions(field_config: dict[str, str]) -> list[str]:
     field_instructions = []
     for i, (f, f_type) in enumerate(field_config.items(), 1):
         if f_type == "Image":
@@ -154,6 +355,64 @@ def generate_cards(
             field_instructions.append(f"  {i}. {f}: LEAVE EMPTY (just put nothing)")
         else:
             field_instructions.append(f"  {i}. {f}: Plain text")
+    return field_instructions
+
+
+def _card_response_schema(field_config: dict[str, str]) -> dict:
+    """Gemini response schema for structured output: an array of card
+    objects with one string property per deck field, in deck order."""
+    descriptions = {"Image": "2-3 word image search query (NO URLs)", "(Skip)": "Leave empty"}
+    fields_list = list(field_config.keys())
+    return {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": {
+                f: {"type": "STRING", "description": descriptions.get(f_type, "Plain text")}
+                for f, f_type in field_config.items()
+            },
+            "required": fields_list,
+            "property_ordering": fields_list,
+        },
+    }
+
+
+def _build_structured_generation_prompt(
+    missing_concepts: str,
+    num: int,
+    field_config: dict[str, str],
+    persona: str,
+) -> str:
+    fields_list = list(field_config.keys())
+    field_instructions = _field_instructions(field_config)
+
+    return f"""
+    You are a strict {persona}.
+
+    TASK: Generate {num} Anki cards based on these MISSING CONCEPTS:
+    '''
+    {missing_concepts}
+    '''
+
+    Return a JSON array of exactly {num} card objects. Each object has these {len(fields_list)} string fields:
+{chr(10).join(field_instructions)}
+
+    RULES:
+    1. Every field is a plain string; use "" for empty/skip fields.
+    2. For the 'Artist' field, ALWAYS provide FULL first and last name (e.g., 'Vincent van Gogh').
+    3. Write as a {persona} would.
+    """
+
+
+def _build_generation_prompt(
+    missing_concepts: str,
+    num: int,
+    field_config: dict[str, str],
+    persona: str,
+) -> str:
+    fields_list = list(field_config.keys())
+    structure_example = "|".join(f"{f}" for f in fields_list)
+    field_instructions = _field_instructions(field_config)
 
     prompt = f"""
     You are a strict {persona}.
@@ -179,8 +438,177 @@ def generate_cards(
 
     Output only the raw text lines, exactly {num} lines.
     """
+    return prompt
+
+
+@metrics.timed("llm", call="generate_cards")
+def generate_cards(
+    missing_concepts: str,
+    num: int,
+    field_config: dict[str, str],
+    persona: str = "Expert Tutor",
+    use_cache: bool = True,
+    structured: bool | None = None,
+) -> str:
+    """Agent 2: The Content Creator. Returns the raw card text for parsing.parse_cards.
+
+    structured=True (default: settings.structured_output) asks Gemini for a
+    JSON array constrained by a response schema built from the deck fields,
+    so a "|" or a missing field can't shift a row; otherwise the reply is
+    pipe-separated lines.
+    """
+    client = get_client()
+    if not client:
+        return "Error: No API Key"
+
+    prompt, config = _generation_request(missing_concepts, num, field_config, persona, structured)
+    try:
+        return _generate_with_retry(client, prompt, use_cache=use_cache, config=config)
+    except Exception as e:
+        return f"Error: {e}"
+
+
+@metrics.timed("llm", call="generate_cards")
+async def generate_cards_async(
+    missing_concepts: str,
+    num: int,
+    field_config: dict[str, str],
+    persona: str = "Expert Tutor",
+    use_cache: bool = True,
+    structured: bool | None = None,
+) -> str:
+    """generate_cards for async callers; cancellable."""
+    client = get_client()
+    if not client:
+        return "Error: No API Key"
+
+    prompt, config = _generation_request(missing_concepts, num, field_config, persona, structured)
+    try:
+        return await _generate_with_retry_async(client, prompt, use_cache=use_cache, config=config)
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def _generation_request(
+    missing_concepts: str,
+    num: int,
+    field_config: dict[str, str],
+    persona: str,
+    structured: bool | None,
+) -> tuple[str, dict | None]:
+    """(prompt, generation config) for Agent 2 in JSON or pipe format."""
+    if structured is None:
+        structured = settings.structured_output
+    if not structured:
+        return _build_generation_prompt(missing_concepts, num, field_config, persona), None
+    prompt = _build_structured_generation_prompt(missing_concepts, num, field_config, persona)
+    config = {
+        "response_mime_type": "application/json",
+        "response_schema": _card_response_schema(field_config),
+    }
+    return prompt, config
+
+
+@metrics.timed("llm", call="generate_cards")
+def generate_cards_stream(
+    missing_concepts: str,
+    num: int,
+    field_config: dict[str, str],
+    persona: str = "Expert Tutor",
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """Agent 2, streaming: yields raw pipe-separated text as Gemini produces it.
+    Feed the chunks to parsing.StreamParser to get cards as each line completes.
+    Errors are yielded as a final "Error: ..." chunk, like generate_cards returns."""
+    client = get_client()
+    if not client:
+        yield "Error: No API Key"
+        return
+
+    prompt = _build_generation_prompt(missing_concepts, num, field_config, persona)
+    try:
+        yield from _generate_stream_with_retry(client, prompt, use_cache=use_cache)
+    except Exception as e:
+        yield f"\nError: {e}"
+
+
+@metrics.timed("llm", call="generate_cards_batch")
+def generate_cards_batch(
+    topic_gaps: list[tuple[str, str, str]],
+    num: int,
+    field_config: dict[str, str],
+    use_cache: bool = True,
+) -> str:
+    """
+    Agent 2 for several topics in ONE call.
+    topic_gaps: [(topic, missing_concepts, persona), ...]
+    Returns raw text with one marker-delimited section of pipe-separated
+    lines per topic; split it with parsing.split_topic_sections.
+    """
+    client = get_client()
+    if not client:
+        return "Error: No API Key"
 
+    prompt = _generation_batch_prompt(topic_gaps, num, field_config)
     try:
-        return _generate_with_retry(client, prompt)
+        return _generate_with_retry(client, prompt, use_cache=use_cache)
     except Exception as e:
         return f"Error: {e}"
+
+
+@metrics.timed("llm", call="generate_cards_batch")
+async def generate_cards_batch_async(
+    topic_gaps: list[tuple[str, str, str]],
+    num: int,
+    field_config: dict[str, str],
+    use_cache: bool = True,
+) -> str:
+    """generate_cards_batch for async callers; cancellable."""
+    client = get_client()
+    if not client:
+        return "Error: No API Key"
+
+    prompt = _generation_batch_prompt(topic_gaps, num, field_config)
+    try:
+        return await _generate_with_retry_async(client, prompt, use_cache=use_cache)
+    except Exception as e:
+        return f"Error: {e}"
+
+
+def _generation_batch_prompt(topic_gaps: list[tuple[str, str, str]], num: int, field_config: dict[str, str]) -> str:
+    fields_list = list(field_config.keys())
+    structure_example = "|".join(fields_list)
+    field_instructions = _field_instructions(field_config)
+    sections = "\n".join(
+        f"""
+    {parsing.topic_marker(i)}
+    TOPIC: "{topic}" — write these cards as a strict {persona}.
+    MISSING CONCEPTS:
+    '''
+    {missing_concepts}
+    '''
+    """
+        for i, (topic, missing_concepts, persona) in enumerate(topic_gaps, 1)
+    )
+
+    prompt = f"""
+    TASK: For EACH of the {len(topic_gaps)} topics below, generate {num} Anki cards based on that
+    topic's MISSING CONCEPTS, written by that topic's expert.
+    {sections}
+    STRICT FORMAT — each card line must have EXACTLY {len(fields_list)} fields separated by {len(fields_list)-1} pipe characters "|":
+    {structure_example}
+
+    FIELD DEFINITIONS (you MUST include ALL {len(fields_list)} fields in order):
+{chr(10).join(field_instructions)}
+
+    RULES:
+    1. Start each topic's cards with its marker line exactly as given (e.g. "{parsing.topic_marker(1)}").
+    2. Under each marker output raw card lines ONLY — no numbering, no bullets, no markdown.
+    3. Each line MUST have exactly {len(fields_list)-1} pipe "|" characters.
+    4. For the 'Artist' field, ALWAYS provide FULL first and last name (e.g., 'Vincent van Gogh').
+    5. DO NOT use the pipe character "|" inside any field value.
+    6. Empty/skip fields still need their pipe separator (e.g., "...||..." for an empty field between two others).
+
+    Output only the marker lines and raw card lines, exactly {num} card lines per topic.
+    """
+    return prompt
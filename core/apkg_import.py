@@ -1,15 +1,26 @@
 """Import cards from an existing .apkg file into the SQLite database for dedup awareness."""
 from __future__ import annotations
 
+import hashlib
+import html
 import json
 import logging
+import os
+import re
 import sqlite3
 import tempfile
+import threading
 import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, Iterator
+from urllib.parse import unquote
 
 from core.cards import Card
-from core import embeddings
+from core import deck_registry, embeddings, metrics, quota
+from core.config import MEDIA_DIR, settings
 from storage import repository
 
 logger = logging.getLogger(__name__)
@@ -18,33 +29,323 @@ logger = logging.getLogger(__name__)
 ANKI_FIELD_SEP = chr(0x1F)
 
 
-def _open_apkg_db(apkg_path: str) -> tuple[sqlite3.Connection, Path]:
-    """Extract and open the SQLite database from an .apkg file.
-    Handles both legacy (.anki2) and modern zstd-compressed (.anki21b) formats.
-    """
-    tmpdir = Path(tempfile.mkdtemp())
-    with zipfile.ZipFile(apkg_path, "r") as z:
-        z.extractall(tmpdir)
+# Collection databases up to this size are opened in memory (Python 3.11+);
+# larger ones are streamed to a single temp file
+IN_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+_CHUNK_BYTES = 1024 * 1024
 
-    # Try modern format first (zstd compressed)
-    anki21b = tmpdir / "collection.anki21b"
-    if anki21b.exists():
+
+def _collection_member(z: zipfile.ZipFile) -> str:
+    """Pick the collection database inside an .apkg, newest format first."""
+    names = set(z.namelist())
+    if "collection.anki21b" in names:
         try:
-            import zstandard
-            decompressed = tmpdir / "collection_decompressed.db"
-            dctx = zstandard.ZstdDecompressor()
-            with open(anki21b, "rb") as fin, open(decompressed, "wb") as fout:
-                dctx.copy_stream(fin, fout)
-            return sqlite3.connect(str(decompressed)), tmpdir
+            import zstandard  # noqa: F401
+            return "collection.anki21b"
         except ImportError:
             logger.warning("zstandard not installed, trying legacy format")
+    for name in ("collection.anki21", "collection.anki2"):
+        if name in names:
+            return name
+    raise FileNotFoundError("No collection database found in .apkg file")
 
-    # Fall back to legacy format
-    anki2 = tmpdir / "collection.anki2"
-    if anki2.exists():
-        return sqlite3.connect(str(anki2)), tmpdir
 
-    raise FileNotFoundError("No collection database found in .apkg file")
+def _copy_collection(src, info: dict) -> tuple[bytearray, Path | None]:
+    """Read the (decompressed) collection stream into memory, spilling to a
+    temp file once it outgrows IN_MEMORY_MAX_BYTES. Returns (buffer, path);
+    path is None when the whole database fit in memory."""
+    limit = IN_MEMORY_MAX_BYTES if hasattr(sqlite3.Connection, "deserialize") else 0
+    buf = bytearray()
+    out = None
+    try:
+        while chunk := src.read(_CHUNK_BYTES):
+            info["collection_bytes"] += len(chunk)
+            if out is None and len(buf) + len(chunk) <= limit:
+                buf += chunk
+                continue
+            if out is None:
+                out = tempfile.NamedTemporaryFile(prefix="apkg-", suffix=".db", delete=False)
+                out.write(buf)
+                buf = bytearray()
+            out.write(chunk)
+    except BaseException:
+        if out is not None:
+            out.close()
+            Path(out.name).unlink(missing_ok=True)
+        raise
+    if out is None:
+        return buf, None
+    out.close()
+    info["peak_disk_bytes"] = info["collection_bytes"]
+    return buf, Path(out.name)
+
+
+@contextmanager
+def _open_apkg_db(apkg_path: str) -> Iterator[tuple[sqlite3.Connection, dict]]:
+    """Open the SQLite collection inside an .apkg file.
+    Handles both legacy (.anki2/.anki21) and modern zstd-compressed (.anki21b)
+    formats. Only the collection member is read (media files are never
+    extracted) and .anki21b is decompressed as it streams out of the zip.
+    Yields (connection, info) where info has member, collection_bytes and
+    peak_disk_bytes (0 when the database was opened in memory); the
+    connection and any temp file are removed on exit.
+    """
+    info = {"member": None, "collection_bytes": 0, "peak_disk_bytes": 0}
+    tmp_path = None
+    conn = None
+    try:
+        with zipfile.ZipFile(apkg_path, "r") as z:
+            member = info["member"] = _collection_member(z)
+            with z.open(member) as raw:
+                if member.endswith(".anki21b"):
+                    import zstandard
+                    with zstandard.ZstdDecompressor().stream_reader(raw) as src:
+                        data, tmp_path = _copy_collection(src, info)
+                else:
+                    data, tmp_path = _copy_collection(raw, info)
+
+        if tmp_path is None:
+            if data[18:20] == b"\x02\x02":
+                # WAL databases can't be read from memory: open as rollback-journal
+                data[18] = data[19] = 1
+            conn = sqlite3.connect(":memory:")
+            conn.deserialize(data)
+        else:
+            conn = sqlite3.connect(str(tmp_path))
+        del data
+        logger.info("Opened %s (%d bytes, %s)", member, info["collection_bytes"],
+                    "on disk" if tmp_path else "in memory")
+        yield conn, info
+    finally:
+        if conn is not None:
+            conn.close()
+        if tmp_path is not None:
+            tmp_path.unlink(missing_ok=True)
+
+
+# --- Media ---
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_IMG_SRC_RE = re.compile(r"""<img[^>]*?\ssrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+
+
+def image_src(field_html: str) -> str | None:
+    """The media filename referenced by the first <img src> in a field."""
+    match = _IMG_SRC_RE.search(field_html or "")
+    if not match:
+        return None
+    src = next(g for g in match.groups() if g is not None)
+    return unquote(html.unescape(src)) or None
+
+
+def _varint(buf: bytes, pos: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _proto_fields(buf: bytes) -> Iterator[tuple[int, int | bytes]]:
+    """Minimal protobuf wire-format reader: yields (field number, value)."""
+    pos = 0
+    while pos < len(buf):
+        key, pos = _varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = _varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = _varint(buf, pos)
+            value, pos = buf[pos:pos + size], pos + size
+        elif wire_type == 1:
+            value, pos = buf[pos:pos + 8], pos + 8
+        elif wire_type == 5:
+            value, pos = buf[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+        yield key >> 3, value
+
+
+def _read_media_map(z: zipfile.ZipFile) -> dict[str, dict]:
+    """Map media filenames to their zip member.
+
+    Legacy packages store a JSON object {"0": "name.jpg", ...} and the files
+    as-is. Newer (.anki21b) packages store a zstd-compressed protobuf
+    MediaEntries list (name = 1, size = 2, sha1 = 3, legacy_zip_filename =
+    255; members are named by list index unless the last is set), and every
+    file is zstd-compressed.
+
+    Returns {filename: {"member", "size", "sha1", "compressed"}}; size and
+    sha1 are only known for the newer format.
+    """
+    if "media" not in z.namelist():
+        return {}
+    data = z.read("media")
+    if not data.startswith(_ZSTD_MAGIC):
+        return {
+            name: {"member": member, "size": None, "sha1": None, "compressed": False}
+            for member, name in json.loads(data or b"{}").items()
+        }
+
+    import zstandard
+    data = zstandard.ZstdDecompressor().stream_reader(data).read()
+    media = {}
+    for index, (field, entry) in enumerate(f for f in _proto_fields(data) if f[0] == 1):
+        info = {"member": str(index), "size": None, "sha1": None, "compressed": True}
+        name = None
+        for number, value in _proto_fields(entry):
+            if number == 1:
+                name = value.decode("utf-8")
+            elif number == 2:
+                info["size"] = value
+            elif number == 3:
+                info["sha1"] = value.hex()
+            elif number == 255:
+                info["member"] = str(value)
+        if name:
+            media[name] = info
+    return media
+
+
+class _MediaStore:
+    """Content-addressed writes into MEDIA_DIR: files are named by SHA-1, and
+    a file whose bytes are already in the store (under any name) is reused."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_size: dict[int, list[Path]] | None = None
+        self._hashes: dict[Path, str] = {}
+
+    def _existing_with_size(self, size: int) -> list[Path]:
+        with self._lock:
+            if self._by_size is None:
+                self._by_size = {}
+                for entry in os.scandir(MEDIA_DIR):
+                    if entry.is_file() and not entry.name.startswith("."):
+                        self._by_size.setdefault(entry.stat().st_size, []).append(Path(entry.path))
+            return list(self._by_size.get(size, []))
+
+    def _file_sha1(self, path: Path) -> str:
+        if path not in self._hashes:
+            digest = hashlib.sha1()
+            with open(path, "rb") as f:
+                while chunk := f.read(_CHUNK_BYTES):
+                    digest.update(chunk)
+            self._hashes[path] = digest.hexdigest()
+        return self._hashes[path]
+
+    def find(self, sha1: str, size: int, ext: str) -> str | None:
+        """Filename of an existing file with this content, if any."""
+        if (MEDIA_DIR / f"{sha1}{ext}").exists():
+            return f"{sha1}{ext}"
+        for path in self._existing_with_size(size):
+            if self._file_sha1(path) == sha1:
+                return path.name
+        return None
+
+    def add(self, path: Path, size: int):
+        with self._lock:
+            if self._by_size is not None:
+                self._by_size.setdefault(size, []).append(path)
+
+
+def _store_media(
+    z: zipfile.ZipFile, name: str, info: dict, store: _MediaStore
+) -> tuple[str, bool, int]:
+    """Copy one media file out of the package unless the store already has it.
+    Returns (filename in MEDIA_DIR, newly written, bytes written)."""
+    ext = Path(name).suffix.lower()
+    if info["sha1"] and info["size"] is not None:
+        existing = store.find(info["sha1"], info["size"], ext)
+        if existing:
+            return existing, False, 0
+
+    digest = hashlib.sha1()
+    size = 0
+    fd, tmp_name = tempfile.mkstemp(prefix=".import-", dir=MEDIA_DIR)
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as out, z.open(info["member"]) as raw:
+            src = raw
+            if info["compressed"]:
+                import zstandard
+                src = zstandard.ZstdDecompressor().stream_reader(raw)
+            while chunk := src.read(_CHUNK_BYTES):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        sha1 = digest.hexdigest()
+        existing = store.find(sha1, size, ext)
+        if existing:
+            return existing, False, 0
+        filename = f"{sha1}{ext}"
+        os.replace(tmp_path, MEDIA_DIR / filename)
+        store.add(MEDIA_DIR / filename, size)
+        return filename, True, size
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def import_media(apkg_path: str, card_media: dict[int, str], workers: int | None = None) -> dict:
+    """Copy the media referenced by imported cards ({card_id: filename in the
+    package}) into MEDIA_DIR and set each card's image_filename.
+
+    Files are streamed (never held in memory whole) by a bounded pool of
+    threads, each reading through its own handle on the zip.
+    """
+    stats = {"linked": 0, "stored": 0, "reused": 0, "missing": 0, "bytes_written": 0}
+    if not card_media:
+        return stats
+
+    with zipfile.ZipFile(apkg_path, "r") as z:
+        media_map = _read_media_map(z)
+
+    by_name: dict[str, list[int]] = {}
+    for card_id, name in card_media.items():
+        if name in media_map:
+            by_name.setdefault(name, []).append(card_id)
+        else:
+            stats["missing"] += 1
+
+    store = _MediaStore()
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+    links: dict[int, str] = {}  # card id -> stored filename, written in one transaction
+
+    def copy(name: str) -> tuple[str, str | None, bool, int]:
+        if not hasattr(local, "zip"):
+            local.zip = zipfile.ZipFile(apkg_path, "r")
+            with handles_lock:
+                handles.append(local.zip)
+        try:
+            return (name, *_store_media(local.zip, name, media_map[name], store))
+        except (KeyError, OSError, zipfile.BadZipFile) as e:
+            logger.warning("Could not import media file %s: %s", name, e)
+            return name, None, False, 0
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers or settings.media_import_workers) as pool:
+            for name, filename, written, size in pool.map(copy, by_name):
+                if filename is None:
+                    stats["missing"] += len(by_name[name])
+                    continue
+                stats["stored" if written else "reused"] += 1
+                stats["bytes_written"] += size
+                for card_id in by_name[name]:
+                    links[card_id] = filename
+    finally:
+        for handle in handles:
+            handle.close()
+    stats["linked"] = repository.update_cards_media(links)
+
+    logger.info("Media: %d linked, %d files stored, %d reused, %d missing",
+                stats["linked"], stats["stored"], stats["reused"], stats["missing"])
+    return stats
 
 
 def _get_art_fields(conn: sqlite3.Connection) -> tuple[int | None, list[str]]:
@@ -107,75 +408,146 @@ def extract_anki_ids(apkg_path: str, deck_type: str = "artwork") -> dict:
 
     Use this to fix NULL IDs so exports merge into the existing deck.
     """
-    conn, tmpdir = _open_apkg_db(apkg_path)
-    ntid, field_names = _get_art_fields(conn)
-    deck_id = _get_deck_id(conn)
-    conn.close()
-
-    import shutil
-    shutil.rmtree(tmpdir, ignore_errors=True)
+    with _open_apkg_db(apkg_path) as (conn, _):
+        ntid, field_names = _get_art_fields(conn)
+        deck_id = _get_deck_id(conn)
 
     if ntid is None:
         return {"error": "No artwork note type found in .apkg"}
 
     if ntid and deck_id:
-        repository.update_deck_type_anki_ids(deck_type, model_id=ntid, deck_id=deck_id)
+        deck_registry.set_anki_ids(deck_type, model_id=ntid, deck_id=deck_id)
         logger.info("Saved Anki IDs: model=%d, deck=%d", ntid, deck_id)
 
     return {"model_id": ntid, "deck_id": deck_id}
 
 
+def _pipelined(fn: Callable, items: list, workers: int) -> Iterator[tuple]:
+    """Yield (item, fn(item)) in order while up to `workers` later items are
+    already being processed in a thread pool."""
+    if workers <= 1:
+        for item in items:
+            yield item, fn(item)
+        return
+    pool = ThreadPoolExecutor(max_workers=workers)
+    window: deque = deque()
+    fn = metrics.bind(fn)
+    try:
+        for item in items:
+            window.append((item, pool.submit(fn, item)))
+            if len(window) > workers:
+                item, future = window.popleft()
+                yield item, future.result()
+        while window:
+            item, future = window.popleft()
+            yield item, future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 def import_apkg(
     apkg_path: str,
     deck_type: str = "artwork",
     compute_embeddings: bool = True,
-    batch_size: int = 20,
+    batch_size: int = embeddings.EMBED_BATCH_SIZE,
+    on_progress: Callable[[int, int, str], None] | None = None,
+    incremental: bool = False,
+    with_media: bool = True,
+    workers: int = 2,
 ) -> dict:
     """
     Import cards from an .apkg file into the database.
     Cards are imported with status 'IMPORTED' so they participate in dedup
-    but aren't re-exported.
-
-    Returns stats dict.
+    but aren't re-exported. Each card keeps its source note id, guid and
+    modification time: re-importing a note that was imported before updates
+    that card in place when the note has changed since.
+
+    With incremental=True only notes modified since the last import of this
+    package's note type and deck are read, and IMPORTED cards from this
+    package's deck whose note is no longer in it are marked DELETED. Cards marked DELETED whose
+    note is in the package again are restored to IMPORTED. With with_media, the image each new or
+    updated card's Artwork field points to is copied out of the package
+    (see import_media).
+
+    Notes are decoded first; new and changed cards are then embedded
+    batch_size at a time (one embedding request per batch, up to `workers`
+    batches in flight) and each batch is inserted in one transaction.
+    on_progress(done, total, message) is called after every batch.
+
+    Returns stats dict. Raises ValueError unless batch_size and workers are
+    at least 1.
     """
-    conn, tmpdir = _open_apkg_db(apkg_path)
-    c = conn.cursor()
-
-    ntid, field_names = _get_art_fields(conn)
-    if ntid is None:
-        conn.close()
-        return {"error": "No artwork note type found in .apkg"}
-
-    # Extract real Anki IDs so exports merge into this deck
-    real_deck_id = _get_deck_id(conn)
-    if ntid and real_deck_id:
-        repository.update_deck_type_anki_ids(deck_type, model_id=ntid, deck_id=real_deck_id)
-        logger.info("Saved Anki IDs: model=%d, deck=%d", ntid, real_deck_id)
-
-    # Get all notes
-    c.execute("SELECT flds FROM notes WHERE mid=?", (ntid,))
-    rows = c.fetchall()
-    conn.close()
+    if batch_size < 1 or workers < 1:
+        raise ValueError(f"batch_size and workers must be at least 1 (got {batch_size}, {workers})")
+    with _open_apkg_db(apkg_path) as (conn, db_info):
+        ntid, field_names = _get_art_fields(conn)
+        if ntid is None:
+            return {"error": "No artwork note type found in .apkg"}
+
+        # Extract real Anki IDs so exports merge into this deck
+        real_deck_id = _get_deck_id(conn)
+        if ntid and real_deck_id:
+            deck_registry.set_anki_ids(deck_type, model_id=ntid, deck_id=real_deck_id)
+            logger.info("Saved Anki IDs: model=%d, deck=%d", ntid, real_deck_id)
+
+        note_ids = [r[0] for r in conn.execute("SELECT id FROM notes WHERE mid=?", (ntid,))]
+        package_mod = conn.execute("SELECT MAX(mod) FROM notes WHERE mid=?", (ntid,)).fetchone()[0]
+        since = repository.get_anki_import_watermark(deck_type, ntid, real_deck_id) if incremental else None
+        if since is None:
+            rows = conn.execute("SELECT id, guid, mod, flds FROM notes WHERE mid=?", (ntid,)).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id, guid, mod, flds FROM notes WHERE mid=? AND mod > ?", (ntid, since)
+            ).fetchall()
 
     # Get existing cards for dedup check
     existing_cards, _ = repository.get_existing_cards_with_embeddings(deck_type)
     existing_titles = {c.get("Title", "").strip().lower() for c in existing_cards}
+    known_notes = repository.get_anki_note_index(deck_type)
+    unlinked = repository.get_unlinked_imported_cards(deck_type)
 
+    card_media: dict[int, str] = {}  # card id -> media filename in the package
     imported = 0
+    updated = 0
+    unchanged = 0
     skipped = 0
     total = len(rows)
 
-    print(f"Found {total} cards in .apkg")
+    if since is None:
+        print(f"Found {total} cards in .apkg")
+    else:
+        print(f"Found {total} of {len(note_ids)} notes changed since the last import")
 
-    for i, (flds,) in enumerate(rows):
+    # 1. Decode notes and decide what each becomes: a new card, an update of
+    # a previously imported card, or nothing. Embedding and writing happen
+    # below, a batch at a time.
+    pending: list[dict] = []  # {"fields", "src", and "card" (new) or "card_id" + "note" (update)}
+    for note_id, guid, mod, flds in rows:
         values = flds.split(ANKI_FIELD_SEP)
         fields_dict = {}
         for j, fname in enumerate(field_names):
             fields_dict[fname] = values[j] if j < len(values) else ""
+        title = fields_dict.get("Title", "").strip().lower()
+        src = image_src(fields_dict.get("Artwork", ""))
+
+        # Note imported before: update the card if the note was edited since
+        if note_id in known_notes:
+            card_id, known_mod = known_notes[note_id]
+            if known_mod is not None and mod <= known_mod:
+                unchanged += 1
+                continue
+            pending.append({"fields": fields_dict, "src": src, "card_id": card_id, "note": (note_id, guid, mod)})
+            existing_titles.add(title)
+            continue
 
         # Skip if title already exists (fast dedup)
-        title = fields_dict.get("Title", "").strip().lower()
         if title in existing_titles:
+            # Cards imported before note ids were stored get linked to their note
+            if title in unlinked:
+                card_id = unlinked.pop(title)
+                repository.update_imported_card(card_id, note_id, guid, mod, anki_deck_id=real_deck_id or 0)
+                if src:
+                    card_media[card_id] = src
             skipped += 1
             continue
 
@@ -184,29 +556,75 @@ def import_apkg(
             fields_json=fields_dict,
             source_topic="imported",
             status="IMPORTED",
+            anki_note_id=note_id,
+            anki_guid=guid,
+            anki_mod=mod,
+            anki_deck_id=real_deck_id or 0,
         )
-
-        # Compute embedding in batches
-        emb = None
-        if compute_embeddings:
-            card_text = embeddings.card_text_for_embedding(fields_dict)
-            emb = embeddings.get_embedding(card_text)
-
-        repository.save_card(card, embedding=emb)
+        pending.append({"fields": fields_dict, "src": src, "card": card})
         existing_titles.add(title)
-        imported += 1
-
-        if (i + 1) % batch_size == 0:
-            print(f"  Progress: {i + 1}/{total} ({imported} imported, {skipped} skipped)")
 
-    # Cleanup
-    import shutil
-    shutil.rmtree(tmpdir, ignore_errors=True)
+    # 2. Embed batches concurrently (one request per batch, rate-limited by
+    # the quota scheduler) while finished batches are written in order.
+    def embed(batch: list[dict]) -> list:
+        if not compute_embeddings:
+            return [None] * len(batch)
+        texts = [embeddings.card_text_for_embedding(item["fields"]) for item in batch]
+        return embeddings.get_embeddings(texts, priority=quota.PRIORITY_BACKGROUND)
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    done = 0
+    for batch, batch_embeddings in _pipelined(embed, batches, workers):
+        new = [(item, emb) for item, emb in zip(batch, batch_embeddings) if "card" in item]
+        card_ids = repository.save_cards([item["card"] for item, _ in new], [emb for _, emb in new])
+        for (item, _), card_id in zip(new, card_ids):
+            item["card_id"] = card_id
+        for item, emb in zip(batch, batch_embeddings):
+            if "note" in item:
+                repository.update_imported_card(
+                    item["card_id"], *item["note"], fields_json=item["fields"], embedding=emb,
+                    anki_deck_id=real_deck_id or 0,
+                )
+            if item["src"]:
+                card_media[item["card_id"]] = item["src"]
+        imported += len(new)
+        updated += len(batch) - len(new)
+        done += len(batch)
+
+        print(f"  Progress: {done}/{len(pending)} ({imported} imported, {updated} updated, {skipped} skipped)")
+        if on_progress:
+            on_progress(done, len(pending), f"{imported} imported, {updated} updated, {skipped} skipped")
+
+    restored = repository.restore_anki_notes(deck_type, note_ids)
+    deleted = repository.mark_deleted_anki_notes(deck_type, note_ids, real_deck_id) if incremental else 0
+    if package_mod is not None:
+        repository.set_anki_import_watermark(deck_type, ntid, real_deck_id, package_mod)
+
+    media_stats = None
+    if with_media and card_media:
+        if on_progress:
+            on_progress(len(pending), len(pending), f"Copying media for {len(card_media)} cards")
+        media_stats = import_media(apkg_path, card_media)
+
+    if on_progress:
+        on_progress(len(pending), len(pending), f"{imported} imported, {updated} updated, {skipped} skipped")
 
     stats = {
-        "total_in_apkg": total,
+        "total_in_apkg": len(note_ids),
+        "changed_since": since,
         "imported": imported,
+        "updated": updated,
+        "unchanged": unchanged,
         "skipped_duplicates": skipped,
+        "deleted": deleted,
+        "restored": restored,
+        "peak_disk_bytes": db_info["peak_disk_bytes"],
+        "media": media_stats,
     }
-    print(f"\nDone: {imported} imported, {skipped} skipped (already existed)")
+    print(f"\nDone: {imported} imported, {updated} updated, {skipped} skipped (already existed)"
+          + (f", {deleted} marked deleted" if deleted else "")
+          + (f", {restored} restored" if restored else ""))
+    if media_stats:
+        print(f"Media: {media_stats['linked']} cards linked, {media_stats['stored']} files copied, "
+              f"{media_stats['reused']} already present, {media_stats['missing']} missing")
     return stats
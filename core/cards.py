@@ -13,6 +13,11 @@ class Card(BaseModel):
     source_topic: Optional[str] = None
     run_id: Optional[int] = None
     status: str = "GENERATED"
+    anki_note_id: Optional[int] = None  # Source note of an imported card
+    anki_guid: Optional[str] = None  # Note GUID in Anki; assigned on first export if not imported
+    anki_mod: Optional[int] = None
+    anki_deck_id: Optional[int] = None  # Deck id of the package it was imported from (0: none)
+    updated_at: Optional[float] = None  # Last content change (unix seconds)
 
 
 class GenerationRun(BaseModel):
@@ -24,6 +29,27 @@ class GenerationRun(BaseModel):
     persona: Optional[str] = None
     total_generated: int = 0
     total_accepted: int = 0
+    parse_mode: Optional[str] = None  # "json" (structured output) or "pipe"
+    rows_dropped: int = 0
+    rows_repaired: int = 0
+
+
+class Job(BaseModel):
+    id: Optional[int] = None
+    kind: str  # generate, generate_artist, import, export
+    params: dict = {}
+    status: str = "QUEUED"  # QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED
+    progress_done: int = 0
+    progress_total: int = 0
+    progress_message: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool = False
+    worker: Optional[str] = None
+    attempts: int = 0
+    created_at: Optional[float] = None
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 
 class CardTemplate(BaseModel):
@@ -39,3 +65,4 @@ class DeckType(BaseModel):
     css: str
     anki_model_id: Optional[int] = None  # Real Anki model ID from imported .apkg
     anki_deck_id: Optional[int] = None   # Real Anki deck ID from imported .apkg
+    version: int = 1  # Bumped on every change to the row (see core.deck_registry)
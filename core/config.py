@@ -17,6 +17,32 @@ class Settings(BaseSettings):
     db_path: str = str(DATA_DIR / "anki_generator.db")
     gemini_model: str = "gemini-2.5-flash-lite"
     embedding_model: str = "gemini-embedding-001"
+    # Existing cards sent to gap analysis: top-k most relevant, capped by a rough token budget
+    context_top_k: int = 60
+    context_token_budget: int = 800
+    # Request quotas enforced by core.quota (0 = unlimited). Defaults match the free tier.
+    gemini_rpm: int = 15
+    gemini_rpd: int = 20
+    gemini_tpm: int = 250_000
+    embedding_rpm: int = 100
+    embedding_rpd: int = 1000
+    embedding_tpm: int = 30_000
+    # Ask Gemini for schema-constrained JSON cards (pipe-separated lines when false or on malformed JSON)
+    structured_output: bool = True
+    # Background job worker threads inside the API server (0 = run `cli.py worker` separately)
+    job_workers: int = 2
+    # Runs of a job whose worker died before it is marked FAILED instead of requeued
+    job_max_attempts: int = 3
+    # Threads copying media files out of an imported .apkg
+    media_import_workers: int = 4
+    # Threads checking media files before an export, and re-downloading missing images
+    export_media_workers: int = 8
+    image_refetch_workers: int = 2
+    # Seconds a cached export package is kept after it was last built or downloaded
+    export_artifact_ttl: int = 7 * 24 * 3600
+    # Opt-in cache of Gemini responses keyed by model + prompt + config
+    llm_cache_enabled: bool = False
+    llm_cache_ttl: int = 7 * 24 * 3600
 
     class Config:
         env_file = str(BASE_DIR / ".env")
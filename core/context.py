@@ -0,0 +1,119 @@
+"""
+Select which existing cards to show the gap-analysis agent.
+
+Sending every existing Title grows without bound (the imported artwork
+deck alone is thousands of tokens). Instead we retrieve the cards most
+relevant to the topic — semantically via stored embeddings when we have
+them, lexically via the FTS index otherwise — and stop at a token budget.
+Full duplicate detection still runs locally against the whole deck.
+"""
+from __future__ import annotations
+
+import logging
+
+import numpy as np
+
+from core import embeddings, quota
+from core.config import settings
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+NO_EXISTING_CARDS = "No existing cards found."
+
+
+def _semantic_titles(
+    topic_embedding: np.ndarray,
+    existing_cards: list[dict],
+    existing_embeddings: list[np.ndarray | None],
+    top_k: int,
+) -> list[str]:
+    """Titles of the existing cards closest to the topic embedding."""
+    indexed = [
+        (i, emb) for i, emb in enumerate(existing_embeddings)
+        if emb is not None and emb.shape == topic_embedding.shape
+    ]
+    if not indexed:
+        return []
+    matrix = np.vstack([emb for _, emb in indexed])
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(topic_embedding)
+    norms[norms == 0] = 1.0
+    sims = matrix @ topic_embedding / norms
+    best = np.argsort(-sims)[:top_k]
+    return [existing_cards[indexed[j][0]].get("Title", "") for j in best]
+
+
+def _lexical_titles(topic: str, deck_type: str, top_k: int) -> list[str]:
+    """Titles of the existing cards whose fields best match the topic words."""
+    cards = repository.search_cards(topic, deck_type=deck_type, limit=top_k * 2, any_word=True)
+    return [c.fields_json.get("Title", "") for c in cards if c.status != "REJECTED"][:top_k]
+
+
+def _ranked_titles(
+    topic: str,
+    deck_type: str,
+    existing_cards: list[dict],
+    existing_embeddings: list[np.ndarray | None],
+    use_embeddings: bool,
+    top_k: int,
+) -> list[str]:
+    """Semantic matches first (when embeddings are available), then lexical ones."""
+    candidates = []
+    if use_embeddings and any(emb is not None for emb in existing_embeddings):
+        topic_embedding = embeddings.get_embedding(topic)
+        if topic_embedding is not None:
+            candidates.extend(_semantic_titles(topic_embedding, existing_cards, existing_embeddings, top_k))
+    candidates.extend(_lexical_titles(topic, deck_type, top_k))
+    return candidates
+
+
+def select_existing_context(
+    topic: str,
+    deck_type: str,
+    existing_cards: list[dict],
+    existing_embeddings: list[np.ndarray | None],
+    use_embeddings: bool = True,
+    top_k: int | None = None,
+    token_budget: int | None = None,
+) -> str:
+    """
+    Build the "existing cards" text for analyze_knowledge_gaps from the
+    top-k cards relevant to the topic, within a token budget.
+    """
+    if not existing_cards:
+        return NO_EXISTING_CARDS
+    top_k = top_k or settings.context_top_k
+    token_budget = token_budget or settings.context_token_budget
+
+    titles = [c.get("Title") or "" for c in existing_cards]
+    if len(titles) <= top_k and sum(quota.estimate_tokens(t) + 1 for t in titles) <= token_budget:
+        # Everything fits: ranking would only cost an embedding call for the topic
+        candidates = titles
+    else:
+        candidates = _ranked_titles(topic, deck_type, existing_cards, existing_embeddings, use_embeddings, top_k)
+
+    selected = []
+    seen = set()
+    used = 0
+    for title in candidates:
+        title = title.strip()
+        key = title.lower()
+        if not title or key in seen:
+            continue
+        cost = quota.estimate_tokens(title) + 1
+        if used + cost > token_budget or len(selected) >= top_k:
+            break
+        seen.add(key)
+        selected.append(title)
+        used += cost
+
+    logger.info(
+        "Gap-analysis context: %d of %d existing cards (~%d tokens)",
+        len(selected), len(existing_cards), used,
+    )
+    if not selected:
+        return f"No cards closely related to this topic (deck has {len(existing_cards)} cards on other topics)."
+    return (
+        f"{', '.join(selected)}\n"
+        f"(The {len(selected)} most relevant of {len(existing_cards)} existing cards.)"
+    )
@@ -0,0 +1,109 @@
+"""
+In-process cache of deck types, shared by the API, the CLI and exports.
+
+Deck types rarely change, but every generate and export path needs one,
+and loading it means parsing the JSON schema and templates into a
+DeckType, and exporting means building a genanki.Model from that. The
+registry keeps the parsed DeckType, its field names and the built model
+per deck type name, tagged with the row's version (bumped by a trigger on
+any change, see storage.database). A lookup only reads the version; when
+another process has changed the row, the entry is reloaded.
+
+Cached DeckTypes are shared between callers and threads: treat them as
+read-only.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+
+import genanki
+
+from core.cards import DeckType
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+
+class DeckTypeEntry:
+    """A parsed deck type plus what is derived from it."""
+
+    def __init__(self, deck_type: DeckType):
+        self.deck_type = deck_type
+        self.version = deck_type.version
+        self.field_names = [f["name"] for f in deck_type.fields_schema]
+        self.field_config = {f["name"]: f["type"] for f in deck_type.fields_schema}
+        self._model: genanki.Model | None = None
+        self._model_lock = threading.Lock()
+
+    @property
+    def model(self) -> genanki.Model:
+        """The genanki model for exports, built on first use."""
+        with self._model_lock:
+            if self._model is None:
+                from export.genanki_export import _build_genanki_model
+                self._model = _build_genanki_model(self.deck_type)
+            return self._model
+
+
+_lock = threading.Lock()
+_entries: dict[str, DeckTypeEntry] = {}
+
+
+def get(name: str) -> DeckTypeEntry | None:
+    """The cached entry for a deck type, reloaded if the row has changed."""
+    version = repository.get_deck_type_version(name)
+    with _lock:
+        entry = _entries.get(name)
+        if version is None:
+            _entries.pop(name, None)
+            return None
+        if entry is not None and entry.version == version:
+            return entry
+    deck_type = repository.get_deck_type(name)
+    if deck_type is None:
+        return None
+    entry = DeckTypeEntry(deck_type)
+    with _lock:
+        _entries[name] = entry
+    logger.debug("Loaded deck type %s (version %d)", name, entry.version)
+    return entry
+
+
+def get_deck_type(name: str) -> DeckType | None:
+    """Cached replacement for repository.get_deck_type."""
+    entry = get(name)
+    return entry.deck_type if entry else None
+
+
+def entry_for(deck_type: DeckType) -> DeckTypeEntry:
+    """The entry for a DeckType already in hand. Uses the cache when it holds
+    the same version, so callers don't need to look the deck type up again."""
+    with _lock:
+        entry = _entries.get(deck_type.name)
+    if entry is not None and entry.version == deck_type.version:
+        return entry
+    return DeckTypeEntry(deck_type)
+
+
+def field_names(deck_type: DeckType) -> list[str]:
+    return entry_for(deck_type).field_names
+
+
+def genanki_model(deck_type: DeckType) -> genanki.Model:
+    return entry_for(deck_type).model
+
+
+def set_anki_ids(name: str, model_id: int, deck_id: int):
+    """repository.update_deck_type_anki_ids, dropping the cached entry."""
+    repository.update_deck_type_anki_ids(name, model_id, deck_id)
+    invalidate(name)
+
+
+def invalidate(name: str | None = None):
+    """Drop one cached deck type, or all of them."""
+    with _lock:
+        if name is None:
+            _entries.clear()
+        else:
+            _entries.pop(name, None)
@@ -4,31 +4,26 @@ import difflib
 import logging
 
 import numpy as np
-from google import genai
 
+from core import metrics, quota
 from core.config import settings
+from core.gemini import get_client
 
 logger = logging.getLogger(__name__)
 
-_client = None
+# Texts per embed_content request (the API's batch limit)
+EMBED_BATCH_SIZE = 100
 
 
-def _get_client() -> genai.Client | None:
-    global _client
-    if not settings.google_api_key:
-        return None
-    if _client is None:
-        _client = genai.Client(api_key=settings.google_api_key)
-    return _client
-
-
-def get_embedding(text: str) -> np.ndarray | None:
+@metrics.timed("embeddings", call="single")
+def get_embedding(text: str, priority: int = quota.PRIORITY_NORMAL) -> np.ndarray | None:
     """Get embedding vector for text using Gemini embedding API."""
-    client = _get_client()
+    client = get_client()
     if not client or not text.strip():
         return None
 
     try:
+        quota.QUOTA.acquire(quota.EMBEDDING, tokens=quota.estimate_tokens(text), priority=priority)
         result = client.models.embed_content(
             model=settings.embedding_model,
             contents=text,
@@ -39,6 +34,64 @@ def get_embedding(text: str) -> np.ndarray | None:
         return None
 
 
+@metrics.timed("embeddings", call="batch")
+def get_embeddings(
+    texts: list[str],
+    priority: int = quota.PRIORITY_NORMAL,
+) -> list[np.ndarray | None]:
+    """Embed several texts, up to EMBED_BATCH_SIZE per request. Returns one
+    vector (or None for blank texts/failures) per text."""
+    results: list[np.ndarray | None] = [None] * len(texts)
+    client = get_client()
+    if not client:
+        return results
+
+    todo = [i for i, text in enumerate(texts) if text.strip()]
+    for start in range(0, len(todo), EMBED_BATCH_SIZE):
+        batch = todo[start:start + EMBED_BATCH_SIZE]
+        contents = [texts[i] for i in batch]
+        try:
+            quota.QUOTA.acquire(
+                quota.EMBEDDING, tokens=sum(quota.estimate_tokens(t) for t in contents), priority=priority
+            )
+            result = client.models.embed_content(model=settings.embedding_model, contents=contents)
+        except Exception as e:
+            logger.warning("Embedding generation failed: %s", e)
+            continue
+        for i, emb in zip(batch, result.embeddings):
+            results[i] = np.array(emb.values, dtype=np.float32)
+    return results
+
+
+@metrics.timed("embeddings", call="batch")
+async def get_embeddings_async(
+    texts: list[str],
+    priority: int = quota.PRIORITY_INTERACTIVE,
+) -> list[np.ndarray | None]:
+    """Embed several texts on the async client, up to EMBED_BATCH_SIZE per
+    request. Returns one vector (or None for blank texts/failures) per text."""
+    results: list[np.ndarray | None] = [None] * len(texts)
+    client = get_client()
+    if not client:
+        return results
+
+    todo = [i for i, text in enumerate(texts) if text.strip()]
+    for start in range(0, len(todo), EMBED_BATCH_SIZE):
+        batch = todo[start:start + EMBED_BATCH_SIZE]
+        contents = [texts[i] for i in batch]
+        try:
+            await quota.QUOTA.acquire_async(
+                quota.EMBEDDING, tokens=sum(quota.estimate_tokens(t) for t in contents), priority=priority
+            )
+            result = await client.aio.models.embed_content(model=settings.embedding_model, contents=contents)
+        except Exception as e:
+            logger.warning("Embedding generation failed: %s", e)
+            continue
+        for i, emb in zip(batch, result.embeddings):
+            results[i] = np.array(emb.values, dtype=np.float32)
+    return results
+
+
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     """Compute cosine similarity between two vectors."""
     norm_a = np.linalg.norm(a)
@@ -0,0 +1,28 @@
+"""
+Shared Gemini client.
+
+Agents and embeddings use one genai.Client per process, so they share a
+connection pool. `client.aio` is the asyncio interface of the same
+client, used by the *_async functions that back the async API routes.
+"""
+from __future__ import annotations
+
+import threading
+
+from google import genai
+
+from core.config import settings
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client() -> genai.Client | None:
+    """The process-wide client, or None when GOOGLE_API_KEY is not set."""
+    global _client
+    if not settings.google_api_key:
+        return None
+    with _lock:
+        if _client is None:
+            _client = genai.Client(api_key=settings.google_api_key)
+    return _client
@@ -0,0 +1,386 @@
+"""
+Non-interactive card generation pipelines shared by the API routes and
+background jobs.
+
+Each pipeline saves its cards and returns the same result dict the
+/api/generate endpoints respond with. Long-running steps report progress
+through an optional on_progress(done, total, message) callback, and
+per-card events through on_event(event, data): "card" when a card is
+saved (GENERATED or DUPLICATE) and "image" when its image was found or
+not. Either callback may raise to cancel the pipeline between cards.
+Pipelines also add a "timings" summary of where their time went
+(core.metrics), which is stored on the runs they create.
+"""
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import logging
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
+
+from core import agents, context, deck_registry, embeddings, llm_cache, media, metrics, parsing
+from core.cards import Card, DeckType, GenerationRun
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int, str], None]
+EventCallback = Callable[[str, dict], None]
+
+
+def _report(on_progress: ProgressCallback | None, done: int, total: int, message: str = ""):
+    if on_progress:
+        on_progress(done, total, message)
+
+
+def _emit(on_event: EventCallback | None, event: str, data: dict):
+    if on_event:
+        on_event(event, data)
+
+
+_run_timings_active: contextvars.ContextVar[bool] = contextvars.ContextVar("run_timings_active", default=False)
+
+
+@contextmanager
+def run_timings() -> Iterator[metrics.Timings | None]:
+    """Collect stage timings; on exit store the summary on every run created
+    inside (save_llm_cards notes them), including after a failure. Nested in
+    another run_timings() (a pipeline calling a pipeline) this yields None
+    and does nothing: the outermost block owns the runs and their summary."""
+    if _run_timings_active.get():
+        yield None
+        return
+    token = _run_timings_active.set(True)
+    try:
+        with metrics.collect() as timings:
+            try:
+                yield timings
+            finally:
+                for run_id in set(timings.run_ids):
+                    repository.update_run_timings(run_id, timings.summary())
+    finally:
+        _run_timings_active.reset(token)
+
+
+def timed_pipeline(fn):
+    """Run a pipeline (plain or async) under run_timings() and, unless it is
+    nested in another one, add the summary to its result dict under "timings"."""
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            with run_timings() as timings:
+                result = await fn(*args, **kwargs)
+                if timings is not None and isinstance(result, dict):
+                    result["timings"] = timings.summary()
+                return result
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with run_timings() as timings:
+            result = fn(*args, **kwargs)
+            if timings is not None and isinstance(result, dict):
+                result["timings"] = timings.summary()
+            return result
+    return wrapper
+
+
+def fetch_image_for_artwork(card_id: int, artwork: dict, fields: dict) -> str | None:
+    """Download image for an artwork card, using Wikidata URL when available.
+
+    Returns filename or None.
+    """
+    image_url = artwork.get("image_url") or fields.get("Image Source", "")
+    title = fields.get("Title", "")
+    artist = fields.get("Artist", "")
+
+    # Try Wikidata URL directly first (fastest, most reliable)
+    if image_url:
+        result = media.download_image(image_url)
+        if result:
+            filename, _ = result
+            repository.update_card_media(card_id, image_filename=filename)
+            return filename
+
+    # Fall back to multi-source search
+    if title or artist:
+        urls, _ = media.search_images(title=title, artist=artist)
+        if urls:
+            result = media.download_image(urls)
+            if result:
+                filename, _ = result
+                repository.update_card_media(card_id, image_filename=filename)
+                return filename
+
+    return None
+
+
+def _save_artworks(
+    new_artworks: list[dict],
+    card_fields_list: list[dict],
+    deck_type: str,
+    source_topic: str,
+    on_progress: ProgressCallback | None = None,
+    on_event: EventCallback | None = None,
+) -> list[dict]:
+    """Save Wikidata artworks as cards and auto-fetch their images."""
+    saved_cards = []
+    total = len(new_artworks)
+    for i, (art, fields) in enumerate(zip(new_artworks, card_fields_list)):
+        card = Card(
+            deck_type=deck_type, fields_json=fields,
+            source_topic=source_topic, status="GENERATED",
+        )
+        card_id = repository.save_card(card)
+        saved = {
+            "id": card_id,
+            "fields": fields,
+            "status": "GENERATED",
+            "has_free_image": bool(fields.get("Image Source")),
+            "image_filename": None,
+        }
+        _emit(on_event, "card", saved)
+
+        # Auto-fetch image
+        img_filename = fetch_image_for_artwork(card_id, art, fields)
+        logger.info("[%d/%d] %s → %s", i + 1, total,
+                    fields.get("Title", "?"), img_filename or "no image")
+        saved["image_filename"] = img_filename
+        _emit(on_event, "image", {"card_id": card_id, "image_filename": img_filename})
+
+        saved_cards.append(saved)
+        _report(on_progress, i + 1, total, fields.get("Title", ""))
+    return saved_cards
+
+
+@timed_pipeline
+def generate_artwork_cards(
+    topic: str,
+    deck_type: str,
+    count: int,
+    on_progress: ProgressCallback | None = None,
+    on_event: EventCallback | None = None,
+) -> dict:
+    """Artwork decks: look the topic up on Wikidata (no LLM, no hallucinations),
+    save the new artworks and fetch their images."""
+    from core.wikidata import query_artworks_by_topic, artworks_to_card_fields
+
+    _report(on_progress, 0, count, f"Searching Wikidata for '{topic}'")
+    artworks = query_artworks_by_topic(topic, limit=count)
+    if not artworks:
+        return {"error": f"No artworks found on Wikidata for '{topic}'"}
+
+    existing_titles = repository.find_existing_titles(
+        deck_type, [parsing.base_title(a["title"]) for a in artworks]
+    )
+    new_artworks = [a for a in artworks if parsing.base_title(a["title"]) not in existing_titles]
+
+    if not new_artworks:
+        return {
+            "cards": [],
+            "message": "All artworks are already in the deck",
+            "total_found": len(artworks),
+            "skipped": len(artworks),
+        }
+
+    card_fields_list = artworks_to_card_fields(new_artworks)
+    saved_cards = _save_artworks(new_artworks, card_fields_list, deck_type, topic, on_progress, on_event)
+
+    return {
+        "cards": saved_cards,
+        "total_found": len(artworks),
+        "skipped": len(artworks) - len(new_artworks),
+        "new": len(new_artworks),
+    }
+
+
+@timed_pipeline
+def generate_artist_cards(
+    artist_name: str,
+    deck_type: str,
+    limit: int = 0,
+    on_progress: ProgressCallback | None = None,
+    on_event: EventCallback | None = None,
+) -> dict:
+    """Look up real paintings by artist on Wikidata and create cards."""
+    from core.wikidata import query_artist_artworks, artworks_to_card_fields
+
+    _report(on_progress, 0, limit, f"Searching Wikidata for '{artist_name}'")
+    artworks = query_artist_artworks(artist_name)
+    if not artworks:
+        return {"error": f"No artworks found on Wikidata for '{artist_name}'"}
+
+    if limit > 0:
+        artworks = artworks[:limit]
+
+    # Filter out paintings already in the deck (fuzzy title match)
+    existing_titles = repository.find_existing_titles(
+        deck_type, [parsing.base_title(a["title"]) for a in artworks]
+    )
+
+    new_artworks = [a for a in artworks if parsing.base_title(a["title"]) not in existing_titles]
+
+    if not new_artworks:
+        return {
+            "cards": [],
+            "message": "All paintings from this artist are already in the deck",
+            "total_found": len(artworks),
+            "skipped": len(artworks),
+        }
+
+    card_fields_list = artworks_to_card_fields(new_artworks, artist_name)
+    saved_cards = _save_artworks(new_artworks, card_fields_list, deck_type, artist_name, on_progress, on_event)
+
+    return {
+        "cards": saved_cards,
+        "total_found": len(artworks),
+        "skipped": len(artworks) - len(new_artworks),
+        "new": len(new_artworks),
+    }
+
+
+@timed_pipeline
+def generate_llm_cards(
+    topic: str,
+    deck_type: str,
+    dt: DeckType,
+    missing_concepts: str,
+    persona: str,
+    count: int,
+    existing_cards: list[dict],
+    existing_embeddings: list,
+    stream: bool = False,
+    use_cache: bool = True,
+    on_progress: ProgressCallback | None = None,
+    on_event: EventCallback | None = None,
+) -> dict:
+    """Run Agent 2, then embed, dedup and save each parsed card.
+
+    With stream=True cards are parsed, checked and saved as each line
+    arrives from Gemini instead of after the whole response.
+    """
+    entry = deck_registry.entry_for(dt)
+    field_names, field_config = entry.field_names, entry.field_config
+
+    if stream:
+        parser = parsing.StreamParser(field_names)
+        parsed = parser.parse_stream(
+            agents.generate_cards_stream(
+                missing_concepts, count, field_config, persona=persona, use_cache=use_cache
+            )
+        )
+        parse_stats = parser.stats  # filled in as save_llm_cards consumes the stream
+    else:
+        raw = agents.generate_cards(
+            missing_concepts, count, field_config, persona=persona, use_cache=use_cache
+        )
+        parsed, parse_stats = parsing.parse_cards(raw, field_names)
+
+    run_id, saved_cards = save_llm_cards(
+        parsed, topic, deck_type, dt, persona, existing_cards, existing_embeddings, parse_stats,
+        on_progress=on_progress, on_event=on_event, expected=count,
+    )
+    if run_id is None:
+        return {"error": "Generation failed", "raw_output": parser.raw if stream else raw}
+
+    return {
+        "run_id": run_id,
+        "persona": persona,
+        "gap_analysis": missing_concepts,
+        "cards": saved_cards,
+        "parse": parse_stats,
+        "llm_cache": llm_cache.stats(),
+    }
+
+
+@timed_pipeline
+def generate_for_topic(
+    topic: str,
+    deck_type: str,
+    dt: DeckType,
+    count: int,
+    use_cache: bool = True,
+    on_progress: ProgressCallback | None = None,
+    stream: bool = False,
+    on_event: EventCallback | None = None,
+) -> dict:
+    """Full LLM pipeline for one topic: context selection, gap analysis,
+    generation, then dedup and save."""
+    existing_cards, existing_embeddings = repository.get_existing_cards_with_embeddings(deck_type)
+    existing_text = context.select_existing_context(topic, deck_type, existing_cards, existing_embeddings)
+
+    _report(on_progress, 0, count, "Analyzing knowledge gaps")
+    missing_concepts, persona = agents.analyze_knowledge_gaps(
+        topic, existing_text, num=count, use_cache=use_cache
+    )
+    _report(on_progress, 0, count, f"Generating cards as {persona}")
+    return generate_llm_cards(
+        topic, deck_type, dt, missing_concepts, persona, count,
+        existing_cards, existing_embeddings, stream=stream, use_cache=use_cache,
+        on_progress=on_progress, on_event=on_event,
+    )
+
+
+def save_llm_cards(
+    parsed: Iterable[dict],
+    topic: str,
+    deck_type: str,
+    dt: DeckType,
+    persona: str,
+    existing_cards: list[dict],
+    existing_embeddings: list,
+    parse_stats: dict | None = None,
+    card_embeddings: list | None = None,
+    on_progress: ProgressCallback | None = None,
+    on_event: EventCallback | None = None,
+    expected: int = 0,
+) -> tuple[int | None, list[dict]]:
+    """Embed, dedup and save parsed cards under a new run (created on the first card).
+    parse_stats (dropped/repaired row counts) is recorded on the run.
+    card_embeddings, if given, are used instead of embedding each card here.
+    Returns (run_id or None if nothing was parsed, saved card dicts)."""
+    run_id = None
+    saved_cards = []
+    for i, card_fields in enumerate(parsed):
+        if run_id is None:
+            run = GenerationRun(
+                topic=topic, deck_name=dt.name, deck_type=deck_type, persona=persona,
+            )
+            run_id = repository.create_run(run)
+            metrics.note_run(run_id)
+
+        if card_embeddings is not None:
+            emb = card_embeddings[i]
+        else:
+            emb = embeddings.get_embedding(embeddings.card_text_for_embedding(card_fields))
+        is_dup, reason = embeddings.is_duplicate(
+            card_fields, existing_cards, existing_embeddings, new_embedding=emb
+        )
+
+        status = "DUPLICATE" if is_dup else "GENERATED"
+        card = Card(
+            deck_type=deck_type, fields_json=card_fields,
+            source_topic=topic, run_id=run_id, status=status,
+        )
+        card_id = repository.save_card(card, embedding=emb)
+
+        saved = {
+            "id": card_id,
+            "fields": card_fields,
+            "status": status,
+            "duplicate_reason": reason if is_dup else None,
+        }
+        saved_cards.append(saved)
+        _emit(on_event, "card", saved)
+
+        if not is_dup:
+            existing_cards.append(card_fields)
+            existing_embeddings.append(emb)
+        first_value = next(iter(card_fields.values()), "")
+        _report(on_progress, i + 1, max(expected, i + 1), card_fields.get("Title") or first_value)
+
+    if run_id is not None:
+        repository.update_run_generated(run_id, len(saved_cards), parse_stats)
+    return run_id, saved_cards
@@ -0,0 +1,293 @@
+"""
+Persistent background jobs for long operations: generation, .apkg import
+and export.
+
+A job is a row in the jobs table (kind + JSON params). Worker threads —
+inside the API server (JOB_WORKERS) or a separate `python3 cli.py worker`
+process — claim queued jobs, run the handler registered for the kind and
+store its result. Handlers report per-card progress through JobContext,
+which is also where a cancel request takes effect. Workers heartbeat
+their running jobs; a job whose worker died is put back in the queue, so
+queued and interrupted work survives restarts. A job is not requeued
+after JOB_MAX_ATTEMPTS runs (it may be what kills its worker), nor when
+its kind is registered with retry=False (generation: a rerun would spend
+quota again and save duplicate runs); those are marked FAILED.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import socket
+import threading
+from pathlib import Path
+from typing import Callable
+
+from core import deck_registry
+from core.cards import Job
+from core.config import settings
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "QUEUED"
+RUNNING = "RUNNING"
+SUCCEEDED = "SUCCEEDED"
+FAILED = "FAILED"
+CANCELLED = "CANCELLED"
+
+POLL_SECONDS = 2.0
+HEARTBEAT_SECONDS = 15.0
+STALE_AFTER_SECONDS = 120.0
+
+# Wakes idle in-process workers as soon as a job is submitted
+_wake = threading.Event()
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job has been cancelled."""
+
+
+class JobContext:
+    """Handed to job handlers: progress reporting and cancellation checks."""
+
+    def __init__(self, job: Job):
+        self.job = job
+
+    def progress(self, done: int, total: int, message: str = ""):
+        """Record progress; raises JobCancelled if the job was cancelled."""
+        if repository.update_job_progress(self.job.id, done, total, message):
+            raise JobCancelled()
+
+
+Handler = Callable[[dict, JobContext], dict]
+_HANDLERS: dict[str, Handler] = {}
+_NO_RETRY: set[str] = set()
+
+
+def handler(kind: str, retry: bool = True) -> Callable[[Handler], Handler]:
+    """Register the function that runs jobs of this kind. With retry=False
+    a job interrupted by a lost worker fails instead of running again."""
+    def register(fn: Handler) -> Handler:
+        _HANDLERS[kind] = fn
+        if not retry:
+            _NO_RETRY.add(kind)
+        return fn
+    return register
+
+
+def kinds() -> list[str]:
+    return sorted(_HANDLERS)
+
+
+def requeue_stale() -> int:
+    """Requeue (or fail, see the module docstring) jobs whose worker stopped heartbeating."""
+    requeued, failed = repository.requeue_stale_jobs(
+        STALE_AFTER_SECONDS, settings.job_max_attempts, _NO_RETRY
+    )
+    if requeued:
+        logger.info("Requeued %d interrupted jobs", requeued)
+    if failed:
+        logger.warning("Marked %d interrupted jobs FAILED (worker lost)", failed)
+    return requeued
+
+
+def submit(kind: str, params: dict) -> int:
+    """Queue a job and return its id. Raises ValueError for an unknown kind."""
+    if kind not in _HANDLERS:
+        raise ValueError(f"Unknown job kind '{kind}' (expected one of: {', '.join(kinds())})")
+    job_id = repository.create_job(kind, params)
+    _wake.set()
+    return job_id
+
+
+def run_job(job: Job):
+    """Run one claimed job to completion and record the outcome."""
+    logger.info("Job %d (%s) started", job.id, job.kind)
+    try:
+        result = _HANDLERS[job.kind](job.params, JobContext(job))
+    except JobCancelled:
+        logger.info("Job %d cancelled", job.id)
+        repository.finish_job(job.id, CANCELLED)
+    except Exception as e:
+        logger.exception("Job %d (%s) failed", job.id, job.kind)
+        repository.finish_job(job.id, FAILED, error=str(e))
+    else:
+        if isinstance(result, dict) and result.get("error"):
+            repository.finish_job(job.id, FAILED, result=result, error=result["error"])
+        else:
+            repository.finish_job(job.id, SUCCEEDED, result=result)
+        logger.info("Job %d (%s) finished", job.id, job.kind)
+
+
+class WorkerPool:
+    """Threads that claim and run queued jobs until stopped."""
+
+    def __init__(self, num_workers: int = 2, name: str | None = None):
+        self.num_workers = num_workers
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._running: dict[int, str] = {}  # job id -> worker thread name
+        self._lock = threading.Lock()
+
+    def start(self):
+        requeue_stale()
+        for i in range(self.num_workers):
+            t = threading.Thread(target=self._work_loop, args=(f"{self.name}/{i}",),
+                                 name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._heartbeat_loop, name="job-heartbeat", daemon=True)
+        t.start()
+        self._threads.append(t)
+        logger.info("Started %d job workers (%s)", self.num_workers, self.name)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop claiming jobs. Running jobs are left to finish (or be requeued)."""
+        self._stop.set()
+        _wake.set()
+        for t in self._threads:
+            t.join(timeout)
+
+    def wait(self):
+        """Block until stop() (used by `cli.py worker`)."""
+        while not self._stop.is_set():
+            self._stop.wait(1.0)
+
+    def _work_loop(self, worker: str):
+        while not self._stop.is_set():
+            try:
+                job = repository.claim_next_job(worker)
+            except Exception:
+                logger.exception("Claiming a job failed")
+                job = None
+            if job is None:
+                _wake.wait(POLL_SECONDS)
+                _wake.clear()
+                continue
+            with self._lock:
+                self._running[job.id] = worker
+            try:
+                run_job(job)
+            finally:
+                with self._lock:
+                    self._running.pop(job.id, None)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(HEARTBEAT_SECONDS):
+            try:
+                with self._lock:
+                    running = list(self._running)
+                repository.touch_jobs(running)
+                requeue_stale()
+            except Exception:
+                logger.exception("Job heartbeat failed")
+
+
+# --- Handlers ---
+
+def _deck_type(name: str):
+    dt = deck_registry.get_deck_type(name)
+    if not dt:
+        raise ValueError(f"Unknown deck type: {name}")
+    return dt
+
+
+@handler("generate", retry=False)
+def _run_generate(params: dict, ctx: JobContext) -> dict:
+    """params: topic, deck_type, count, no_cache"""
+    from core import generation
+
+    deck_type = params.get("deck_type", "artwork")
+    dt = _deck_type(deck_type)
+    count = params.get("count", 3)
+    if deck_type == "artwork":
+        return generation.generate_artwork_cards(params["topic"], deck_type, count, on_progress=ctx.progress)
+    return generation.generate_for_topic(
+        params["topic"], deck_type, dt, count,
+        use_cache=not params.get("no_cache", False), on_progress=ctx.progress,
+    )
+
+
+@handler("generate_artist", retry=False)
+def _run_generate_artist(params: dict, ctx: JobContext) -> dict:
+    """params: artist_name, deck_type, limit"""
+    from core import generation
+
+    deck_type = params.get("deck_type", "artwork")
+    _deck_type(deck_type)
+    return generation.generate_artist_cards(
+        params["artist_name"], deck_type, params.get("limit", 0), on_progress=ctx.progress
+    )
+
+
+@handler("import")
+def _run_import(params: dict, ctx: JobContext) -> dict:
+    """params: path, deck_type, compute_embeddings, incremental, with_media, workers,
+    delete_after (remove an uploaded file when done)"""
+    from core.apkg_import import import_apkg
+
+    path = params["path"]
+    try:
+        return import_apkg(
+            path,
+            deck_type=params.get("deck_type", "artwork"),
+            compute_embeddings=params.get("compute_embeddings", True),
+            on_progress=ctx.progress,
+            incremental=params.get("incremental", False),
+            with_media=params.get("with_media", True),
+            workers=params.get("workers", 2),
+        )
+    finally:
+        if params.get("delete_after"):
+            Path(path).unlink(missing_ok=True)
+
+
+@handler("export")
+def _run_export(params: dict, ctx: JobContext) -> dict:
+    """params: card_ids, or deck_type + status (default ACCEPTED), or
+    deck_type + delta (only cards accepted, or edited since they were exported); deck_name,
+    max_part_mb (split a full export into several packages), refetch_missing
+    (re-download images whose file is missing). Single-package exports go
+    through the artifact cache (export.artifacts)."""
+    from export import artifacts
+    from export.genanki_export import export_cards_parts, export_delta
+
+    deck_name = params.get("deck_name", "Great Works of Art")
+    refetch_missing = params.get("refetch_missing", False)
+    if params.get("delta"):
+        dt = _deck_type(params.get("deck_type", "artwork"))
+        output_path, cards = export_delta(
+            dt, deck_name=deck_name, on_progress=ctx.progress, refetch_missing=refetch_missing,
+        )
+        if output_path is None:
+            return {"exported": 0, "message": "Nothing changed since the last export"}
+        repository.mark_cards_exported(cards)
+        return {"path": str(output_path), "filename": output_path.name, "exported": len(cards)}
+
+    if params.get("card_ids"):
+        cards = repository.get_cards(card_ids=params["card_ids"])
+    else:
+        cards = repository.get_cards(
+            deck_type=params.get("deck_type", "artwork"), status=params.get("status") or "ACCEPTED"
+        )
+    if not cards:
+        return {"error": "No cards found to export"}
+
+    dt = _deck_type(cards[0].deck_type)
+    max_part_mb = params.get("max_part_mb")
+    if max_part_mb:
+        paths, manifest = export_cards_parts(
+            cards, dt, deck_name=deck_name, on_progress=ctx.progress,
+            max_part_bytes=int(max_part_mb * 1024 * 1024), refetch_missing=refetch_missing,
+        )
+        result = {"path": str(paths[0]), "filename": paths[0].name, "parts": [p.name for p in paths]}
+    else:
+        artifact = artifacts.build_artifact(
+            cards, dt, deck_name=deck_name, on_progress=ctx.progress, refetch_missing=refetch_missing,
+        )
+        manifest = artifact["manifest"]
+        path = artifacts.artifact_path(artifact)
+        result = {"path": str(path), "filename": path.name, "parts": [path.name], "artifact": artifact["key"]}
+    repository.mark_cards_exported(cards)
+    return {**result, "exported": len(cards), "media": manifest}
@@ -0,0 +1,84 @@
+"""
+Persistent response cache for Gemini calls.
+
+Identical (model, prompt, generation config) requests — retried runs,
+repeated topics, tests — are answered from SQLite instead of spending
+quota. Opt-in via LLM_CACHE_ENABLED=true; entries expire after
+LLM_CACHE_TTL seconds and are deleted by prune(), which store() runs at
+most once per PRUNE_INTERVAL. Callers can bypass it per call (use_cache=False).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from core.config import settings
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 3600  # seconds between purges of expired entries, per process
+
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+_last_prune = 0.0
+
+
+def cache_key(model: str, prompt: str, config: dict | None = None) -> str:
+    payload = json.dumps({"model": model, "prompt": prompt, "config": config or {}}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_enabled(use_cache: bool = True) -> bool:
+    return use_cache and settings.llm_cache_enabled
+
+
+def lookup(key: str) -> str | None:
+    """Return the cached response for key, or None. Counts towards the hit rate."""
+    global _hits, _misses
+    response = repository.get_cached_response(key, max_age_seconds=settings.llm_cache_ttl)
+    with _lock:
+        if response is None:
+            _misses += 1
+        else:
+            _hits += 1
+    return response
+
+
+def store(key: str, model: str, response: str):
+    global _last_prune
+    repository.save_cached_response(key, model, response)
+    now = time.time()
+    with _lock:
+        due = now - _last_prune >= PRUNE_INTERVAL
+        if due:
+            _last_prune = now
+    if due:
+        prune()
+
+
+def prune(ttl: float | None = None) -> int:
+    """Delete entries older than ttl seconds (default LLM_CACHE_TTL)."""
+    ttl = settings.llm_cache_ttl if ttl is None else ttl
+    deleted = repository.delete_cached_responses(time.time() - ttl)
+    if deleted:
+        logger.info("Pruned %d expired LLM cache entries", deleted)
+    return deleted
+
+
+def stats() -> dict:
+    """Hit-rate for this process plus totals persisted across runs."""
+    with _lock:
+        hits, misses = _hits, _misses
+    lookups = hits + misses
+    return {
+        "enabled": settings.llm_cache_enabled,
+        "session_hits": hits,
+        "session_misses": misses,
+        "session_hit_rate": round(hits / lookups, 3) if lookups else None,
+        **repository.get_llm_cache_stats(),
+    }
@@ -12,6 +12,7 @@ import requests
 from gtts import gTTS
 from urllib.parse import urlparse, quote
 
+from core import metrics
 from core.config import MEDIA_DIR
 
 logger = logging.getLogger(__name__)
@@ -118,6 +119,7 @@ def _search_wikipedia_lang(lang: str, queries: list[str]) -> list[str]:
     return candidates
 
 
+@metrics.timed("media.search", source="wikipedia")
 def search_wikipedia(title: str, artist: str) -> list[str]:
     """
     Search Wikipedia for the painting's article and extract the painting image.
@@ -148,6 +150,7 @@ def search_wikipedia(title: str, artist: str) -> list[str]:
     return []
 
 
+@metrics.timed("media.search", source="wikidata")
 def search_wikidata(title: str, artist: str) -> list[str]:
     """
     Query Wikidata for the painting entity and get its image.
@@ -276,6 +279,7 @@ def _commons_filename_to_url(filename: str) -> str | None:
     return None
 
 
+@metrics.timed("media.search", source="commons")
 def search_wikimedia(query: str, title: str = "", artist: str = "") -> list[str]:
     """Search Wikimedia Commons directly with art-relevance scoring."""
     url = "https://commons.wikimedia.org/w/api.php"
@@ -358,6 +362,7 @@ def search_wikimedia(query: str, title: str = "", artist: str = "") -> list[str]
     return candidates
 
 
+@metrics.timed("media.search", source="duckduckgo")
 def search_duckduckgo(query: str) -> list[str]:
     """Last resort fallback via DuckDuckGo image search."""
     search_query = f"{query} painting artwork"
@@ -450,6 +455,7 @@ def _google_images_url(title: str, artist: str) -> str:
     return f"https://www.google.com/search?tbm=isch&q={quote(query)}"
 
 
+@metrics.timed("media.search", source="wikipedia_fairuse")
 def search_wikipedia_fairuse(title: str, artist: str) -> list[str]:
     """
     Find fair-use images of copyrighted paintings from Wikipedia articles.
@@ -655,6 +661,7 @@ def search_images(title: str = "", artist: str = "", query: str = "") -> tuple[l
 
 # --- 2. DOWNLOADER ---
 
+@metrics.timed("media.download")
 def download_image(urls: list[str] | str) -> tuple[str, bytes] | None:
     """
     Downloads from a list of URLs until one works.
@@ -758,9 +765,10 @@ def fetch_images_batch(
     results = {}
     total = len(tasks)
 
+    fetch = metrics.bind(_fetch_single_image)
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         futures = {
-            executor.submit(_fetch_single_image, card_id, title, artist): card_id
+            executor.submit(fetch, card_id, title, artist): card_id
             for card_id, title, artist in tasks
         }
 
@@ -0,0 +1,275 @@
+"""
+Lightweight timing instrumentation.
+
+Hot-path stages (Wikidata SPARQL and entity search, each image source,
+image downloads, LLM calls, embeddings, repository writes) are wrapped in
+span()/timed(). Every span is recorded in a process-wide histogram, served
+in Prometheus text format by /api/metrics, and in whichever collect()
+blocks are active in the current context: the API middleware collects per
+request (reported as a Server-Timing header), and generation pipelines
+collect per run (stored on the runs row). Context follows asyncio tasks
+and asyncio.to_thread; plain threads start with no collector, so work
+handed to a thread pool is wrapped in bind().
+"""
+from __future__ import annotations
+
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+
+_lock = threading.Lock()
+_stages: dict[tuple, _Histogram] = {}  # (stage, sorted label items) -> histogram
+_stage_errors: dict[tuple, int] = {}
+_requests: dict[tuple, _Histogram] = {}  # (method, route, status) -> histogram
+_in_flight = 0
+
+
+class Timings:
+    """Per-stage totals for one collect() block. Spans also count towards
+    every enclosing collector."""
+
+    def __init__(self, parent: Timings | None = None):
+        self.parent = parent
+        self.stages: dict[str, list] = {}  # stage -> [count, seconds]
+        self.run_ids: list[int] = []
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        collector = self
+        while collector is not None:
+            with collector._lock:
+                entry = collector.stages.setdefault(stage, [0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+            collector = collector.parent
+
+    def note_run(self, run_id: int):
+        collector = self
+        while collector is not None:
+            collector.run_ids.append(run_id)
+            collector = collector.parent
+
+    def summary(self) -> dict:
+        """{"elapsed_seconds": ..., "stages": {stage: {"count", "seconds"}}}, slowest stage first."""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda kv: kv[1][1], reverse=True)
+        return {
+            "elapsed_seconds": round(time.perf_counter() - self.started, 3),
+            "stages": {name: {"count": n, "seconds": round(s, 3)} for name, (n, s) in stages},
+        }
+
+
+_current: contextvars.ContextVar[Timings | None] = contextvars.ContextVar("metrics_timings", default=None)
+
+
+@contextmanager
+def collect() -> Iterator[Timings]:
+    """Collect the spans run in this context (and nested ones) into a Timings."""
+    timings = Timings(parent=_current.get())
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def note_run(run_id: int):
+    """Attach a generation run to the active collectors (see core.generation.run_timings)."""
+    timings = _current.get()
+    if timings is not None:
+        timings.note_run(run_id)
+
+
+def bind(fn):
+    """Wrap fn so that, run in a worker thread, its spans reach the collectors
+    active where bind() was called (e.g. executor.submit(bind(fn), ...))."""
+    timings = _current.get()
+
+    @functools.wraps(fn)
+    def bound(*args, **kwargs):
+        token = _current.set(timings)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return bound
+
+
+def record(stage: str, seconds: float, error: bool = False, **labels: str):
+    key = (stage, tuple(sorted(labels.items())))
+    with _lock:
+        _stages.setdefault(key, _Histogram()).observe(seconds)
+        if error:
+            _stage_errors[key] = _stage_errors.get(key, 0) + 1
+    timings = _current.get()
+    if timings is not None:
+        name = stage + "".join(f".{v}" for _, v in key[1])
+        timings.add(name, seconds)
+
+
+@contextmanager
+def span(stage: str, **labels: str):
+    """Time the enclosed block as `stage` (an exception counts as an error)."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, error, **labels)
+
+
+def timed(stage: str, **labels: str):
+    """Decorator form of span() for plain, async and generator functions.
+    For a generator only the time spent producing items counts, not the
+    time its consumer spends between them."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, **labels):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                gen = fn(*args, **kwargs)
+                elapsed = 0.0
+                error = False
+                try:
+                    while True:
+                        start = time.perf_counter()
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            return
+                        except Exception:
+                            error = True
+                            raise
+                        finally:
+                            elapsed += time.perf_counter() - start
+                        yield item
+                finally:
+                    gen.close()
+                    record(stage, elapsed, error, **labels)
+            return gen_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# --- HTTP requests (see the middleware in main.py) ---
+
+def request_started():
+    global _in_flight
+    with _lock:
+        _in_flight += 1
+
+
+def request_finished():
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+def record_request(method: str, route: str, status: int, seconds: float):
+    with _lock:
+        _requests.setdefault((method, route, str(status)), _Histogram()).observe(seconds)
+
+
+def server_timing(timings: Timings, total_seconds: float, limit: int = 10) -> str:
+    """Server-Timing header value: the slowest stages so far, plus the total."""
+    parts = [
+        f"{name};dur={stage['seconds'] * 1000:.1f}"
+        for name, stage in list(timings.summary()["stages"].items())[:limit]
+    ]
+    parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# --- Prometheus exposition ---
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    return ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs)
+
+
+def _histogram_lines(name: str, labels: str, h: _Histogram) -> list[str]:
+    sep = "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, n in zip(BUCKETS, h.buckets):
+        cumulative += n
+        lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {h.count}')
+    lines.append(f"{name}_sum{{{labels}}} {h.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {h.count}")
+    return lines
+
+
+def render_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format (0.0.4)."""
+    with _lock:
+        stages = sorted(_stages.items())
+        errors = sorted(_stage_errors.items())
+        requests = sorted(_requests.items())
+        in_flight = _in_flight
+
+    lines = [
+        "# HELP anki_stage_duration_seconds Time spent in instrumented stages.",
+        "# TYPE anki_stage_duration_seconds histogram",
+    ]
+    for (stage, extra), h in stages:
+        lines += _histogram_lines("anki_stage_duration_seconds", _labels((("stage", stage),) + extra), h)
+    lines += [
+        "# HELP anki_stage_errors_total Instrumented stages that raised.",
+        "# TYPE anki_stage_errors_total counter",
+    ]
+    for (stage, extra), n in errors:
+        lines.append(f"anki_stage_errors_total{{{_labels((('stage', stage),) + extra)}}} {n}")
+    lines += [
+        "# HELP anki_http_request_duration_seconds HTTP request latency until the response starts.",
+        "# TYPE anki_http_request_duration_seconds histogram",
+    ]
+    for (method, route, status), h in requests:
+        labels = _labels((("method", method), ("route", route), ("status", status)))
+        lines += _histogram_lines("anki_http_request_duration_seconds", labels, h)
+    lines += [
+        "# HELP anki_http_requests_in_flight HTTP requests being handled.",
+        "# TYPE anki_http_requests_in_flight gauge",
+        f"anki_http_requests_in_flight {in_flight}",
+    ]
+    return "\n".join(lines) + "\n"
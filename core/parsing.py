@@ -1,41 +1,224 @@
 from __future__ import annotations
 
+import json
 import logging
 import re
+from functools import lru_cache
+from typing import Iterable, Iterator
 
 logger = logging.getLogger(__name__)
 
+_PAREN_SUFFIX_RE = re.compile(r"\s*\(.*?\)\s*$")
+_YEAR_SUFFIX_RE = re.compile(r"\s*\d{4}\s*$")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=65536)
+def base_title(title: str) -> str:
+    """Normalize a title for dedup/grouping: remove dates, parentheticals, collapse whitespace.
+
+    Cached: the same titles are normalized over and over when building
+    "existing titles" sets and grouping Wikidata results.
+    """
+    t = title.lower().strip()
+    # Remove parenthetical suffixes like "(study)" or "(detail)"
+    t = _PAREN_SUFFIX_RE.sub("", t)
+    # Remove trailing years
+    t = _YEAR_SUFFIX_RE.sub("", t)
+    # Collapse whitespace
+    return _WHITESPACE_RE.sub(" ", t).strip()
+
+
+def artist_key(artist: str) -> str:
+    """Normalize an artist name for dedup lookups: lowercase, collapse whitespace."""
+    return _WHITESPACE_RE.sub(" ", artist.lower()).strip()
+
+
+_TOPIC_MARKER_RE = re.compile(r"^\W*=+\s*TOPIC\s+(\d+)\s*=+\W*$", re.IGNORECASE | re.MULTILINE)
+
+
+def topic_marker(index: int) -> str:
+    """Section marker used by batch prompts to delimit per-topic output (1-based)."""
+    return f"=== TOPIC {index} ==="
 
-def smart_parse(raw_text: str, fields: list[str]) -> list[dict]:
-    """Parses the pipe-separated text from Agent 2 into a list of dicts."""
-    parsed_cards = []
-    clean_text = raw_text.replace("```markdown", "").replace("```text", "").replace("```", "").strip()
-    lines = clean_text.split("\n")
-    expected_count = len(fields)
 
-    for line in lines:
-        line = re.sub(r"^[\d\)\.\-\*]+\s*", "", line).strip()
-        if not line or "|" not in line:
+def split_topic_sections(raw_text: str, num_topics: int) -> dict[int, str]:
+    """Split a batch response into {topic_index: section_text} using topic_marker lines.
+    Unknown indexes are ignored; a repeated index keeps its text appended."""
+    sections: dict[int, str] = {}
+    matches = list(_TOPIC_MARKER_RE.finditer(raw_text))
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        index = int(m.group(1))
+        if not 1 <= index <= num_topics:
             continue
+        body = raw_text[m.end():nxt.start() if nxt else len(raw_text)]
+        sections[index] = sections.get(index, "") + body
+    return sections
 
-        parts = [p.strip() for p in line.split("|")]
 
-        # Handle trailing empty part from trailing pipe
-        if len(parts) == expected_count + 1 and parts[-1] == "":
-            parts.pop()
+_CODE_FENCES = ("```markdown", "```text", "```json", "```")
+_LINE_PREFIX_RE = re.compile(r"^[\d\)\.\-\*]+\s*")
 
-        # Pad with empty strings if we're short (AI sometimes drops trailing empty fields)
-        while len(parts) < expected_count:
-            parts.append("")
 
-        # Truncate if we have too many (AI sometimes adds extra)
-        if len(parts) > expected_count:
-            parts = parts[:expected_count]
+def _strip_fences(text: str) -> str:
+    for fence in _CODE_FENCES:
+        text = text.replace(fence, "")
+    return text
 
-        if len(parts) == expected_count:
-            row = {fields[i]: parts[i] for i in range(expected_count)}
-            parsed_cards.append(row)
-        else:
-            logger.warning("Skipping line with %d fields (expected %d): %s", len(parts), expected_count, line[:100])
 
+def new_parse_stats(mode: str = "pipe") -> dict:
+    """Counters for one parsed generation: rows kept, dropped and repaired."""
+    return {"mode": mode, "parsed": 0, "dropped": 0, "repaired": 0}
+
+
+def _count(stats: dict | None, key: str):
+    if stats is not None:
+        stats[key] += 1
+
+
+def _parse_line(line: str, fields: list[str], stats: dict | None = None) -> dict | None:
+    """Parse one pipe-separated line into a field dict, or None if it isn't a card line."""
+    expected_count = len(fields)
+    line = _LINE_PREFIX_RE.sub("", line).strip()
+    if not line or "|" not in line:
+        return None
+
+    parts = [p.strip() for p in line.split("|")]
+
+    # Handle trailing empty part from trailing pipe
+    if len(parts) == expected_count + 1 and parts[-1] == "":
+        parts.pop()
+
+    repaired = len(parts) != expected_count
+    # Pad with empty strings if we're short (AI sometimes drops trailing empty fields)
+    while len(parts) < expected_count:
+        parts.append("")
+
+    # Truncate if we have too many (AI sometimes adds extra, or a "|" inside a field shifted the row)
+    if len(parts) > expected_count:
+        parts = parts[:expected_count]
+
+    if not parts[0]:
+        logger.warning("Dropping line with an empty %s: %s", fields[0], line[:100])
+        _count(stats, "dropped")
+        return None
+    _count(stats, "parsed")
+    if repaired:
+        _count(stats, "repaired")
+    return {fields[i]: parts[i] for i in range(expected_count)}
+
+
+def smart_parse(raw_text: str, fields: list[str], stats: dict | None = None) -> list[dict]:
+    """Parses the pipe-separated text from Agent 2 into a list of dicts.
+    Pass a new_parse_stats() dict to count dropped/repaired rows."""
+    clean_text = _strip_fences(raw_text).strip()
+    parsed_cards = []
+    for line in clean_text.split("\n"):
+        row = _parse_line(line, fields, stats)
+        if row is not None:
+            parsed_cards.append(row)
     return parsed_cards
+
+
+def decode_cards_json(raw_text: str, fields: list[str], stats: dict | None = None) -> list[dict] | None:
+    """Decode and validate a structured-output response: a JSON array of card
+    objects keyed by field name (or {"cards": [...]}).
+
+    Field names are matched case-insensitively; unknown keys are dropped,
+    missing fields are filled with "" and non-string values are stringified
+    (each counted as a repair). Cards without a first field are dropped.
+    Returns None if the text is not such JSON, so callers can fall back to
+    smart_parse.
+    """
+    text = _strip_fences(raw_text).strip()
+    if not text.startswith(("[", "{")):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if isinstance(data, dict):
+        data = data.get("cards")
+    if not isinstance(data, list):
+        return None
+
+    by_lower = {f.lower(): f for f in fields}
+    cards = []
+    for item in data:
+        if not isinstance(item, dict):
+            _count(stats, "dropped")
+            continue
+        row = dict.fromkeys(fields, "")
+        repaired = len(item) != len(fields)
+        for key, value in item.items():
+            field = key if key in row else by_lower.get(str(key).strip().lower())
+            if field is None:
+                repaired = True
+                continue
+            if not isinstance(value, str):
+                value = "" if value is None else str(value)
+                repaired = True
+            row[field] = value.strip()
+        if not row[fields[0]]:
+            _count(stats, "dropped")
+            continue
+        _count(stats, "parsed")
+        if repaired:
+            _count(stats, "repaired")
+        cards.append(row)
+    return cards
+
+
+def parse_cards(raw_text: str, fields: list[str]) -> tuple[list[dict], dict]:
+    """Parse an Agent 2 response in either format: structured JSON first,
+    pipe-separated lines as the fallback. Returns (cards, stats)."""
+    stats = new_parse_stats("json")
+    cards = decode_cards_json(raw_text, fields, stats)
+    if cards is None:
+        stats = new_parse_stats("pipe")
+        cards = smart_parse(raw_text, fields, stats)
+    if stats["dropped"] or stats["repaired"]:
+        logger.info("Parsed %d cards (%s): %d dropped, %d repaired",
+                    stats["parsed"], stats["mode"], stats["dropped"], stats["repaired"])
+    return cards, stats
+
+
+class StreamParser:
+    """Incremental version of smart_parse for streamed generations.
+
+    Feed raw text chunks as they arrive; each complete line is parsed
+    immediately, so callers can act on card 1 while card N is still being
+    generated. The full raw text is kept for error reporting.
+    """
+
+    def __init__(self, fields: list[str]):
+        self.fields = fields
+        self.stats = new_parse_stats("pipe")
+        self._buffer = ""
+        self._raw_parts: list[str] = []
+
+    @property
+    def raw(self) -> str:
+        return "".join(self._raw_parts)
+
+    def feed(self, chunk: str) -> list[dict]:
+        """Add a chunk; return the cards from any lines it completed."""
+        self._raw_parts.append(chunk)
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse_lines(lines)
+
+    def close(self) -> list[dict]:
+        """Flush the final (unterminated) line."""
+        lines, self._buffer = [self._buffer], ""
+        return self._parse_lines(lines)
+
+    def parse_stream(self, chunks: Iterable[str]) -> Iterator[dict]:
+        """Yield cards from a chunk stream as soon as each line completes."""
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.close()
+
+    def _parse_lines(self, lines: list[str]) -> list[dict]:
+        rows = (_parse_line(_strip_fences(line), self.fields, self.stats) for line in lines)
+        return [row for row in rows if row is not None]
@@ -0,0 +1,225 @@
+"""
+Process-wide, quota-aware scheduler for Gemini requests.
+
+Every LLM and embedding call goes through QUOTA.acquire() before it is
+sent. Requests-per-minute and tokens-per-minute are enforced with token
+buckets; requests-per-day is counted in SQLite so the CLI, the API server
+and workers share one daily budget. Waiting callers are served in
+priority order (interactive generation before background imports), and
+a 429 from the API pauses every caller of that kind, not just the thread
+that hit it.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import date, datetime
+
+from core.config import settings
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+LLM = "llm"
+EMBEDDING = "embedding"
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BACKGROUND = 10
+
+try:
+    from zoneinfo import ZoneInfo
+    # Gemini daily quotas reset at midnight Pacific time
+    _QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+except Exception:  # tzdata missing (e.g. bare Windows): fall back to local date
+    _QUOTA_TZ = None
+
+
+class QuotaExceeded(Exception):
+    """Raised when the daily request budget for a kind of call is used up."""
+
+
+def quota_day() -> str:
+    if _QUOTA_TZ is None:
+        return date.today().isoformat()
+    return datetime.now(_QUOTA_TZ).date().isoformat()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled evenly over `period` seconds.
+    A capacity of 0 means unlimited."""
+
+    def __init__(self, capacity: int, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period if capacity else 0.0
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)."""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # oversized requests wait for a full bucket
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+    def available(self, now: float) -> int | None:
+        if not self.capacity:
+            return None
+        self._refill(now)
+        return int(self.tokens)
+
+
+class _KindState:
+    def __init__(self, rpm: int, rpd: int, tpm: int):
+        self.rpd = rpd
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.blocked_until = 0.0
+        self.waiting: list[tuple[int, int]] = []  # heap of (priority, seq)
+        # Requests counted against rpd: the SQLite total as last read, plus
+        # this process's grants (recorded to SQLite after the lock is released)
+        self.day = ""
+        self.used_today = 0
+
+    def sync_daily(self, day: str, stored: int):
+        if self.day != day:
+            self.day, self.used_today = day, 0
+        self.used_today = max(self.used_today, stored)
+
+
+class QuotaScheduler:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._kinds: dict[str, _KindState] = {}
+
+    def _state(self, kind: str) -> _KindState:
+        if kind not in self._kinds:
+            if kind == LLM:
+                limits = (settings.gemini_rpm, settings.gemini_rpd, settings.gemini_tpm)
+            else:
+                limits = (settings.embedding_rpm, settings.embedding_rpd, settings.embedding_tpm)
+            self._kinds[kind] = _KindState(*limits)
+        return self._kinds[kind]
+
+    def acquire(
+        self,
+        kind: str,
+        tokens: int = 0,
+        priority: int = PRIORITY_NORMAL,
+        cancelled: threading.Event | None = None,
+    ):
+        """Block until a request of this kind may be sent, then record it.
+        Raises QuotaExceeded if today's request budget is already spent.
+        If `cancelled` is set while waiting, give up the place in the queue
+        without taking or recording anything.
+
+        SQLite is read and written outside the lock (a busy database can
+        block for seconds); the daily check under the lock uses the count
+        cached on the kind's state."""
+        day = quota_day()
+        with self._cond:
+            state = self._state(kind)
+        stored = repository.get_quota_usage(day, kind)["requests"] if state.rpd else 0
+        granted = False
+        with self._cond:
+            state.sync_daily(day, stored)
+            ticket = (priority, next(self._seq))
+            heapq.heappush(state.waiting, ticket)
+            try:
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        return
+                    if state.waiting[0] == ticket:
+                        if state.rpd and state.used_today >= state.rpd:
+                            raise QuotaExceeded(
+                                f"Daily {kind} quota of {state.rpd} requests reached; resets at midnight Pacific time"
+                            )
+                        now = time.monotonic()
+                        wait = max(
+                            state.blocked_until - now,
+                            state.requests.wait_time(1, now),
+                            state.tokens.wait_time(tokens, now),
+                        )
+                        if wait <= 0:
+                            state.requests.take(1)
+                            state.tokens.take(tokens)
+                            # Counted here so the next caller's daily check sees it
+                            state.used_today += 1
+                            granted = True
+                            break
+                        logger.debug("Quota: %s request waiting %.1fs", kind, wait)
+                        self._cond.wait(timeout=wait)
+                    else:
+                        self._cond.wait()
+            finally:
+                state.waiting.remove(ticket)
+                heapq.heapify(state.waiting)
+                self._cond.notify_all()
+        if granted:
+            repository.record_quota_usage(day, kind, requests=1, tokens=tokens)
+
+    async def acquire_async(self, kind: str, tokens: int = 0, priority: int = PRIORITY_NORMAL):
+        """acquire() for coroutines: waits in a worker thread so the event loop
+        stays free. Cancelling the awaiting task withdraws the queued request."""
+        cancelled = threading.Event()
+        try:
+            await asyncio.to_thread(self.acquire, kind, tokens, priority, cancelled)
+        except asyncio.CancelledError:
+            cancelled.set()
+            with self._cond:
+                self._cond.notify_all()
+            raise
+
+    def backoff(self, kind: str, seconds: float):
+        """Pause all requests of this kind (e.g. after a 429 with retryDelay)."""
+        with self._cond:
+            state = self._state(kind)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    def status(self) -> dict:
+        """Remaining quota per kind of call."""
+        day = quota_day()
+        result = {"day": day}
+        usage = {kind: repository.get_quota_usage(day, kind) for kind in (LLM, EMBEDDING)}
+        with self._cond:
+            now = time.monotonic()
+            for kind in (LLM, EMBEDDING):
+                state = self._state(kind)
+                used = usage[kind]
+                result[kind] = {
+                    "requests_today": used["requests"],
+                    "tokens_today": used["tokens"],
+                    "rpd_limit": state.rpd or None,
+                    "rpd_remaining": max(state.rpd - used["requests"], 0) if state.rpd else None,
+                    "rpm_available": state.requests.available(now),
+                    "tpm_available": state.tokens.available(now),
+                    "queued": len(state.waiting),
+                    "paused_for_seconds": round(max(state.blocked_until - now, 0.0), 1),
+                }
+        return result
+
+
+QUOTA = QuotaScheduler()
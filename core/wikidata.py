@@ -16,6 +16,9 @@ from typing import List, Optional
 
 import requests
 
+from core import metrics
+from core.parsing import base_title
+
 logger = logging.getLogger(__name__)
 
 SPARQL_ENDPOINT = "https://query.wikidata.org/sparql"
@@ -125,6 +128,10 @@ LIMIT {limit}
 # P135 = movement, P276 = location, P136 = genre, P195 = collection
 TOPIC_PROPERTIES = ["P135", "P276", "P136", "P195"]
 
+# Applied to every SPARQL result row
+_QID_RE = re.compile(r"^Q\d+$")
+_YEAR_RE = re.compile(r"(\d{4})")
+
 
 def _parse_date_range(topic: str) -> Optional[tuple]:
     """Parse a date range from topic string. Returns (year_start, year_end) or None."""
@@ -148,6 +155,7 @@ def _parse_date_range(topic: str) -> Optional[tuple]:
     return None
 
 
+@metrics.timed("wikidata.entity_search")
 def _search_entity(topic: str) -> List[dict]:
     """Search Wikidata for entities matching the topic string.
     Returns list of {id, label, description} dicts."""
@@ -271,6 +279,7 @@ def _try_sparql_search(artist_name: str) -> List[dict]:
     return _execute_sparql(query)
 
 
+@metrics.timed("wikidata.sparql")
 def _execute_sparql(query: str, timeout: int = 30) -> List[dict]:
     """Execute a SPARQL query and parse results."""
     try:
@@ -312,7 +321,7 @@ def _parse_sparql_results(data: dict) -> List[dict]:
 
         title = _get_val(row, "artworkLabel") or ""
         # Skip if title is just the Q-number (unresolved label)
-        if re.match(r"^Q\d+$", title):
+        if _QID_RE.match(title):
             continue
 
         date_raw = _get_val(row, "date") or ""
@@ -353,65 +362,38 @@ def _merge_field(record: dict, field: str, new_value: Optional[str]):
             record[field] = new_value
 
 
-def base_title(title: str) -> str:
-    """Normalize a title for dedup/grouping: remove dates, parentheticals, collapse whitespace."""
-    t = title.lower().strip()
-    t = re.sub(r"\s*\(.*?\)\s*$", "", t)
-    t = re.sub(r"\s*\d{4}\s*$", "", t)
-    t = re.sub(r"\s+", " ", t).strip()
-    return t
-
-
 def _sort_for_variety(artworks: List[dict]) -> List[dict]:
     """Sort artworks so unique titles come first, similar titles later.
 
     Monet has 183 "Water Lilies" variants — we want to show diverse works
     first and group similar-titled ones at the end.
+
+    Equivalent to a round-robin over the title groups (one from each group,
+    then the seconds, etc.), but built in a single pass: each artwork is
+    dropped straight into the bucket for its position within its group.
     """
-    # Normalize title to a base form for grouping
-    def _base_title(title: str) -> str:
-        t = title.lower().strip()
-        # Remove parenthetical suffixes like "(study)" or "(detail)"
-        t = re.sub(r"\s*\(.*?\)\s*$", "", t)
-        # Remove trailing numbers/years
-        t = re.sub(r"\s*\d{4}\s*$", "", t)
-        # Collapse whitespace
-        t = re.sub(r"\s+", " ", t).strip()
-        return t
-
-    # Group by base title
-    groups = {}
+    # Group by base title (dict keeps first-seen group order)
+    groups: dict[str, List[dict]] = {}
     for art in artworks:
-        base = _base_title(art["title"])
-        if base not in groups:
-            groups[base] = []
-        groups[base].append(art)
+        groups.setdefault(base_title(art["title"]), []).append(art)
 
-    # Build result: take one from each group first (round-robin), then seconds, etc.
-    # Within each group, prefer artworks with images
+    # Within each group, prefer artworks with images, then earliest date
+    rounds: List[List[dict]] = []
     for group in groups.values():
-        group.sort(key=lambda a: (not a.get("image_url"), a.get("date", "")))
-
-    result = []
-    round_num = 0
-    while True:
-        added = False
-        for group in groups.values():
-            if round_num < len(group):
-                result.append(group[round_num])
-                added = True
-        if not added:
-            break
-        round_num += 1
+        group.sort(key=lambda a: (not a.get("image_url"), a.get("date") or ""))
+        for round_num, art in enumerate(group):
+            if round_num == len(rounds):
+                rounds.append([])
+            rounds[round_num].append(art)
 
-    return result
+    return [art for round_arts in rounds for art in round_arts]
 
 
 def _extract_year(date_str: str) -> str:
     """Extract year from ISO date string like '1886-01-01T00:00:00Z'."""
     if not date_str:
         return ""
-    match = re.match(r"(\d{4})", date_str)
+    match = _YEAR_RE.match(date_str)
     return match.group(1) if match else date_str
 
 
@@ -0,0 +1,195 @@
+"""
+Streaming .apkg writer.
+
+genanki.Package keeps every note and media path in memory and builds the
+whole collection at the end. ApkgWriter writes notes into the collection
+database in batched transactions as they are added (reusing genanki's
+schema and Note/Deck serialisation) and streams media files from disk
+into the zip. Already-compressed media is stored rather than deflated.
+With max_part_bytes set, the output is split into several complete
+packages of roughly that size; each part carries the deck and note type,
+so Anki merges them on import.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterator
+
+import genanki
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+# Formats that don't shrink when deflated
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".mp3", ".ogg", ".m4a", ".mp4", ".webm"}
+
+
+class _Part:
+    """One package being written: a temp collection DB plus its media list."""
+
+    def __init__(self, path: Path, model: genanki.Model, deck_id: int, deck_name: str, timestamp: float,
+                 id_gen: Iterator[int]):
+        self.path = path
+        self.timestamp = timestamp
+        self.deck_id = deck_id
+        fd, self.db_path = tempfile.mkstemp(prefix="apkg-", suffix=".db")
+        os.close(fd)
+        self.conn = sqlite3.connect(self.db_path)
+        self.cursor = self.conn.cursor()
+        self.id_gen = id_gen  # shared by all parts, so note and card ids never repeat across them
+        self.cursor.executescript(APKG_SCHEMA)
+        self.cursor.executescript(APKG_COL)
+        deck = genanki.Deck(deck_id, deck_name)
+        deck.add_model(model)
+        deck.write_to_db(self.cursor, timestamp, self.id_gen)  # deck + note type, no notes
+        self.media: dict[str, Path] = {}  # name in the package -> file on disk
+        self.notes = 0
+        self.bytes = 0
+
+    def write_notes(self, notes: list[genanki.Note]):
+        for note in notes:
+            note.write_to_db(self.cursor, self.timestamp, self.deck_id, self.id_gen)
+        self.conn.commit()
+        self.notes += len(notes)
+
+    def finish(self):
+        """Zip the collection and media into a temp file next to the target,
+        then move it into place, so concurrent builds of the same package
+        never interleave and readers only ever see a complete file."""
+        self.conn.commit()
+        self.conn.close()
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{self.path.stem}-", suffix=".tmp", dir=self.path.parent)
+        os.close(fd)
+        try:
+            with zipfile.ZipFile(tmp_name, "w", zipfile.ZIP_DEFLATED) as z:
+                z.write(self.db_path, "collection.anki2")
+                names = list(self.media)
+                z.writestr("media", json.dumps({str(i): name for i, name in enumerate(names)}))
+                for i, name in enumerate(names):
+                    source = self.media[name]
+                    compress = zipfile.ZIP_STORED if source.suffix.lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+                    z.write(source, str(i), compress_type=compress)  # copied in chunks
+            os.replace(tmp_name, self.path)
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+            Path(self.db_path).unlink(missing_ok=True)
+
+    def discard(self):
+        self.conn.close()
+        Path(self.db_path).unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
+
+
+class ApkgWriter:
+    """Write notes to one or more .apkg files without holding them all in memory.
+
+        with ApkgWriter(path, model, deck_id, deck_name) as writer:
+            for ...:
+                writer.add_note(note, media=[image_path])
+        writer.paths  # the written package(s)
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        model: genanki.Model,
+        deck_id: int,
+        deck_name: str,
+        batch_size: int = 500,
+        max_part_bytes: int | None = None,
+        timestamp: float | None = None,
+    ):
+        self.path = Path(path)
+        self.model = model
+        self.deck_id = deck_id
+        self.deck_name = deck_name
+        self.batch_size = batch_size
+        self.max_part_bytes = max_part_bytes
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.paths: list[Path] = []
+        self.note_counts: list[int] = []  # notes in each of paths
+        self._id_gen = itertools.count(int(self.timestamp * 1000))
+        self._pending: list[genanki.Note] = []
+        self._part: _Part | None = None
+
+    def _part_path(self, number: int) -> Path:
+        if not self.max_part_bytes:
+            return self.path
+        return self.path.with_name(f"{self.path.stem}_part{number}{self.path.suffix}")
+
+    def _start_part(self):
+        self._part = _Part(
+            self._part_path(len(self.paths) + 1), self.model, self.deck_id, self.deck_name, self.timestamp,
+            self._id_gen,
+        )
+
+    def _flush(self):
+        if self._pending:
+            self._part.write_notes(self._pending)
+            self._pending = []
+
+    def _finish_part(self):
+        self._flush()
+        self._part.finish()
+        logger.info("Wrote %s (%d notes, %d media files)", self._part.path, self._part.notes, len(self._part.media))
+        self.paths.append(self._part.path)
+        self.note_counts.append(self._part.notes)
+        self._part = None
+
+    def _note_size(self, note: genanki.Note, media: list[Path]) -> int:
+        """Bytes this note adds to the current part: its text plus media not already in it."""
+        new_media = [p for p in media if p.name not in self._part.media]
+        return sum(p.stat().st_size for p in new_media) + sum(len(f) for f in note.fields)
+
+    def add_note(self, note: genanki.Note, media: list[Path] = ()):
+        """Queue a note (written every batch_size notes) and the media files it uses."""
+        if self._part is None:
+            self._start_part()
+        size = self._note_size(note, media)
+        if (self.max_part_bytes and (self._part.notes or self._pending)
+                and self._part.bytes + size > self.max_part_bytes):
+            self._finish_part()
+            self._start_part()
+            size = self._note_size(note, media)
+
+        for p in media:
+            self._part.media[p.name] = p
+        self._part.bytes += size
+        self._pending.append(note)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def close(self) -> list[Path]:
+        """Write out the last part. Returns the paths of all parts."""
+        if self._part is None:
+            self._start_part()  # an empty deck still gets a package
+        self._finish_part()
+        return self.paths
+
+    def abort(self):
+        """Remove everything written so far."""
+        if self._part is not None:
+            self._part.discard()
+            self._part = None
+        for path in self.paths:
+            path.unlink(missing_ok=True)
+        self.paths = []
+        self.note_counts = []
+
+    def __enter__(self) -> ApkgWriter:
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,87 @@
+"""
+Cached export packages.
+
+An export artifact is a built .apkg in data/exports, keyed by a hash of
+the deck type (name and version), the deck name and every exported card's
+id and content version (updated_at). Asking for the same selection again
+while nothing has changed returns the existing file instead of rebuilding
+it; the key doubles as the download's ETag. Artifacts nobody has asked for
+within EXPORT_ARTIFACT_TTL are deleted.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Callable
+
+from core.cards import Card, DeckType
+from core.config import EXPORTS_DIR, settings
+from export.genanki_export import export_cards_parts
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+
+def artifact_key(cards: list[Card], deck_type: DeckType, deck_name: str) -> str:
+    digest = hashlib.sha256(json.dumps([deck_type.name, deck_type.version, deck_name]).encode())
+    for card in sorted(cards, key=lambda c: c.id):
+        digest.update(f"{card.id}:{card.updated_at!r}\n".encode())
+    return digest.hexdigest()
+
+
+def artifact_path(artifact: dict) -> Path:
+    return EXPORTS_DIR / artifact["filename"]
+
+
+def get_artifact(key: str, touch: bool = False) -> dict | None:
+    """The artifact with this key, or None if unknown or its file is gone."""
+    artifact = repository.get_export_artifact(key, touch=touch)
+    if artifact and not artifact_path(artifact).exists():
+        repository.delete_export_artifacts([key])
+        return None
+    return artifact
+
+
+def build_artifact(
+    cards: list[Card],
+    deck_type: DeckType,
+    deck_name: str = "Great Works of Art",
+    on_progress: Callable[[int, int, str], None] | None = None,
+    refetch_missing: bool = False,
+) -> dict:
+    """Return the artifact for these cards, building the package if needed."""
+    key = artifact_key(cards, deck_type, deck_name)
+    artifact = get_artifact(key, touch=True)
+    if artifact:
+        logger.info("Export artifact %s reused (%d cards)", key[:12], artifact["card_count"])
+        return artifact
+
+    filename = f"{deck_name.replace(' ', '_').lower()}_{key[:16]}.apkg"
+    paths, manifest = export_cards_parts(
+        cards, deck_type, deck_name=deck_name, output_filename=filename,
+        on_progress=on_progress, refetch_missing=refetch_missing,
+    )
+    if manifest["refetched"]:
+        # Re-downloaded images bumped those cards' versions (updated on the Cards)
+        key = artifact_key(cards, deck_type, deck_name)
+    path = paths[0]
+    repository.save_export_artifact(
+        key, deck_type.name, deck_name, path.name, len(cards), path.stat().st_size, manifest
+    )
+    prune_artifacts()
+    return repository.get_export_artifact(key)
+
+
+def prune_artifacts(ttl: float | None = None) -> int:
+    """Delete artifacts (rows and files) unused for longer than ttl seconds."""
+    ttl = settings.export_artifact_ttl if ttl is None else ttl
+    stale = repository.get_stale_export_artifacts(time.time() - ttl)
+    for artifact in stale:
+        artifact_path(artifact).unlink(missing_ok=True)
+    if stale:
+        repository.delete_export_artifacts([a["key"] for a in stale])
+        logger.info("Pruned %d unused export artifacts", len(stale))
+    return len(stale)
@@ -1,13 +1,19 @@
 from __future__ import annotations
 
 import logging
+import uuid
 from datetime import datetime
 from pathlib import Path
+from typing import Callable
 
 import genanki
 
+from core import deck_registry
 from core.cards import Card, DeckType
-from core.config import EXPORTS_DIR, MEDIA_DIR
+from core.config import EXPORTS_DIR
+from export.apkg_writer import ApkgWriter
+from export.media_preflight import resolve_media
+from storage import repository
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +22,9 @@ ARTWORK_MODEL_ID = 1607392319
 ARTWORK_DECK_ID = 2058400319
 
 
-def _build_genanki_model(deck_type: DeckType, model_id: int) -> genanki.Model:
-    """Build a genanki Model from a DeckType definition."""
+def _build_genanki_model(deck_type: DeckType) -> genanki.Model:
+    """Build a genanki Model from a DeckType definition (cached per deck
+    type version by core.deck_registry.genanki_model)."""
     fields = [{"name": f["name"]} for f in deck_type.fields_schema]
     templates = [
         {
@@ -28,7 +35,7 @@ def _build_genanki_model(deck_type: DeckType, model_id: int) -> genanki.Model:
         for t in deck_type.templates
     ]
     return genanki.Model(
-        model_id,
+        deck_type.anki_model_id or ARTWORK_MODEL_ID,
         "Art-a7e12",  # Match the real model name from the user's deck
         fields=fields,
         templates=templates,
@@ -41,39 +48,58 @@ def export_cards(
     deck_type: DeckType,
     deck_name: str = "Great Works of Art",
     output_filename: str | None = None,
+    on_progress: Callable[[int, int, str], None] | None = None,
+    mode: str = "full",
+    refetch_missing: bool = False,
 ) -> Path:
     """
     Export cards to an .apkg file.
     Uses real Anki model/deck IDs from imported .apkg when available,
     so the exported deck merges into the existing deck on import.
+    Every note gets the card's stable GUID (its Anki GUID if imported,
+    otherwise one assigned and saved on first export), so re-exporting an
+    edited card updates the note in Anki instead of adding a new one.
+    The export is recorded in the exports ledger under `mode`.
+    Images are checked first (see export.media_preflight); cards whose image
+    is missing keep their Artwork field instead of a broken <img>, or with
+    refetch_missing get their image downloaded again (and their Card updated
+    to the new version, which is what repository.mark_cards_exported records).
+    on_progress(done, total, message) is called per note and before writing.
     Returns the path to the generated file.
     """
-    model_id = deck_type.anki_model_id or ARTWORK_MODEL_ID
-    deck_id = deck_type.anki_deck_id or ARTWORK_DECK_ID
-    model = _build_genanki_model(deck_type, model_id)
-    deck = genanki.Deck(deck_id, deck_name)
-
-    media_files = []
-    field_names = [f["name"] for f in deck_type.fields_schema]
+    paths, _ = export_cards_parts(
+        cards, deck_type, deck_name, output_filename, on_progress, mode, refetch_missing=refetch_missing
+    )
+    return paths[0]
 
-    for card in cards:
-        fields = card.fields_json
-        field_values = []
 
-        for fname in field_names:
-            value = fields.get(fname, "")
+def export_cards_parts(
+    cards: list[Card],
+    deck_type: DeckType,
+    deck_name: str = "Great Works of Art",
+    output_filename: str | None = None,
+    on_progress: Callable[[int, int, str], None] | None = None,
+    mode: str = "full",
+    max_part_bytes: int | None = None,
+    refetch_missing: bool = False,
+) -> tuple[list[Path], dict]:
+    """
+    export_cards, split into packages of about max_part_bytes each (notes
+    plus media) when set. Notes are written to the collection in batches
+    and media is streamed into the zip (see export.apkg_writer), so memory
+    use doesn't grow with the deck. Returns (paths of all parts, media
+    manifest from the pre-flight check).
+    """
+    images, manifest = resolve_media(cards, refetch=refetch_missing, on_progress=on_progress)
 
-            # Image field: wrap in <img> tag if we have a downloaded file
-            if fname == "Artwork" and card.image_filename:
-                value = f'<img src="{card.image_filename}">'
-                img_path = MEDIA_DIR / card.image_filename
-                if img_path.exists():
-                    media_files.append(str(img_path))
+    deck_id = deck_type.anki_deck_id or ARTWORK_DECK_ID
+    model = deck_registry.genanki_model(deck_type)
 
-            field_values.append(str(value))
+    guids = repository.assign_card_guids(
+        [c.id for c in cards if c.id is not None], lambda: genanki.guid_for(uuid.uuid4().hex)
+    )
 
-        note = genanki.Note(model=model, fields=field_values)
-        deck.add_note(note)
+    field_names = deck_registry.field_names(deck_type)
 
     if not output_filename:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -82,9 +108,53 @@ def export_cards(
 
     output_path = EXPORTS_DIR / output_filename
 
-    package = genanki.Package(deck)
-    package.media_files = media_files
-    package.write_to_file(str(output_path))
+    with ApkgWriter(output_path, model, deck_id, deck_name, max_part_bytes=max_part_bytes) as writer:
+        for i, card in enumerate(cards):
+            if on_progress:
+                on_progress(i, len(cards), card.fields_json.get("Title", ""))
+            fields = card.fields_json
+            field_values = []
+            media = []
+
+            for fname in field_names:
+                value = fields.get(fname, "")
 
-    logger.info("Exported %d cards to %s", len(cards), output_path)
-    return output_path
+                # Image field: wrap in <img> tag if we have a downloaded file
+                if fname == "Artwork" and i in images:
+                    value = f'<img src="{images[i].name}">'
+                    media.append(images[i])
+
+                field_values.append(str(value))
+
+            note = genanki.Note(model=model, fields=field_values, guid=guids.get(card.id))
+            writer.add_note(note, media)
+
+        if on_progress:
+            on_progress(len(cards), len(cards), f"Writing {output_filename}")
+
+    for path, count in zip(writer.paths, writer.note_counts):
+        repository.record_export(deck_type.name, deck_name, path.name, mode, count)
+    logger.info("Exported %d cards to %s", len(cards), ", ".join(str(p) for p in writer.paths))
+    return writer.paths, manifest
+
+
+def export_delta(
+    deck_type: DeckType,
+    deck_name: str = "Great Works of Art",
+    on_progress: Callable[[int, int, str], None] | None = None,
+    refetch_missing: bool = False,
+) -> tuple[Path | None, list[Card]]:
+    """
+    Export only what changed: accepted cards not exported yet, and exported
+    cards whose fields or media were edited after they were exported.
+    Returns (path, cards), or (None, []) when there is nothing new. The
+    caller marks the cards exported (repository.mark_cards_exported).
+    """
+    cards = repository.get_delta_export_cards(deck_type.name)
+    if not cards:
+        return None, []
+    path = export_cards(
+        cards, deck_type, deck_name=deck_name, on_progress=on_progress, mode="delta",
+        refetch_missing=refetch_missing,
+    )
+    return path, cards
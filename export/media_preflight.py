@@ -0,0 +1,158 @@
+"""
+Export pre-flight: resolve every card's image before the package is written.
+
+Each referenced file in MEDIA_DIR is checked for existence and a non-zero
+size in parallel. Missing or empty files can optionally be fetched again
+through the normal image pipeline (Image Source URL, then search) with a
+small concurrency limit, since that hits external sites. Files with
+identical bytes under different names are collapsed to one, so the
+package carries each image once. The result maps card id to the file to
+package, plus a manifest of counts and timings. Re-fetched cards are
+updated in place, so callers mark the version that was packaged as
+exported.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from core import metrics
+from core.cards import Card
+from core.config import MEDIA_DIR, settings
+from storage import repository
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_BYTES = 1024 * 1024
+
+
+def _check(filename: str) -> tuple[Path, int | None]:
+    """(path, size), size None if the file is missing."""
+    path = MEDIA_DIR / filename
+    try:
+        return path, path.stat().st_size
+    except OSError:
+        return path, None
+
+
+def _sha1(path: Path) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _refetch(card: Card) -> str | None:
+    from core.generation import fetch_image_for_artwork
+
+    try:
+        return fetch_image_for_artwork(card.id, {}, card.fields_json)
+    except Exception as e:
+        logger.warning("Image refetch failed for card %s: %s", card.id, e)
+        return None
+
+
+def resolve_media(
+    cards: list[Card],
+    refetch: bool = False,
+    workers: int | None = None,
+    refetch_workers: int | None = None,
+    on_progress: Callable[[int, int, str], None] | None = None,
+) -> tuple[dict[int, Path], dict]:
+    """
+    Check (and with refetch=True, repair) the images of cards about to be
+    exported. Cards are keyed by list position for the lookup, so unsaved
+    cards work too. Returns ({card index: file to package}, manifest);
+    cards missing from the map have no usable image. A card whose image was
+    re-fetched gets its new image_filename and updated_at set on the Card.
+    """
+    workers = workers or settings.export_media_workers
+    refetch_workers = refetch_workers or settings.image_refetch_workers
+    manifest = {
+        "cards": len(cards),
+        "with_image": 0,
+        "ok": 0,
+        "missing": 0,
+        "empty": 0,
+        "refetched": 0,
+        "refetch_failed": 0,
+        "duplicates": 0,
+        "unique_files": 0,
+        "bytes": 0,
+        "missing_cards": [],
+        "timings": {},
+    }
+    wanted = [(i, c) for i, c in enumerate(cards) if c.image_filename]
+    manifest["with_image"] = len(wanted)
+    if on_progress:
+        on_progress(0, len(wanted), "Checking media")
+
+    start = time.perf_counter()
+    names = sorted({c.image_filename for _, c in wanted})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        checked = dict(zip(names, pool.map(_check, names)))
+    resolved: dict[int, Path] = {}
+    sizes: dict[Path, int] = {}
+    broken: list[tuple[int, Card]] = []
+    for i, card in wanted:
+        path, size = checked[card.image_filename]
+        if size:
+            resolved[i] = path
+            sizes[path] = size
+            manifest["ok"] += 1
+        else:
+            manifest["missing" if size is None else "empty"] += 1
+            broken.append((i, card))
+    manifest["timings"]["check_seconds"] = round(time.perf_counter() - start, 3)
+
+    if broken and refetch:
+        start = time.perf_counter()
+        if on_progress:
+            on_progress(manifest["ok"], len(wanted), f"Re-fetching {len(broken)} missing images")
+        with ThreadPoolExecutor(max_workers=refetch_workers) as pool:
+            fetched = list(pool.map(metrics.bind(lambda item: _refetch(item[1])), broken))
+        versions = repository.get_card_versions([c.id for (_, c), f in zip(broken, fetched) if f and c.id])
+        still_broken = []
+        for (i, card), filename in zip(broken, fetched):
+            path, size = _check(filename) if filename else (None, None)
+            if size:
+                resolved[i] = path
+                sizes[path] = size
+                manifest["refetched"] += 1
+                card.image_filename = filename
+                card.updated_at = versions.get(card.id, card.updated_at)
+            else:
+                manifest["refetch_failed"] += 1
+                still_broken.append((i, card))
+        broken = still_broken
+        manifest["timings"]["refetch_seconds"] = round(time.perf_counter() - start, 3)
+    manifest["missing_cards"] = [card.id for _, card in broken]
+
+    # Same bytes under different names: only files sharing a size are hashed
+    start = time.perf_counter()
+    by_size: dict[int, list[Path]] = {}
+    for path, size in sizes.items():
+        by_size.setdefault(size, []).append(path)
+    to_hash = [p for group in by_size.values() if len(group) > 1 for p in group]
+    canonical: dict[Path, Path] = {}
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            first_by_hash: dict[str, Path] = {}
+            for path, digest in zip(to_hash, pool.map(_sha1, to_hash)):
+                canonical[path] = first_by_hash.setdefault(digest, path)
+    for i, path in resolved.items():
+        resolved[i] = canonical.get(path, path)
+    unique = set(resolved.values())
+    manifest["duplicates"] = len(sizes) - len(unique)
+    manifest["unique_files"] = len(unique)
+    manifest["bytes"] = sum(sizes[p] for p in unique)
+    manifest["timings"]["dedup_seconds"] = round(time.perf_counter() - start, 3)
+
+    if broken:
+        logger.warning("%d cards have no usable image and are exported without one", len(broken))
+    return resolved, manifest
@@ -1,18 +1,75 @@
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
-
-import storage.database  # triggers init_db()
+from starlette.datastructures import MutableHeaders
 
 from api.routes_generate import router as generate_router
 from api.routes_cards import router as cards_router
 from api.routes_analytics import router as analytics_router
+from api.routes_jobs import router as jobs_router
+from core import jobs, metrics
+from core.config import settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Run background jobs in-process unless a separate `cli.py worker` handles them
+    pool = jobs.WorkerPool(settings.job_workers) if settings.job_workers > 0 else None
+    if pool:
+        pool.start()
+    yield
+    if pool:
+        pool.stop()
+
+
+class TimingMiddleware:
+    """Records request latency per route (until the response starts, so
+    event streams count their time to first byte) for /api/metrics, and
+    reports the request's slowest stages in a Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        recorded = False
+
+        def record(status: int) -> float:
+            nonlocal recorded
+            elapsed = time.perf_counter() - start
+            if not recorded:
+                recorded = True
+                route = getattr(scope.get("route"), "path", "unmatched")
+                metrics.record_request(scope["method"], route, status, elapsed)
+            return elapsed
+
+        metrics.request_started()
+        with metrics.collect() as timings:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    elapsed = record(message["status"])
+                    MutableHeaders(scope=message).append("Server-Timing", metrics.server_timing(timings, elapsed))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                record(500)  # no-op once the response has started
+                metrics.request_finished()
+
 
-app = FastAPI(title="Anki Card Generator", version="2.0")
+app = FastAPI(title="Anki Card Generator", version="2.0", lifespan=lifespan)
 
+app.add_middleware(TimingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -24,6 +81,7 @@ app.add_middleware(
 app.include_router(generate_router)
 app.include_router(cards_router)
 app.include_router(analytics_router)
+app.include_router(jobs_router)
 
 # Serve card media files
 MEDIA_DIR = Path("data/media")
@@ -1,6 +1,13 @@
-import sqlite3
 import json
+import logging
+import re
+import sqlite3
+import threading
+
 from core.config import settings
+from core.parsing import artist_key, base_title
+
+logger = logging.getLogger(__name__)
 
 # Exact match of the real "Great Works of Art" deck from the user's .apkg
 ARTWORK_DECK_TYPE = {
@@ -77,14 +84,39 @@ background-color: black }
 }
 
 
+_schema_ready: set[str] = set()
+_schema_lock = threading.Lock()
+
+
 def get_connection():
-    return sqlite3.connect(settings.db_path)
+    """Open a connection, bringing the schema up to date on first use in this process."""
+    if settings.db_path not in _schema_ready:
+        init_db()
+    # Background job workers write concurrently with requests; wait for locks rather than fail
+    return sqlite3.connect(settings.db_path, timeout=30)
 
 
-def init_db():
-    conn = get_connection()
-    c = conn.cursor()
+def card_keys(fields: dict) -> tuple[str, str]:
+    """Normalized (title_key, artist_key) stored alongside a card's fields."""
+    return base_title(fields.get("Title", "") or ""), artist_key(fields.get("Artist", "") or "")
+
+
+# --- Migrations ---
+#
+# Each migration brings the schema from version N-1 to N (tracked in
+# PRAGMA user_version). Append new ones to MIGRATIONS; never edit a
+# migration that has shipped. Databases created before versioning start
+# at 0, so early migrations probe for existing tables/columns.
+
+def _add_missing_columns(c: sqlite3.Cursor, table: str, columns: dict[str, str]):
+    c.execute(f"PRAGMA table_info({table})")
+    existing_cols = {row[1] for row in c.fetchall()}
+    for name, col_type in columns.items():
+        if name not in existing_cols:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
 
+def _migrate_initial_schema(c: sqlite3.Cursor):
     c.execute("""CREATE TABLE IF NOT EXISTS deck_types (
         name TEXT PRIMARY KEY,
         fields_schema TEXT NOT NULL,
@@ -122,13 +154,8 @@ def init_db():
     c.execute("CREATE INDEX IF NOT EXISTS idx_cards_status ON cards(status)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_cards_deck_type ON cards(deck_type)")
 
-    # Migration: add anki_model_id, anki_deck_id columns if missing
-    c.execute("PRAGMA table_info(deck_types)")
-    existing_cols = {row[1] for row in c.fetchall()}
-    if "anki_model_id" not in existing_cols:
-        c.execute("ALTER TABLE deck_types ADD COLUMN anki_model_id INTEGER")
-    if "anki_deck_id" not in existing_cols:
-        c.execute("ALTER TABLE deck_types ADD COLUMN anki_deck_id INTEGER")
+    # Databases from before the Anki ID columns existed
+    _add_missing_columns(c, "deck_types", {"anki_model_id": "INTEGER", "anki_deck_id": "INTEGER"})
 
     # Seed artwork deck type
     c.execute(
@@ -141,8 +168,379 @@ def init_db():
         ),
     )
 
-    conn.commit()
-    conn.close()
+
+def _migrate_card_keys(c: sqlite3.Cursor):
+    """Normalized title/artist keys for indexed dedup lookups."""
+    _add_missing_columns(c, "cards", {"title_key": "TEXT", "artist_key": "TEXT"})
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cards_title_key ON cards(deck_type, title_key)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cards_artist_key ON cards(deck_type, artist_key)")
+
+    # Frozen copy of base_title/artist_key as of this migration: the live
+    # normalization may change, but the backfill must not.
+    def keys(fields: dict) -> tuple[str, str]:
+        title = (fields.get("Title", "") or "").lower().strip()
+        title = re.sub(r"\s*\(.*?\)\s*$", "", title)
+        title = re.sub(r"\s*\d{4}\s*$", "", title)
+        artist = (fields.get("Artist", "") or "").lower()
+        return re.sub(r"\s+", " ", title).strip(), re.sub(r"\s+", " ", artist).strip()
+
+    c.execute("SELECT id, fields_json FROM cards WHERE title_key IS NULL")
+    rows = c.fetchall()
+    if rows:
+        c.executemany(
+            "UPDATE cards SET title_key = ?, artist_key = ? WHERE id = ?",
+            [(*keys(json.loads(fields_str)), card_id) for card_id, fields_str in rows],
+        )
+
+
+# Card fields mirrored into the full-text index: (fts column, fields_json key)
+FTS_FIELDS = [
+    ("title", "Title"),
+    ("artist", "Artist"),
+    ("movement", "Period/Movement"),
+    ("location", "Permanent Location"),
+    ("note", "Note"),
+]
+
+
+def _migrate_cards_fts(c: sqlite3.Cursor):
+    """FTS5 index over the searchable card fields, kept in sync by triggers."""
+    cols = ", ".join(col for col, _ in FTS_FIELDS)
+    values = ", ".join(f"json_extract(new.fields_json, '$.\"{key}\"')" for _, key in FTS_FIELDS)
+
+    c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts USING fts5({cols}, tokenize='unicode61 remove_diacritics 2')")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_fts_insert AFTER INSERT ON cards BEGIN
+        INSERT INTO cards_fts(rowid, {cols}) VALUES (new.id, {values});
+    END""")
+    c.execute("""CREATE TRIGGER IF NOT EXISTS cards_fts_delete AFTER DELETE ON cards BEGIN
+        DELETE FROM cards_fts WHERE rowid = old.id;
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_fts_update AFTER UPDATE OF fields_json ON cards BEGIN
+        DELETE FROM cards_fts WHERE rowid = old.id;
+        INSERT INTO cards_fts(rowid, {cols}) VALUES (new.id, {values});
+    END""")
+
+    c.execute("DELETE FROM cards_fts")
+    c.execute(f"INSERT INTO cards_fts(rowid, {cols}) SELECT id, {values.replace('new.', '')} FROM cards")
+
+
+def _migrate_llm_cache(c: sqlite3.Cursor):
+    """Persistent Gemini response cache (see core.llm_cache)."""
+    c.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        model TEXT NOT NULL,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )""")
+
+
+def _migrate_quota_usage(c: sqlite3.Cursor):
+    """Daily Gemini request/token counters shared by every process (see core.quota)."""
+    c.execute("""CREATE TABLE IF NOT EXISTS quota_usage (
+        day TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        requests INTEGER NOT NULL DEFAULT 0,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, kind)
+    )""")
+
+
+def _migrate_run_parse_stats(c: sqlite3.Cursor):
+    """Per-run parse outcome: output format and rows dropped/repaired by the parser."""
+    _add_missing_columns(c, "runs", {
+        "parse_mode": "TEXT",
+        "rows_dropped": "INTEGER DEFAULT 0",
+        "rows_repaired": "INTEGER DEFAULT 0",
+    })
+
+
+def _migrate_jobs(c: sqlite3.Cursor):
+    """Persistent background jobs (see core.jobs). Times are unix seconds."""
+    c.execute("""CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'QUEUED',
+        progress_done INTEGER NOT NULL DEFAULT 0,
+        progress_total INTEGER NOT NULL DEFAULT 0,
+        progress_message TEXT,
+        result TEXT,
+        error TEXT,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        heartbeat_at REAL
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+
+
+def _migrate_anki_note_keys(c: sqlite3.Cursor):
+    """Source note of imported cards, for incremental re-imports (anki_mod is
+    the note's modification time in unix seconds)."""
+    _add_missing_columns(c, "cards", {
+        "anki_note_id": "INTEGER",
+        "anki_guid": "TEXT",
+        "anki_mod": "INTEGER",
+    })
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cards_anki_note ON cards(deck_type, anki_note_id)")
+
+
+_UNIX_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+def _migrate_export_ledger(c: sqlite3.Cursor):
+    """cards.updated_at (unix seconds, kept current by triggers on content
+    changes) and a ledger of exports, for delta exports."""
+    _add_missing_columns(c, "cards", {"updated_at": "REAL"})
+    c.execute("UPDATE cards SET updated_at = CAST(strftime('%s', created_at) AS REAL) WHERE updated_at IS NULL")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_updated_at_insert AFTER INSERT ON cards BEGIN
+        UPDATE cards SET updated_at = {_UNIX_NOW} WHERE id = new.id;
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_updated_at_update
+        AFTER UPDATE OF fields_json, image_filename, audio_filename ON cards BEGIN
+        UPDATE cards SET updated_at = {_UNIX_NOW} WHERE id = new.id;
+    END""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cards_updated_at ON cards(deck_type, updated_at)")
+    c.execute("""CREATE TABLE IF NOT EXISTS exports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        deck_type TEXT NOT NULL,
+        deck_name TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        mode TEXT NOT NULL,
+        card_count INTEGER NOT NULL,
+        created_at REAL NOT NULL
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_exports_deck ON exports(deck_type, deck_name, created_at)")
+
+
+def _migrate_deck_type_versions(c: sqlite3.Cursor):
+    """deck_types.version, bumped by a trigger whenever the schema, templates,
+    CSS or Anki IDs change, so cached deck types can be revalidated cheaply."""
+    _add_missing_columns(c, "deck_types", {"version": "INTEGER NOT NULL DEFAULT 1"})
+    c.execute("""CREATE TRIGGER IF NOT EXISTS deck_types_version
+        AFTER UPDATE OF fields_schema, templates, css, anki_model_id, anki_deck_id ON deck_types
+        WHEN old.fields_schema IS NOT new.fields_schema OR old.templates IS NOT new.templates
+            OR old.css IS NOT new.css OR old.anki_model_id IS NOT new.anki_model_id
+            OR old.anki_deck_id IS NOT new.anki_deck_id
+    BEGIN
+        UPDATE deck_types SET version = old.version + 1 WHERE name = new.name;
+    END""")
+
+
+def _migrate_export_artifacts(c: sqlite3.Cursor):
+    """Built .apkg packages in data/exports, keyed by a hash of the exported
+    cards' ids and content versions, so identical exports are served again."""
+    c.execute("""CREATE TABLE IF NOT EXISTS export_artifacts (
+        key TEXT PRIMARY KEY,
+        deck_type TEXT NOT NULL,
+        deck_name TEXT NOT NULL,
+        filename TEXT NOT NULL,
+        card_count INTEGER NOT NULL,
+        size_bytes INTEGER NOT NULL,
+        manifest_json TEXT,
+        created_at REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_export_artifacts_used ON export_artifacts(last_used_at)")
+
+
+# Card statuses with a column in the analytics rollups (column name =
+# status.lower()). Shipped migrations use their own frozen copy: to count a
+# new status, add a migration that adds its columns and recreates the
+# triggers, then extend this tuple.
+ROLLUP_STATUSES = ("GENERATED", "ACCEPTED", "REJECTED", "DUPLICATE", "EXPORTED", "IMPORTED", "DELETED")
+
+
+def _rollup_upsert(table: str, keys: dict[str, str], row: str, sign: int, statuses: tuple[str, ...]) -> str:
+    """Statement adding (sign=1) or removing (sign=-1) card `row` (new/old)
+    to the rollup row identified by keys {column: expression}."""
+    cols = list(keys) + ["total"] + [s.lower() for s in statuses]
+    values = list(keys.values()) + [str(sign)] + [f"{sign} * ({row}.status = '{s}')" for s in statuses]
+    counters = ["total"] + [s.lower() for s in statuses]
+    return f"""INSERT INTO {table} ({", ".join(cols)}) VALUES ({", ".join(values)})
+        ON CONFLICT({", ".join(keys)}) DO UPDATE SET
+        {", ".join(f"{c} = {c} + excluded.{c}" for c in counters)};"""
+
+
+def _rollup_statements(row: str, sign: int, statuses: tuple[str, ...], null_day: str) -> str:
+    daily = _rollup_upsert("card_stats_daily", {
+        "deck_type": f"{row}.deck_type",
+        "source_topic": f"COALESCE({row}.source_topic, '')",
+        "day": f"COALESCE(date({row}.created_at), {null_day})",
+    }, row, sign, statuses)
+    per_run = _rollup_upsert("card_stats_runs", {"run_id": f"COALESCE({row}.run_id, 0)"}, row, sign, statuses)
+    return f"{daily}\n        {per_run}"
+
+
+def _create_rollup_triggers(c: sqlite3.Cursor, statuses: tuple[str, ...], null_day: str):
+    add = _rollup_statements("new", 1, statuses, null_day)
+    remove = _rollup_statements("old", -1, statuses, null_day)
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_rollup_insert AFTER INSERT ON cards BEGIN
+        {add}
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_rollup_delete AFTER DELETE ON cards BEGIN
+        {remove}
+    END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS cards_rollup_update
+        AFTER UPDATE OF status, deck_type, source_topic, created_at, run_id ON cards
+        WHEN old.status IS NOT new.status OR old.deck_type IS NOT new.deck_type
+            OR old.source_topic IS NOT new.source_topic OR old.created_at IS NOT new.created_at
+            OR old.run_id IS NOT new.run_id
+    BEGIN
+        {remove}
+        {add}
+    END""")
+
+
+def _backfill_rollups(c: sqlite3.Cursor, statuses: tuple[str, ...], null_day: str):
+    """Rebuild both rollup tables from the cards table."""
+    sums = ", ".join(f"SUM(status = '{s}')" for s in statuses)
+    cols = ", ".join(s.lower() for s in statuses)
+    c.execute("DELETE FROM card_stats_daily")
+    c.execute(f"""INSERT INTO card_stats_daily (deck_type, source_topic, day, total, {cols})
+        SELECT deck_type, COALESCE(source_topic, ''), COALESCE(date(created_at), {null_day}), COUNT(*), {sums}
+        FROM cards GROUP BY 1, 2, 3""")
+    c.execute("DELETE FROM card_stats_runs")
+    c.execute(f"""INSERT INTO card_stats_runs (run_id, total, {cols})
+        SELECT COALESCE(run_id, 0), COUNT(*), {sums} FROM cards GROUP BY 1""")
+
+
+def _migrate_analytics_rollups(c: sqlite3.Cursor):
+    """Card counts per status, rolled up per (deck type, topic, creation day)
+    and per run, kept current by triggers on every insert, delete and status
+    change, so analytics never scan the cards table."""
+    statuses = ("GENERATED", "ACCEPTED", "REJECTED", "DUPLICATE", "EXPORTED", "IMPORTED", "DELETED")
+    counters = ",\n        ".join(f"{s.lower()} INTEGER NOT NULL DEFAULT 0" for s in ("total",) + statuses)
+    c.execute(f"""CREATE TABLE IF NOT EXISTS card_stats_daily (
+        deck_type TEXT NOT NULL,
+        source_topic TEXT NOT NULL,
+        day TEXT NOT NULL,
+        {counters},
+        PRIMARY KEY (deck_type, source_topic, day)
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_card_stats_daily_day ON card_stats_daily(day)")
+    c.execute(f"""CREATE TABLE IF NOT EXISTS card_stats_runs (
+        run_id INTEGER PRIMARY KEY,  -- 0: cards not from a run (imports, artist lookups)
+        {counters}
+    )""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cards_source_topic ON cards(deck_type, source_topic)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_runs_deck_type ON runs(deck_type, run_id)")
+    _create_rollup_triggers(c, statuses, "date('now')")
+    _backfill_rollups(c, statuses, "date('now')")
 
 
-init_db()
+def _migrate_run_timings(c: sqlite3.Cursor):
+    """runs.timings_json: per-stage timing summary of the run (core.metrics)."""
+    _add_missing_columns(c, "runs", {"timings_json": "TEXT"})
+
+
+def _migrate_card_export_versions(c: sqlite3.Cursor):
+    """cards.exported_version: the updated_at of the content last exported,
+    so a delta export picks up each card edited since *its* export, whatever
+    else was exported in between. Exported cards edited after their deck
+    type's last recorded export stay NULL and go out in the next delta."""
+    _add_missing_columns(c, "cards", {"exported_version": "REAL"})
+    c.execute("""UPDATE cards SET exported_version = updated_at
+        WHERE status = 'EXPORTED' AND COALESCE(
+            updated_at <= (SELECT MAX(created_at) FROM exports WHERE exports.deck_type = cards.deck_type), 1)""")
+
+
+def _migrate_llm_cache_expiry(c: sqlite3.Cursor):
+    """Index for purging expired LLM cache entries (core.llm_cache.prune)."""
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at)")
+
+
+def _migrate_anki_import_watermarks(c: sqlite3.Cursor):
+    """Newest note mod time imported per source note type and deck, so an
+    incremental import of one package doesn't skip another package's notes.
+    Seeded from the IDs of the deck each deck type last imported. Imported
+    cards record their package's deck (cards.anki_deck_id, 0 when it has
+    none), so only that package's cards are marked DELETED."""
+    _add_missing_columns(c, "cards", {"anki_deck_id": "INTEGER"})
+    c.execute("""CREATE TABLE IF NOT EXISTS anki_import_watermarks (
+        deck_type TEXT NOT NULL,
+        anki_model_id INTEGER NOT NULL,
+        anki_deck_id INTEGER NOT NULL,  -- 0: package without a deck id
+        last_mod INTEGER NOT NULL,
+        PRIMARY KEY (deck_type, anki_model_id, anki_deck_id)
+    )""")
+    c.execute("""INSERT OR IGNORE INTO anki_import_watermarks (deck_type, anki_model_id, anki_deck_id, last_mod)
+        SELECT d.name, d.anki_model_id, d.anki_deck_id, MAX(cards.anki_mod)
+        FROM deck_types d JOIN cards ON cards.deck_type = d.name
+        WHERE d.anki_model_id IS NOT NULL AND d.anki_deck_id IS NOT NULL AND cards.anki_mod IS NOT NULL
+        GROUP BY d.name""")
+
+
+def _migrate_rollup_null_day(c: sqlite3.Cursor):
+    """Cards without a created_at were rolled up under date('now'), so a
+    delete on a later day decremented a different row than the insert had
+    incremented. Recreate the triggers with a fixed day (0000-00-00, outside
+    every time series) and rebuild."""
+    statuses = ("GENERATED", "ACCEPTED", "REJECTED", "DUPLICATE", "EXPORTED", "IMPORTED", "DELETED")
+    for trigger in ("cards_rollup_insert", "cards_rollup_delete", "cards_rollup_update"):
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    _create_rollup_triggers(c, statuses, "'0000-00-00'")
+    _backfill_rollups(c, statuses, "'0000-00-00'")
+
+
+MIGRATIONS = [
+    _migrate_initial_schema,  # 1
+    _migrate_card_keys,       # 2
+    _migrate_cards_fts,       # 3
+    _migrate_llm_cache,       # 4
+    _migrate_quota_usage,     # 5
+    _migrate_run_parse_stats, # 6
+    _migrate_jobs,            # 7
+    _migrate_anki_note_keys,  # 8
+    _migrate_export_ledger,   # 9
+    _migrate_deck_type_versions,  # 10
+    _migrate_export_artifacts,    # 11
+    _migrate_analytics_rollups,   # 12
+    _migrate_run_timings,         # 13
+    _migrate_card_export_versions,  # 14
+    _migrate_llm_cache_expiry,      # 15
+    _migrate_anki_import_watermarks,  # 16
+    _migrate_rollup_null_day,         # 17
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db():
+    """Apply any pending migrations. Cheap no-op when the schema is current."""
+    db_path = settings.db_path
+    with _schema_lock:
+        if db_path in _schema_ready:
+            return
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            if _schema_version(conn) < SCHEMA_VERSION:
+                _run_migrations(conn)
+        finally:
+            conn.close()
+        _schema_ready.add(db_path)
+
+
+def _run_migrations(conn: sqlite3.Connection):
+    c = conn.cursor()
+    # Take the write lock before re-reading the version so concurrent
+    # processes (CLI + API server) don't both apply the same migration.
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        version = _schema_version(conn)
+        for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info("Migrating database schema to version %d (%s)", target, migration.__name__)
+            migration(c)
+            c.execute(f"PRAGMA user_version = {target}")
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        raise
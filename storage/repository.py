@@ -1,53 +1,61 @@
 from __future__ import annotations
 
 import json
+import re
 import sqlite3
+import time
+from typing import Callable, Iterable
 
 import numpy as np
 
-from core.cards import Card, CardTemplate, DeckType, GenerationRun
-from storage.database import get_connection
+from core import metrics
+from core.cards import Card, CardTemplate, DeckType, GenerationRun, Job
+from storage.database import card_keys, get_connection
 
 
 # --- Deck Types ---
 
-def get_deck_type(name: str) -> DeckType | None:
-    conn = get_connection()
-    c = conn.cursor()
-    c.execute("SELECT name, fields_schema, templates, css, anki_model_id, anki_deck_id FROM deck_types WHERE name = ?", (name,))
-    row = c.fetchone()
-    conn.close()
-    if not row:
-        return None
-    templates_raw = json.loads(row[2])
+_DECK_TYPE_COLUMNS = "name, fields_schema, templates, css, anki_model_id, anki_deck_id, version"
+
+
+def _row_to_deck_type(row) -> DeckType:
     return DeckType(
         name=row[0],
         fields_schema=json.loads(row[1]),
-        templates=[CardTemplate(**t) for t in templates_raw],
+        templates=[CardTemplate(**t) for t in json.loads(row[2])],
         css=row[3],
         anki_model_id=row[4],
         anki_deck_id=row[5],
+        version=row[6],
     )
 
 
+def get_deck_type(name: str) -> DeckType | None:
+    """Load and parse a deck type. Most callers want core.deck_registry.get_deck_type,
+    which caches the parsed result."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"SELECT {_DECK_TYPE_COLUMNS} FROM deck_types WHERE name = ?", (name,))
+    row = c.fetchone()
+    conn.close()
+    return _row_to_deck_type(row) if row else None
+
+
+def get_deck_type_version(name: str) -> int | None:
+    """Current version of a deck type row, or None if it doesn't exist."""
+    conn = get_connection()
+    row = conn.execute("SELECT version FROM deck_types WHERE name = ?", (name,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
 def get_all_deck_types() -> list[DeckType]:
     conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT name, fields_schema, templates, css, anki_model_id, anki_deck_id FROM deck_types")
+    c.execute(f"SELECT {_DECK_TYPE_COLUMNS} FROM deck_types")
     rows = c.fetchall()
     conn.close()
-    result = []
-    for r in rows:
-        templates_raw = json.loads(r[2])
-        result.append(DeckType(
-            name=r[0],
-            fields_schema=json.loads(r[1]),
-            templates=[CardTemplate(**t) for t in templates_raw],
-            css=r[3],
-            anki_model_id=r[4],
-            anki_deck_id=r[5],
-        ))
-    return result
+    return [_row_to_deck_type(r) for r in rows]
 
 
 def update_deck_type_anki_ids(name: str, model_id: int, deck_id: int):
@@ -88,37 +96,182 @@ def _deserialize_embedding(data: bytes | None) -> np.ndarray | None:
 
 
 def save_card(card: Card, embedding: np.ndarray | None = None) -> int:
+    return save_cards([card], [embedding])[0]
+
+
+@metrics.timed("db", op="save_cards")
+def save_cards(cards: list[Card], embeddings: list[np.ndarray | None] | None = None) -> list[int]:
+    """Insert many cards in one transaction. Returns their ids, in order."""
+    if embeddings is None:
+        embeddings = [None] * len(cards)
     conn = get_connection()
     c = conn.cursor()
-    c.execute(
-        """INSERT INTO cards (deck_type, fields_json, image_filename, audio_filename, embedding, source_topic, run_id, status)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-        (
-            card.deck_type,
-            json.dumps(card.fields_json),
-            card.image_filename,
-            card.audio_filename,
-            _serialize_embedding(embedding),
-            card.source_topic,
-            card.run_id,
-            card.status,
-        ),
-    )
-    card_id = c.lastrowid
+    ids = []
+    for card, emb in zip(cards, embeddings):
+        title_key, artist_key = card_keys(card.fields_json)
+        c.execute(
+            """INSERT INTO cards (deck_type, fields_json, image_filename, audio_filename, embedding, source_topic, run_id,
+                                  status, title_key, artist_key, anki_note_id, anki_guid, anki_mod, anki_deck_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                card.deck_type,
+                json.dumps(card.fields_json),
+                card.image_filename,
+                card.audio_filename,
+                _serialize_embedding(emb),
+                card.source_topic,
+                card.run_id,
+                card.status,
+                title_key,
+                artist_key,
+                card.anki_note_id,
+                card.anki_guid,
+                card.anki_mod,
+                card.anki_deck_id,
+            ),
+        )
+        ids.append(c.lastrowid)
     conn.commit()
     conn.close()
-    return card_id
+    return ids
 
 
 def save_card_fields(card_id: int, fields_json: dict):
     """Update the fields_json for a card (e.g., to add a search link)."""
     conn = get_connection()
     c = conn.cursor()
-    c.execute("UPDATE cards SET fields_json = ? WHERE id = ?", (json.dumps(fields_json), card_id))
+    title_key, artist_key = card_keys(fields_json)
+    c.execute(
+        "UPDATE cards SET fields_json = ?, title_key = ?, artist_key = ? WHERE id = ?",
+        (json.dumps(fields_json), title_key, artist_key, card_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+@metrics.timed("db", op="update_imported_card")
+def update_imported_card(
+    card_id: int,
+    anki_note_id: int,
+    anki_guid: str,
+    anki_mod: int,
+    fields_json: dict | None = None,
+    embedding: np.ndarray | None = None,
+    anki_deck_id: int | None = None,
+):
+    """Record the source Anki note (and package deck) of an imported card
+    and, if given, replace its fields (and embedding) with the note's current
+    contents. A card marked DELETED is IMPORTED again, since its note is back."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """UPDATE cards SET anki_note_id = ?, anki_guid = ?, anki_mod = ?,
+               anki_deck_id = COALESCE(?, anki_deck_id),
+               status = CASE WHEN status = 'DELETED' THEN 'IMPORTED' ELSE status END
+           WHERE id = ?""",
+        (anki_note_id, anki_guid, anki_mod, anki_deck_id, card_id),
+    )
+    if fields_json is not None:
+        title_key, artist_key = card_keys(fields_json)
+        c.execute(
+            "UPDATE cards SET fields_json = ?, title_key = ?, artist_key = ? WHERE id = ?",
+            (json.dumps(fields_json), title_key, artist_key, card_id),
+        )
+    if embedding is not None:
+        c.execute("UPDATE cards SET embedding = ? WHERE id = ?", (_serialize_embedding(embedding), card_id))
+    conn.commit()
+    conn.close()
+
+
+def get_anki_note_index(deck_type: str) -> dict[int, tuple[int, int | None]]:
+    """Imported cards of a deck by source note: {anki_note_id: (card_id, anki_mod)}."""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT anki_note_id, id, anki_mod FROM cards WHERE deck_type = ? AND anki_note_id IS NOT NULL",
+        (deck_type,),
+    ).fetchall()
+    conn.close()
+    return {note_id: (card_id, mod) for note_id, card_id, mod in rows}
+
+
+def get_anki_import_watermark(deck_type: str, anki_model_id: int, anki_deck_id: int | None) -> int | None:
+    """Newest note modification time seen by a previous import of this
+    package's note type and deck, or None."""
+    conn = get_connection()
+    row = conn.execute(
+        """SELECT last_mod FROM anki_import_watermarks
+           WHERE deck_type = ? AND anki_model_id = ? AND anki_deck_id = ?""",
+        (deck_type, anki_model_id, anki_deck_id or 0),
+    ).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def set_anki_import_watermark(deck_type: str, anki_model_id: int, anki_deck_id: int | None, last_mod: int):
+    conn = get_connection()
+    conn.execute(
+        """INSERT INTO anki_import_watermarks (deck_type, anki_model_id, anki_deck_id, last_mod)
+           VALUES (?, ?, ?, ?)
+           ON CONFLICT(deck_type, anki_model_id, anki_deck_id) DO UPDATE SET
+               last_mod = MAX(last_mod, excluded.last_mod)""",
+        (deck_type, anki_model_id, anki_deck_id or 0, last_mod),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_unlinked_imported_cards(deck_type: str) -> dict[str, int]:
+    """IMPORTED cards without a source note id (imported before note ids were
+    stored), by lowercase title: {title: card_id}."""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id, fields_json FROM cards WHERE deck_type = ? AND status = 'IMPORTED' AND anki_note_id IS NULL",
+        (deck_type,),
+    ).fetchall()
+    conn.close()
+    return {json.loads(fields).get("Title", "").strip().lower(): card_id for card_id, fields in rows}
+
+
+def restore_anki_notes(deck_type: str, live_note_ids: Iterable[int]) -> int:
+    """Set DELETED cards whose source note is in the package again back to
+    IMPORTED. Returns the number of cards restored."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """UPDATE cards SET status = 'IMPORTED'
+           WHERE deck_type = ? AND status = 'DELETED'
+             AND anki_note_id IN (SELECT value FROM json_each(?))""",
+        (deck_type, json.dumps(list(live_note_ids))),
+    )
+    count = c.rowcount
+    conn.commit()
+    conn.close()
+    return count
+
+
+def mark_deleted_anki_notes(deck_type: str, live_note_ids: Iterable[int], anki_deck_id: int | None = None) -> int:
+    """Set IMPORTED cards from this package's deck (or from an unknown deck)
+    whose source note is no longer in the package to DELETED. Returns the
+    number of cards marked."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("CREATE TEMP TABLE live_notes (id INTEGER PRIMARY KEY)")
+    c.executemany("INSERT OR IGNORE INTO live_notes (id) VALUES (?)", ((i,) for i in live_note_ids))
+    c.execute(
+        """UPDATE cards SET status = 'DELETED'
+           WHERE deck_type = ? AND status = 'IMPORTED' AND anki_note_id IS NOT NULL
+             AND (anki_deck_id IS NULL OR anki_deck_id = ?)
+             AND anki_note_id NOT IN (SELECT id FROM live_notes)""",
+        (deck_type, anki_deck_id or 0),
+    )
+    count = c.rowcount
+    c.execute("DROP TABLE live_notes")
     conn.commit()
     conn.close()
+    return count
 
 
+@metrics.timed("db", op="update_card_status")
 def update_card_status(card_id: int, status: str):
     conn = get_connection()
     c = conn.cursor()
@@ -127,6 +280,56 @@ def update_card_status(card_id: int, status: str):
     conn.close()
 
 
+@metrics.timed("db", op="update_cards_status")
+def update_cards_status(card_ids: Iterable[int], status: str) -> int:
+    """Set the status of many cards in one statement. Returns the number changed."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "UPDATE cards SET status = ? WHERE id IN (SELECT value FROM json_each(?)) AND status != ?",
+        (status, json.dumps(list(card_ids)), status),
+    )
+    changed = c.rowcount
+    conn.commit()
+    conn.close()
+    return changed
+
+
+@metrics.timed("db", op="update_cards_statuses")
+def update_cards_statuses(statuses: dict[int, str]) -> int:
+    """Set a different status per card ({card_id: status}) in one transaction.
+    Returns the number of cards changed."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany(
+        "UPDATE cards SET status = ? WHERE id = ? AND status != ?",
+        [(status, card_id, status) for card_id, status in statuses.items()],
+    )
+    changed = c.rowcount
+    conn.commit()
+    conn.close()
+    return changed
+
+
+@metrics.timed("db", op="update_cards_media")
+def update_cards_media(
+    image_filenames: dict[int, str] | None = None, audio_filenames: dict[int, str] | None = None
+) -> int:
+    """update_card_media for many cards ({card_id: filename}) in one transaction.
+    Returns the number of rows updated."""
+    conn = get_connection()
+    c = conn.cursor()
+    changed = 0
+    for column, mapping in (("image_filename", image_filenames), ("audio_filename", audio_filenames)):
+        if mapping:
+            c.executemany(f"UPDATE cards SET {column} = ? WHERE id = ?", [(f, i) for i, f in mapping.items()])
+            changed += c.rowcount
+    conn.commit()
+    conn.close()
+    return changed
+
+
+@metrics.timed("db", op="update_card_media")
 def update_card_media(card_id: int, image_filename: str | None = None, audio_filename: str | None = None):
     conn = get_connection()
     c = conn.cursor()
@@ -138,12 +341,20 @@ def update_card_media(card_id: int, image_filename: str | None = None, audio_fil
     conn.close()
 
 
-def get_cards(deck_type: str | None = None, status: str | None = None) -> list[Card]:
+@metrics.timed("db", op="get_cards")
+def get_cards(
+    deck_type: str | None = None, status: str | None = None, card_ids: Iterable[int] | None = None
+) -> list[Card]:
     conn = get_connection()
     c = conn.cursor()
 
-    query = "SELECT id, deck_type, fields_json, image_filename, audio_filename, created_at, source_topic, run_id, status FROM cards WHERE 1=1"
+    query = """SELECT id, deck_type, fields_json, image_filename, audio_filename, created_at, source_topic, run_id, status,
+                      anki_guid, updated_at
+               FROM cards WHERE 1=1"""
     params = []
+    if card_ids is not None:
+        query += " AND id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(card_ids)))
     if deck_type:
         query += " AND deck_type = ?"
         params.append(deck_type)
@@ -160,12 +371,74 @@ def get_cards(deck_type: str | None = None, status: str | None = None) -> list[C
         Card(
             id=r[0], deck_type=r[1], fields_json=json.loads(r[2]),
             image_filename=r[3], audio_filename=r[4], created_at=r[5],
-            source_topic=r[6], run_id=r[7], status=r[8],
+            source_topic=r[6], run_id=r[7], status=r[8], anki_guid=r[9], updated_at=r[10],
         )
         for r in rows
     ]
 
 
+def get_delta_export_cards(deck_type: str) -> list[Card]:
+    """Cards a delta export should contain: every ACCEPTED card (never
+    exported) plus EXPORTED cards whose content changed after the version
+    they were last exported at (see mark_cards_exported)."""
+    conn = get_connection()
+    ids = [r[0] for r in conn.execute(
+        """SELECT id FROM cards WHERE deck_type = ? AND (status = 'ACCEPTED' OR (status = 'EXPORTED'
+               AND (exported_version IS NULL OR updated_at > exported_version)))""",
+        (deck_type,),
+    )]
+    conn.close()
+    return get_cards(card_ids=ids) if ids else []
+
+
+def get_card_versions(card_ids: Iterable[int]) -> dict[int, float]:
+    """Current content version (updated_at) of each card: {card_id: updated_at}."""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT id, updated_at FROM cards WHERE id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(card_ids)),),
+    ).fetchall()
+    conn.close()
+    return dict(rows)
+
+
+@metrics.timed("db", op="mark_cards_exported")
+def mark_cards_exported(cards: Iterable[Card]) -> int:
+    """Set cards to EXPORTED and remember the content version (updated_at as
+    read before the export) that went into the package. Returns the number
+    of cards updated."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany(
+        "UPDATE cards SET status = 'EXPORTED', exported_version = ? WHERE id = ?",
+        [(card.updated_at, card.id) for card in cards],
+    )
+    changed = c.rowcount
+    conn.commit()
+    conn.close()
+    return changed
+
+
+def assign_card_guids(card_ids: list[int], new_guid: Callable[[], str]) -> dict[int, str]:
+    """Give cards without an Anki note GUID one from new_guid() and return
+    the (now stable) GUID of every given card: {card_id: guid}."""
+    conn = get_connection()
+    c = conn.cursor()
+    guids = {}
+    for start in range(0, len(card_ids), 500):
+        chunk = card_ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        c.execute(f"SELECT id, anki_guid FROM cards WHERE id IN ({placeholders})", chunk)
+        guids.update(c.fetchall())
+    missing = {card_id: new_guid() for card_id, guid in guids.items() if not guid}
+    c.executemany("UPDATE cards SET anki_guid = ? WHERE id = ?", [(g, i) for i, g in missing.items()])
+    conn.commit()
+    conn.close()
+    guids.update(missing)
+    return guids
+
+
+@metrics.timed("db", op="get_existing_cards_with_embeddings")
 def get_existing_cards_with_embeddings(deck_type: str) -> tuple[list[dict], list[np.ndarray | None]]:
     """Returns (list_of_fields_dicts, list_of_embeddings) for duplicate detection."""
     conn = get_connection()
@@ -185,8 +458,170 @@ def get_existing_cards_with_embeddings(deck_type: str) -> tuple[list[dict], list
     return cards, embeddings
 
 
+@metrics.timed("db", op="find_existing_titles")
+def find_existing_titles(deck_type: str, title_keys: list[str]) -> set[str]:
+    """Return which of the given normalized titles (see parsing.base_title) already
+    exist in the deck. One indexed query, regardless of deck size."""
+    if not title_keys:
+        return set()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """SELECT DISTINCT title_key FROM cards
+           WHERE deck_type = ? AND title_key IN (SELECT value FROM json_each(?))""",
+        (deck_type, json.dumps(list(title_keys))),
+    )
+    rows = c.fetchall()
+    conn.close()
+    return {r[0] for r in rows}
+
+
+# bm25 column weights for cards_fts (title, artist, movement, location, note)
+_FTS_WEIGHTS = "10.0, 5.0, 2.0, 2.0, 1.0"
+_FTS_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _fts_query(text: str, any_word: bool = False) -> str:
+    """Turn free text into a safe FTS5 query matching each word as a prefix.
+    All words must match unless any_word is set."""
+    joiner = " OR " if any_word else " "
+    return joiner.join(f'"{tok}"*' for tok in _FTS_TOKEN_RE.findall(text))
+
+
+@metrics.timed("db", op="search_cards")
+def search_cards(
+    query: str,
+    deck_type: str | None = None,
+    status: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+    any_word: bool = False,
+) -> list[Card]:
+    """Full-text search over Title, Artist, Period/Movement, Permanent Location and Note.
+    Results are ranked best-first (bm25, Title matches weigh most)."""
+    match = _fts_query(query, any_word=any_word)
+    if not match:
+        return []
+
+    conn = get_connection()
+    c = conn.cursor()
+    sql = f"""SELECT c.id, c.deck_type, c.fields_json, c.image_filename, c.audio_filename, c.created_at,
+                     c.source_topic, c.run_id, c.status
+              FROM cards_fts JOIN cards c ON c.id = cards_fts.rowid
+              WHERE cards_fts MATCH ?"""
+    params: list = [match]
+    if deck_type:
+        sql += " AND c.deck_type = ?"
+        params.append(deck_type)
+    if status:
+        sql += " AND c.status = ?"
+        params.append(status)
+    sql += f" ORDER BY bm25(cards_fts, {_FTS_WEIGHTS}) LIMIT ? OFFSET ?"
+    params.extend([limit, offset])
+
+    c.execute(sql, params)
+    rows = c.fetchall()
+    conn.close()
+
+    return [
+        Card(
+            id=r[0], deck_type=r[1], fields_json=json.loads(r[2]),
+            image_filename=r[3], audio_filename=r[4], created_at=r[5],
+            source_topic=r[6], run_id=r[7], status=r[8],
+        )
+        for r in rows
+    ]
+
+
+# --- Exports ---
+
+def record_export(deck_type: str, deck_name: str, filename: str, mode: str, card_count: int) -> int:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """INSERT INTO exports (deck_type, deck_name, filename, mode, card_count, created_at)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (deck_type, deck_name, filename, mode, card_count, time.time()),
+    )
+    export_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return export_id
+
+
+def list_exports(deck_type: str | None = None, limit: int = 20) -> list[dict]:
+    conn = get_connection()
+    query = "SELECT id, deck_type, deck_name, filename, mode, card_count, created_at FROM exports"
+    params: list = []
+    if deck_type:
+        query += " WHERE deck_type = ?"
+        params.append(deck_type)
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(limit)
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    keys = ("id", "deck_type", "deck_name", "filename", "mode", "card_count", "created_at")
+    return [dict(zip(keys, r)) for r in rows]
+
+
+_ARTIFACT_COLUMNS = ("key", "deck_type", "deck_name", "filename", "card_count", "size_bytes",
+                     "manifest", "created_at", "last_used_at")
+
+
+def save_export_artifact(
+    key: str, deck_type: str, deck_name: str, filename: str, card_count: int, size_bytes: int, manifest: dict
+):
+    now = time.time()
+    conn = get_connection()
+    conn.execute(
+        """INSERT OR REPLACE INTO export_artifacts
+           (key, deck_type, deck_name, filename, card_count, size_bytes, manifest_json, created_at, last_used_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (key, deck_type, deck_name, filename, card_count, size_bytes, json.dumps(manifest), now, now),
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_export_artifact(key: str, touch: bool = False) -> dict | None:
+    """An export artifact by key; touch=True also marks it as just used."""
+    conn = get_connection()
+    if touch:
+        conn.execute("UPDATE export_artifacts SET last_used_at = ? WHERE key = ?", (time.time(), key))
+        conn.commit()
+    row = conn.execute(
+        """SELECT key, deck_type, deck_name, filename, card_count, size_bytes, manifest_json, created_at, last_used_at
+           FROM export_artifacts WHERE key = ?""",
+        (key,),
+    ).fetchone()
+    conn.close()
+    if not row:
+        return None
+    artifact = dict(zip(_ARTIFACT_COLUMNS, row))
+    artifact["manifest"] = json.loads(artifact["manifest"]) if artifact["manifest"] else {}
+    return artifact
+
+
+def delete_export_artifacts(keys: Iterable[str]):
+    conn = get_connection()
+    conn.execute("DELETE FROM export_artifacts WHERE key IN (SELECT value FROM json_each(?))", (json.dumps(list(keys)),))
+    conn.commit()
+    conn.close()
+
+
+def get_stale_export_artifacts(unused_since: float) -> list[dict]:
+    """Artifacts not built or downloaded since the given unix time."""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT key, filename FROM export_artifacts WHERE last_used_at < ?", (unused_since,)
+    ).fetchall()
+    conn.close()
+    return [{"key": r[0], "filename": r[1]} for r in rows]
+
+
 # --- Runs ---
 
+@metrics.timed("db", op="create_run")
 def create_run(run: GenerationRun) -> int:
     conn = get_connection()
     c = conn.cursor()
@@ -201,6 +636,24 @@ def create_run(run: GenerationRun) -> int:
     return run_id
 
 
+@metrics.timed("db", op="update_run_generated")
+def update_run_generated(run_id: int, total_generated: int, parse_stats: dict | None = None):
+    """Record how many cards a run produced and, if given, how parsing went
+    (parsing.new_parse_stats: mode, dropped, repaired)."""
+    conn = get_connection()
+    c = conn.cursor()
+    if parse_stats is None:
+        c.execute("UPDATE runs SET total_generated = ? WHERE run_id = ?", (total_generated, run_id))
+    else:
+        c.execute(
+            """UPDATE runs SET total_generated = ?, parse_mode = ?, rows_dropped = ?, rows_repaired = ?
+               WHERE run_id = ?""",
+            (total_generated, parse_stats["mode"], parse_stats["dropped"], parse_stats["repaired"], run_id),
+        )
+    conn.commit()
+    conn.close()
+
+
 def update_run_accepted(run_id: int, total_accepted: int):
     conn = get_connection()
     c = conn.cursor()
@@ -209,29 +662,364 @@ def update_run_accepted(run_id: int, total_accepted: int):
     conn.close()
 
 
+def update_run_timings(run_id: int, timings: dict):
+    """Store a run's timing summary (core.metrics.Timings.summary())."""
+    conn = get_connection()
+    conn.execute("UPDATE runs SET timings_json = ? WHERE run_id = ?", (json.dumps(timings), run_id))
+    conn.commit()
+    conn.close()
+
+
+def get_parse_stats(deck_type: str | None = None) -> list[dict]:
+    """Rows generated, dropped and repaired per output format, summed over runs."""
+    conn = get_connection()
+    c = conn.cursor()
+    query = """
+        SELECT
+            parse_mode,
+            COUNT(*) as runs,
+            COALESCE(SUM(total_generated), 0) as generated,
+            COALESCE(SUM(rows_dropped), 0) as dropped,
+            COALESCE(SUM(rows_repaired), 0) as repaired
+        FROM runs
+        WHERE parse_mode IS NOT NULL
+    """
+    params = []
+    if deck_type:
+        query += " AND deck_type = ?"
+        params.append(deck_type)
+    query += " GROUP BY parse_mode"
+
+    c.execute(query, params)
+    cols = [desc[0] for desc in c.description]
+    rows = [dict(zip(cols, row)) for row in c.fetchall()]
+    conn.close()
+    return rows
+
+
+# --- Jobs ---
+
+_JOB_COLUMNS = """id, kind, params, status, progress_done, progress_total, progress_message,
+    result, error, cancel_requested, worker, attempts, created_at, started_at, finished_at"""
+
+
+def _row_to_job(r) -> Job:
+    return Job(
+        id=r[0], kind=r[1], params=json.loads(r[2]), status=r[3],
+        progress_done=r[4], progress_total=r[5], progress_message=r[6],
+        result=json.loads(r[7]) if r[7] else None, error=r[8],
+        cancel_requested=bool(r[9]), worker=r[10], attempts=r[11],
+        created_at=r[12], started_at=r[13], finished_at=r[14],
+    )
+
+
+def create_job(kind: str, params: dict) -> int:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO jobs (kind, params, created_at) VALUES (?, ?, ?)",
+        (kind, json.dumps(params), time.time()),
+    )
+    job_id = c.lastrowid
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def get_job(job_id: int) -> Job | None:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id = ?", (job_id,))
+    row = c.fetchone()
+    conn.close()
+    return _row_to_job(row) if row else None
+
+
+def list_jobs(status: str | None = None, kind: str | None = None, limit: int = 50) -> list[Job]:
+    conn = get_connection()
+    c = conn.cursor()
+    query = f"SELECT {_JOB_COLUMNS} FROM jobs WHERE 1=1"
+    params = []
+    if status:
+        query += " AND status = ?"
+        params.append(status)
+    if kind:
+        query += " AND kind = ?"
+        params.append(kind)
+    query += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    c.execute(query, params)
+    rows = c.fetchall()
+    conn.close()
+    return [_row_to_job(r) for r in rows]
+
+
+def claim_next_job(worker: str) -> Job | None:
+    """Atomically move the oldest QUEUED job to RUNNING for this worker."""
+    conn = get_connection()
+    conn.isolation_level = None
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("SELECT id FROM jobs WHERE status = 'QUEUED' ORDER BY id LIMIT 1")
+        row = c.fetchone()
+        if row:
+            now = time.time()
+            c.execute(
+                """UPDATE jobs SET status = 'RUNNING', worker = ?, attempts = attempts + 1,
+                       started_at = ?, heartbeat_at = ?
+                   WHERE id = ?""",
+                (worker, now, now, row[0]),
+            )
+        c.execute("COMMIT")
+    except Exception:
+        c.execute("ROLLBACK")
+        conn.close()
+        raise
+    conn.close()
+    return get_job(row[0]) if row else None
+
+
+def update_job_progress(job_id: int, done: int, total: int, message: str | None = None) -> bool:
+    """Record progress (and a heartbeat). Returns True if cancellation was requested."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """UPDATE jobs SET progress_done = ?, progress_total = ?, progress_message = ?, heartbeat_at = ?
+           WHERE id = ?""",
+        (done, total, message, time.time(), job_id),
+    )
+    c.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,))
+    row = c.fetchone()
+    conn.commit()
+    conn.close()
+    return bool(row and row[0])
+
+
+def touch_jobs(job_ids: list[int]):
+    """Heartbeat for jobs a live worker is still running."""
+    if not job_ids:
+        return
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", [(time.time(), i) for i in job_ids])
+    conn.commit()
+    conn.close()
+
+
+def finish_job(job_id: int, status: str, result: dict | None = None, error: str | None = None):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+        (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+    )
+    conn.commit()
+    conn.close()
+
+
+def request_job_cancel(job_id: int) -> bool:
+    """Cancel a queued job outright, or flag a running one to stop at its next
+    progress update. Returns False if the job is unknown or already finished."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "UPDATE jobs SET status = 'CANCELLED', finished_at = ? WHERE id = ? AND status = 'QUEUED'",
+        (time.time(), job_id),
+    )
+    changed = c.rowcount
+    if not changed:
+        c.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'RUNNING'", (job_id,))
+        changed = c.rowcount
+    conn.commit()
+    conn.close()
+    return bool(changed)
+
+
+def requeue_stale_jobs(
+    stale_after_seconds: float, max_attempts: int, no_retry_kinds: Iterable[str] = ()
+) -> tuple[int, int]:
+    """Put RUNNING jobs whose worker stopped heartbeating (crash, restart) back
+    in the queue. Jobs that already ran max_attempts times, and jobs of kinds
+    that are not safe to run twice, are marked FAILED instead. Returns
+    (requeued, failed)."""
+    conn = get_connection()
+    c = conn.cursor()
+    now = time.time()
+    stale = (now - stale_after_seconds,)
+    c.execute("UPDATE jobs SET status = 'CANCELLED', worker = NULL, finished_at = ? "
+              "WHERE status = 'RUNNING' AND heartbeat_at < ? AND cancel_requested", (now,) + stale)
+    c.execute(
+        """UPDATE jobs SET status = 'FAILED', worker = NULL, finished_at = ?,
+               error = CASE WHEN kind IN (SELECT value FROM json_each(?))
+                   THEN 'Worker lost while running; not retried because this kind of job is not safe to repeat'
+                   ELSE 'Worker lost on each of ' || attempts || ' attempts; giving up' END
+           WHERE status = 'RUNNING' AND heartbeat_at < ?
+             AND (attempts >= ? OR kind IN (SELECT value FROM json_each(?)))""",
+        (now, json.dumps(list(no_retry_kinds))) + stale + (max_attempts, json.dumps(list(no_retry_kinds))),
+    )
+    failed = c.rowcount
+    c.execute("UPDATE jobs SET status = 'QUEUED', worker = NULL WHERE status = 'RUNNING' AND heartbeat_at < ?", stale)
+    requeued = c.rowcount
+    conn.commit()
+    conn.close()
+    return requeued, failed
+
+
+# --- LLM response cache ---
+
+def get_cached_response(key: str, max_age_seconds: int) -> str | None:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?",
+        (key, time.time() - max_age_seconds),
+    )
+    row = c.fetchone()
+    if row:
+        c.execute("UPDATE llm_cache SET hits = hits + 1 WHERE key = ?", (key,))
+        conn.commit()
+    conn.close()
+    return row[0] if row else None
+
+
+def save_cached_response(key: str, model: str, response: str):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        "INSERT OR REPLACE INTO llm_cache (key, model, response, created_at) VALUES (?, ?, ?, ?)",
+        (key, model, response, time.time()),
+    )
+    conn.commit()
+    conn.close()
+
+
+def delete_cached_responses(created_before: float) -> int:
+    """Delete cache entries created before the given unix time. Returns the number deleted."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("DELETE FROM llm_cache WHERE created_at < ?", (created_before,))
+    count = c.rowcount
+    conn.commit()
+    conn.close()
+    return count
+
+
+def get_llm_cache_stats() -> dict:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM llm_cache")
+    entries, total_hits = c.fetchone()
+    conn.close()
+    return {"entries": entries, "total_hits": total_hits}
+
+
+# --- Quota usage ---
+
+def get_quota_usage(day: str, kind: str) -> dict:
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT requests, tokens FROM quota_usage WHERE day = ? AND kind = ?", (day, kind))
+    row = c.fetchone()
+    conn.close()
+    return {"requests": row[0] if row else 0, "tokens": row[1] if row else 0}
+
+
+def record_quota_usage(day: str, kind: str, requests: int = 1, tokens: int = 0):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(
+        """INSERT INTO quota_usage (day, kind, requests, tokens) VALUES (?, ?, ?, ?)
+           ON CONFLICT(day, kind) DO UPDATE SET
+               requests = requests + excluded.requests,
+               tokens = tokens + excluded.tokens""",
+        (day, kind, requests, tokens),
+    )
+    conn.commit()
+    conn.close()
+
+
 # --- Analytics ---
 
 def get_analytics(deck_type: str | None = None) -> list[dict]:
+    """Card counts per topic and deck type, from the card_stats_daily rollup.
+    accepted includes cards exported since."""
     conn = get_connection()
     c = conn.cursor()
 
     query = """
         SELECT
-            c.source_topic as topic,
-            c.deck_type,
-            COUNT(*) as total_cards,
-            SUM(CASE WHEN c.status IN ('ACCEPTED', 'EXPORTED') THEN 1 ELSE 0 END) as accepted,
-            SUM(CASE WHEN c.status = 'REJECTED' THEN 1 ELSE 0 END) as rejected
-        FROM cards c
+            NULLIF(source_topic, '') as topic,
+            deck_type,
+            SUM(total) as total_cards,
+            SUM(accepted + exported) as accepted,
+            SUM(rejected) as rejected,
+            SUM(generated) as generated,
+            SUM(duplicate) as duplicate,
+            SUM(exported) as exported
+        FROM card_stats_daily
     """
     params = []
     if deck_type:
-        query += " WHERE c.deck_type = ?"
+        query += " WHERE deck_type = ?"
         params.append(deck_type)
-    query += " GROUP BY c.source_topic, c.deck_type"
+    query += " GROUP BY source_topic, deck_type HAVING SUM(total) > 0"
 
     c.execute(query, params)
     cols = [desc[0] for desc in c.description]
     rows = [dict(zip(cols, row)) for row in c.fetchall()]
     conn.close()
     return rows
+
+
+def get_analytics_timeseries(
+    deck_type: str | None = None, topic: str | None = None, days: int = 30
+) -> list[dict]:
+    """Cards created per day over the last `days` days, by current status."""
+    conn = get_connection()
+    query = """
+        SELECT day, SUM(total) as total, SUM(generated) as generated, SUM(accepted) as accepted,
+               SUM(rejected) as rejected, SUM(duplicate) as duplicate, SUM(exported) as exported,
+               SUM(imported) as imported
+        FROM card_stats_daily WHERE day >= date('now', ?)
+    """
+    params: list = [f"-{days} days"]
+    if deck_type:
+        query += " AND deck_type = ?"
+        params.append(deck_type)
+    if topic is not None:
+        query += " AND source_topic = ?"
+        params.append(topic)
+    query += " GROUP BY day HAVING SUM(total) > 0 ORDER BY day"
+    c = conn.execute(query, params)
+    cols = [desc[0] for desc in c.description]
+    rows = [dict(zip(cols, row)) for row in c.fetchall()]
+    conn.close()
+    return rows
+
+
+def get_run_analytics(deck_type: str | None = None, limit: int = 50) -> list[dict]:
+    """Recent generation runs with the current status counts of their cards."""
+    conn = get_connection()
+    query = """
+        SELECT r.run_id, r.timestamp, r.topic, r.deck_type, r.persona, r.parse_mode,
+               r.total_generated, r.rows_dropped, r.rows_repaired, r.timings_json,
+               COALESCE(s.total, 0) as cards, COALESCE(s.accepted + s.exported, 0) as accepted,
+               COALESCE(s.rejected, 0) as rejected, COALESCE(s.duplicate, 0) as duplicate,
+               COALESCE(s.generated, 0) as pending, COALESCE(s.exported, 0) as exported
+        FROM runs r LEFT JOIN card_stats_runs s ON s.run_id = r.run_id
+    """
+    params: list = []
+    if deck_type:
+        query += " WHERE r.deck_type = ?"
+        params.append(deck_type)
+    query += " ORDER BY r.run_id DESC LIMIT ?"
+    params.append(limit)
+    c = conn.execute(query, params)
+    cols = [desc[0] for desc in c.description]
+    rows = [dict(zip(cols, row)) for row in c.fetchall()]
+    conn.close()
+    for row in rows:
+        timings_json = row.pop("timings_json")
+        row["timings"] = json.loads(timings_json) if timings_json else None
+    return rows
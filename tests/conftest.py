@@ -0,0 +1,69 @@
+import sqlite3
+import zipfile
+import zlib
+
+import genanki
+import pytest
+
+from core import deck_registry
+from core.config import settings
+from export.apkg_writer import ApkgWriter
+from export.genanki_export import _build_genanki_model
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh database (migrated on first connection) and exports dir per test."""
+    monkeypatch.setattr(settings, "db_path", str(tmp_path / "test.db"))
+    exports = tmp_path / "exports"
+    exports.mkdir()
+    monkeypatch.setattr("export.genanki_export.EXPORTS_DIR", exports)
+    monkeypatch.setattr("export.artifacts.EXPORTS_DIR", exports)
+    deck_registry.invalidate()
+    yield tmp_path
+    deck_registry.invalidate()
+
+
+@pytest.fixture
+def make_apkg(db):
+    """Factory for artwork .apkg files: make_apkg(name, {guid: title}, ...) -> path.
+    Notes get mod = timestamp and an id derived from their guid; model_id and
+    deck_id pick the note type and deck."""
+    def make(name: str, notes: dict[str, str], timestamp: int = 1_700_000_000,
+             model_id: int = 1_111_111_111, deck_id: int = 2_222_222_222, wal: bool = False):
+        dt = deck_registry.get_deck_type("artwork").model_copy(update={"anki_model_id": model_id})
+        model = _build_genanki_model(dt)
+        path = db / name
+        with ApkgWriter(path, model, deck_id, "Test Deck", timestamp=timestamp) as writer:
+            for guid, title in notes.items():
+                fields = [""] * len(model.fields)
+                fields[1], fields[2] = "Someone", title
+                writer.add_note(genanki.Note(model=model, fields=fields, guid=guid))
+        _rewrite_collection(path, wal)
+        return path
+    return make
+
+
+def _rewrite_collection(path, wal: bool):
+    """Give notes a stable id derived from their guid, as Anki keeps note ids
+    across exports, and optionally mark the collection WAL (bytes 18/19 = 2)."""
+    with zipfile.ZipFile(path) as z:
+        members = {name: z.read(name) for name in z.namelist()}
+    collection = path.with_suffix(".anki2")
+    collection.write_bytes(members["collection.anki2"])
+    conn = sqlite3.connect(collection)
+    for note_id, guid in conn.execute("SELECT id, guid FROM notes").fetchall():
+        stable_id = zlib.crc32(guid.encode()) + 1
+        conn.execute("UPDATE notes SET id = ? WHERE id = ?", (stable_id, note_id))
+        conn.execute("UPDATE cards SET nid = ? WHERE nid = ?", (stable_id, note_id))
+    conn.commit()
+    if wal:
+        assert conn.execute("PRAGMA journal_mode=WAL").fetchone()[0] == "wal"
+    conn.close()
+    members["collection.anki2"] = collection.read_bytes()
+    collection.unlink()
+    if wal:
+        assert members["collection.anki2"][18:20] == b"\x02\x02"
+    with zipfile.ZipFile(path, "w") as z:
+        for name, data in members.items():
+            z.writestr(name, data)
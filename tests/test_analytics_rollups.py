@@ -0,0 +1,68 @@
+from core.cards import Card
+from storage import repository
+from storage.database import ROLLUP_STATUSES, get_connection
+
+_COUNTS = ", ".join(f"SUM(status = '{s}')" for s in ROLLUP_STATUSES)
+_COLUMNS = ", ".join(f"SUM({s.lower()})" for s in ROLLUP_STATUSES)
+
+
+def _direct() -> tuple[list, list]:
+    conn = get_connection()
+    daily = conn.execute(f"""SELECT deck_type, COALESCE(source_topic, ''), COALESCE(date(created_at), '0000-00-00'),
+               COUNT(*), {_COUNTS}
+        FROM cards GROUP BY 1, 2, 3 ORDER BY 1, 2, 3""").fetchall()
+    runs = conn.execute(f"""SELECT COALESCE(run_id, 0), COUNT(*), {_COUNTS}
+        FROM cards GROUP BY 1 ORDER BY 1""").fetchall()
+    conn.close()
+    return daily, runs
+
+
+def _rollups() -> tuple[list, list]:
+    conn = get_connection()
+    daily = conn.execute(f"""SELECT deck_type, source_topic, day, SUM(total), {_COLUMNS}
+        FROM card_stats_daily GROUP BY 1, 2, 3 HAVING SUM(total) > 0 ORDER BY 1, 2, 3""").fetchall()
+    runs = conn.execute(f"""SELECT run_id, SUM(total), {_COLUMNS}
+        FROM card_stats_runs GROUP BY 1 HAVING SUM(total) > 0 ORDER BY 1""").fetchall()
+    conn.close()
+    return daily, runs
+
+
+def test_rollups_match_cards(db):
+    cards = [
+        Card(deck_type=deck_type, fields_json={"Title": f"{deck_type} {topic} {i}"},
+             source_topic=topic, run_id=run_id)
+        for deck_type in ("artwork", "vocab")
+        for topic, run_id in (("Baroque", 1), ("Cubism", 2), (None, None))
+        for i in range(4)
+    ]
+    ids = repository.save_cards(cards)
+    assert _rollups() == _direct()
+
+    repository.update_cards_status(ids[:6], "ACCEPTED")
+    repository.update_cards_statuses({ids[0]: "EXPORTED", ids[7]: "REJECTED", ids[8]: "DUPLICATE"})
+    repository.update_card_status(ids[20], "REJECTED")
+    assert _rollups() == _direct()
+
+    repository.delete_cards_by_status("REJECTED")
+    assert _rollups() == _direct()
+
+    repository.mark_cards_exported(repository.get_cards(status="ACCEPTED"))
+    assert _rollups() == _direct()
+
+
+def test_card_without_created_at_rolls_back_out(db):
+    card_id, other_id = repository.save_cards([
+        Card(deck_type="artwork", fields_json={"Title": title}, source_topic="t") for title in ("A", "B")
+    ])
+    conn = get_connection()
+    conn.execute("UPDATE cards SET created_at = NULL WHERE id = ?", (card_id,))
+    conn.commit()
+    conn.close()
+    repository.update_card_status(card_id, "ACCEPTED")
+    assert _rollups() == _direct()
+    assert "0000-00-00" in {row[2] for row in _rollups()[0]}  # fixed day, not today
+
+    repository.update_card_status(card_id, "REJECTED")
+    repository.delete_cards_by_status("REJECTED")
+    assert _rollups() == _direct()
+    assert "0000-00-00" not in {row[2] for row in _rollups()[0]}
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from core import embeddings
+from core.apkg_import import _pipelined, import_apkg
+from storage import repository
+
+
+def test_import_wal_collection_in_memory(make_apkg):
+    path = make_apkg("wal.apkg", {"g1": "Starry Night", "g2": "Water Lilies"}, wal=True)
+    stats = import_apkg(str(path), compute_embeddings=False, with_media=False)
+    assert stats["imported"] == 2
+    assert stats["peak_disk_bytes"] == 0  # opened in memory, not via a temp file
+
+
+def _statuses() -> dict[str, str]:
+    return {c.fields_json["Title"]: c.status for c in repository.get_cards(deck_type="artwork")}
+
+
+def _import(path, **kwargs) -> dict:
+    return import_apkg(str(path), compute_embeddings=False, with_media=False, **kwargs)
+
+
+def test_deleted_note_is_restored_when_it_reappears(make_apkg):
+    notes = {"g1": "Starry Night", "g2": "Water Lilies"}
+    _import(make_apkg("full.apkg", notes), incremental=True)
+    stats = _import(make_apkg("one.apkg", {"g1": "Starry Night"}), incremental=True)
+    assert stats["deleted"] == 1
+    assert _statuses() == {"Starry Night": "IMPORTED", "Water Lilies": "DELETED"}
+
+    # Unchanged note (same mod): not even read, but still restored
+    stats = _import(make_apkg("full_again.apkg", notes), incremental=True)
+    assert stats["restored"] == 1
+    assert _statuses() == {"Starry Night": "IMPORTED", "Water Lilies": "IMPORTED"}
+
+    # Edited note: updated and restored
+    _import(make_apkg("one_again.apkg", {"g1": "Starry Night"}), incremental=True)
+    _import(make_apkg("edited.apkg", {"g1": "Starry Night", "g2": "Water Lilies II"},
+                      timestamp=1_800_000_000), incremental=True)
+    assert _statuses() == {"Starry Night": "IMPORTED", "Water Lilies II": "IMPORTED"}
+
+
+def test_incremental_watermark_is_per_package_deck(make_apkg):
+    _import(make_apkg("a.apkg", {"a1": "Guernica"}, timestamp=1_800_000_000, deck_id=111), incremental=True)
+    # A second deck whose notes are all older than the first deck's newest edit
+    stats = _import(make_apkg("b.apkg", {"b1": "The Kiss", "b2": "Olympia"}, deck_id=222), incremental=True)
+    assert stats["imported"] == 2
+    assert stats["deleted"] == 0
+    assert _statuses() == {"Guernica": "IMPORTED", "The Kiss": "IMPORTED", "Olympia": "IMPORTED"}
+
+    # Same deck again, nothing newer: nothing read
+    stats = _import(make_apkg("a_again.apkg", {"a1": "Guernica"}, timestamp=1_800_000_000, deck_id=111),
+                    incremental=True)
+    assert stats["changed_since"] == 1_800_000_000
+    assert stats["imported"] == stats["updated"] == 0
+
+
+def test_pipelined_yields_in_order():
+    import random
+    import time
+
+    def slow_square(n):
+        time.sleep(random.random() / 200)
+        return n * n
+
+    assert list(_pipelined(slow_square, list(range(20)), workers=4)) == [(n, n * n) for n in range(20)]
+    assert list(_pipelined(slow_square, [3, 1], workers=1)) == [(3, 9), (1, 1)]
+
+
+def test_import_embeds_in_batches_and_saves_in_order(make_apkg, monkeypatch):
+    calls = []
+
+    def fake_embeddings(texts, priority=None):
+        calls.append(len(texts))
+        return [np.array([len(t), 1.0], dtype=np.float32) for t in texts]
+
+    monkeypatch.setattr(embeddings, "get_embeddings", fake_embeddings)
+    titles = [f"Painting {i}" * (i + 1) for i in range(5)]
+    path = make_apkg("batch.apkg", {f"g{i}": t for i, t in enumerate(titles)})
+    stats = import_apkg(str(path), batch_size=2, workers=3, with_media=False)
+
+    assert stats["imported"] == 5
+    assert calls == [2, 2, 1]
+    fields, vectors = repository.get_existing_cards_with_embeddings("artwork")
+    for card_fields, vector in zip(fields, vectors):
+        assert vector[0] == len(embeddings.card_text_for_embedding(card_fields))
+
+
+def test_import_rejects_non_positive_batch_size(make_apkg):
+    path = make_apkg("x.apkg", {"g1": "Guernica"})
+    with pytest.raises(ValueError):
+        import_apkg(str(path), batch_size=0)
+    with pytest.raises(ValueError):
+        import_apkg(str(path), workers=0)
@@ -0,0 +1,62 @@
+import hashlib
+import io
+import json
+import zipfile
+
+import zstandard
+
+from core.apkg_import import _read_media_map
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number: int, value: int | bytes) -> bytes:
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def _package(media: bytes) -> zipfile.ZipFile:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("media", media)
+    return zipfile.ZipFile(buf)
+
+
+def test_legacy_json_map():
+    z = _package(json.dumps({"0": "a.jpg", "1": "b c.png"}).encode())
+    assert _read_media_map(z) == {
+        "a.jpg": {"member": "0", "size": None, "sha1": None, "compressed": False},
+        "b c.png": {"member": "1", "size": None, "sha1": None, "compressed": False},
+    }
+
+
+def test_zstd_protobuf_map():
+    sha_a = hashlib.sha1(b"a").digest()
+    sha_b = hashlib.sha1(b"b").digest()
+    entries = (
+        _field(1, _field(1, "a.jpg".encode()) + _field(2, 300) + _field(3, sha_a))
+        + _field(1, _field(1, "é.png".encode()) + _field(2, 5) + _field(3, sha_b) + _field(255, 7))
+    )
+    z = _package(zstandard.ZstdCompressor().compress(entries))
+    assert _read_media_map(z) == {
+        "a.jpg": {"member": "0", "size": 300, "sha1": sha_a.hex(), "compressed": True},
+        "é.png": {"member": "7", "size": 5, "sha1": sha_b.hex(), "compressed": True},
+    }
+
+
+def test_no_media_member():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("collection.anki2", b"")
+    assert _read_media_map(zipfile.ZipFile(buf)) == {}
@@ -0,0 +1,62 @@
+import json
+import sqlite3
+import zipfile
+
+import genanki
+
+from core import deck_registry
+from export.apkg_writer import ApkgWriter
+
+
+def _read_part(path, tmp_path):
+    with zipfile.ZipFile(path) as z:
+        assert z.testzip() is None
+        media = json.loads(z.read("media"))
+        assert sorted(media) == sorted(n for n in z.namelist() if n not in ("media", "collection.anki2"))
+        collection = tmp_path / f"{path.stem}.anki2"
+        collection.write_bytes(z.read("collection.anki2"))
+    conn = sqlite3.connect(collection)
+    note_ids = [r[0] for r in conn.execute("SELECT id FROM notes")]
+    card_ids = [r[0] for r in conn.execute("SELECT id FROM cards")]
+    conn.close()
+    return media, note_ids, card_ids
+
+
+def test_split_into_three_parts(db, tmp_path):
+    model = deck_registry.genanki_model(deck_registry.get_deck_type("artwork"))
+    images = []
+    for i in range(6):
+        image = tmp_path / f"img{i}.jpg"
+        image.write_bytes(bytes([i]) * 1000)
+        images.append(image)
+
+    path = tmp_path / "deck.apkg"
+    with ApkgWriter(path, model, 1234, "Test", max_part_bytes=2500, batch_size=1) as writer:
+        for i, image in enumerate(images):
+            fields = [""] * len(model.fields)
+            fields[0], fields[2] = f'<img src="{image.name}">', f"Title {i}"
+            writer.add_note(genanki.Note(model=model, fields=fields), media=[image])
+
+    assert writer.paths == [tmp_path / f"deck_part{n}.apkg" for n in (1, 2, 3)]
+    assert writer.note_counts == [2, 2, 2]
+    all_notes, all_cards = [], []
+    for part, count in zip(writer.paths, writer.note_counts):
+        media, note_ids, card_ids = _read_part(part, tmp_path)
+        assert len(media) == len(note_ids) == count
+        all_notes += note_ids
+        all_cards += card_ids
+    assert len(set(all_notes)) == len(all_notes)
+    assert len(set(all_cards)) == len(all_cards)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_abort_removes_parts(db, tmp_path):
+    model = deck_registry.genanki_model(deck_registry.get_deck_type("artwork"))
+    path = tmp_path / "deck.apkg"
+    writer = ApkgWriter(path, model, 1234, "Test", max_part_bytes=10)
+    for i in range(3):
+        writer.add_note(genanki.Note(model=model, fields=[f"note {i} " * 5] + [""] * (len(model.fields) - 1)))
+    assert len(writer.paths) == 2
+    writer.abort()
+    assert writer.paths == [] and writer.note_counts == []
+    assert not list(tmp_path.glob("deck*"))
@@ -0,0 +1,25 @@
+import numpy as np
+
+from core import context, embeddings
+
+EMB = np.ones(4, dtype=np.float32)
+
+
+def _fail_embedding(text, *args, **kwargs):
+    raise AssertionError("topic should not be embedded")
+
+
+def test_small_deck_skips_the_topic_embedding(db, monkeypatch):
+    monkeypatch.setattr(embeddings, "get_embedding", _fail_embedding)
+    cards = [{"Title": "Photosynthesis"}, {"Title": "Osmosis"}]
+    text = context.select_existing_context("biology", "generic", cards, [EMB, EMB], top_k=5)
+    assert text.startswith("Photosynthesis, Osmosis\n")
+
+
+def test_large_deck_is_ranked_by_embedding(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(embeddings, "get_embedding", lambda text, *a, **k: calls.append(text) or EMB)
+    cards = [{"Title": f"Card {i}"} for i in range(5)]
+    text = context.select_existing_context("biology", "generic", cards, [EMB] * 5, top_k=2)
+    assert calls == ["biology"]
+    assert "(The 2 most relevant of 5 existing cards.)" in text
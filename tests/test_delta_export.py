@@ -0,0 +1,37 @@
+import time
+
+from core import deck_registry
+from core.cards import Card
+from export import artifacts
+from export.genanki_export import export_delta
+from storage import repository
+
+
+def _card(title: str) -> Card:
+    return Card(deck_type="artwork", fields_json={"Title": title, "Artist": "Someone"}, status="ACCEPTED")
+
+
+def _delta_titles(deck_type) -> list[str]:
+    path, cards = export_delta(deck_type)
+    if cards:
+        repository.mark_cards_exported(cards)
+    return sorted(c.fields_json["Title"] for c in cards)
+
+
+def test_edit_survives_export_of_other_cards(db):
+    dt = deck_registry.get_deck_type("artwork")
+    x_id, y_id = repository.save_cards([_card("X"), _card("Y")])
+
+    assert _delta_titles(dt) == ["X", "Y"]
+    assert _delta_titles(dt) == []
+
+    time.sleep(0.01)
+    repository.save_card_fields(x_id, {"Title": "X", "Artist": "Someone", "Note": "edited"})
+
+    # An unrelated export of Y alone adds a newer ledger row for the deck
+    y = repository.get_cards(card_ids=[y_id])
+    artifacts.build_artifact(y, dt)
+    repository.mark_cards_exported(y)
+
+    assert _delta_titles(dt) == ["X"]
+    assert _delta_titles(dt) == []
@@ -0,0 +1,33 @@
+from core import deck_registry
+from core.cards import Card
+from export import artifacts, media_preflight
+from export.genanki_export import export_delta
+from storage import repository
+
+
+def test_refetched_cards_are_not_shipped_again(db, monkeypatch):
+    media = db / "media"
+    media.mkdir()
+    monkeypatch.setattr(media_preflight, "MEDIA_DIR", media)
+
+    def refetch(card):
+        name = f"refetched_{card.id}.jpg"
+        (media / name).write_bytes(b"\xff\xd8image")
+        repository.update_card_media(card.id, image_filename=name)  # bumps updated_at
+        return name
+
+    monkeypatch.setattr(media_preflight, "_refetch", refetch)
+    dt = deck_registry.get_deck_type("artwork")
+    repository.save_cards([
+        Card(deck_type="artwork", fields_json={"Title": title}, image_filename="gone.jpg", status="ACCEPTED")
+        for title in ("A", "B")
+    ])
+
+    cards = repository.get_cards(deck_type="artwork")
+    artifact = artifacts.build_artifact(cards, dt, refetch_missing=True)
+    repository.mark_cards_exported(cards)
+    assert artifact["manifest"]["refetched"] == 2
+    assert artifact["key"] == artifacts.artifact_key(repository.get_cards(deck_type="artwork"), dt, "Great Works of Art")
+
+    path, delta = export_delta(dt)
+    assert path is None and delta == []
@@ -0,0 +1,34 @@
+from core import jobs
+from storage import repository
+from storage.database import get_connection
+
+
+def _lose_worker(job_id: int):
+    """Make a RUNNING job look abandoned: its heartbeat is long stale."""
+    conn = get_connection()
+    conn.execute("UPDATE jobs SET heartbeat_at = 0 WHERE id = ?", (job_id,))
+    conn.commit()
+    conn.close()
+
+
+def test_stale_export_is_retried_until_max_attempts(db, monkeypatch):
+    monkeypatch.setattr(jobs.settings, "job_max_attempts", 2)
+    job_id = jobs.submit("export", {"card_ids": [1]})
+    for attempt in (1, 2):
+        assert repository.claim_next_job("w").id == job_id
+        _lose_worker(job_id)
+        jobs.requeue_stale()
+        job = repository.get_job(job_id)
+        assert job.attempts == attempt
+    assert job.status == jobs.FAILED
+    assert "2 attempts" in job.error
+
+
+def test_stale_generate_is_not_retried(db):
+    job_id = jobs.submit("generate", {"topic": "Baroque"})
+    repository.claim_next_job("w")
+    _lose_worker(job_id)
+    assert jobs.requeue_stale() == 0
+    job = repository.get_job(job_id)
+    assert job.status == jobs.FAILED
+    assert "Worker lost" in job.error
@@ -0,0 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from core import metrics
+
+
+@metrics.timed("test.work")
+def _work(n: int) -> int:
+    return n * 2
+
+
+def test_bound_thread_pool_work_reaches_the_collector():
+    with metrics.collect() as timings:
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            assert list(pool.map(metrics.bind(_work), range(5))) == [0, 2, 4, 6, 8]
+            pool.submit(_work, 1).result()  # unbound: not collected
+    assert timings.summary()["stages"]["test.work"]["count"] == 5
+
+
+def test_nested_collectors_both_count():
+    with metrics.collect() as outer:
+        with metrics.collect() as inner:
+            _work(1)
+        _work(2)
+    assert inner.summary()["stages"]["test.work"]["count"] == 1
+    assert outer.summary()["stages"]["test.work"]["count"] == 2
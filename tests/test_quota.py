@@ -0,0 +1,38 @@
+import pytest
+
+from core import quota
+from core.config import settings
+from storage import repository
+
+
+@pytest.fixture
+def scheduler(db, monkeypatch):
+    monkeypatch.setattr(settings, "gemini_rpm", 0)
+    monkeypatch.setattr(settings, "gemini_tpm", 0)
+    monkeypatch.setattr(settings, "gemini_rpd", 3)
+    return quota.QuotaScheduler()
+
+
+def test_sqlite_is_not_touched_under_the_lock(scheduler, monkeypatch):
+    calls = []
+
+    def unlocked(fn):
+        def wrapper(*args, **kwargs):
+            calls.append(scheduler._cond._is_owned())
+            return fn(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(repository, "get_quota_usage", unlocked(repository.get_quota_usage))
+    monkeypatch.setattr(repository, "record_quota_usage", unlocked(repository.record_quota_usage))
+    scheduler.acquire(quota.LLM, tokens=10)
+    scheduler.status()
+    assert calls and not any(calls)
+
+
+def test_daily_budget_counts_local_and_stored_requests(scheduler):
+    repository.record_quota_usage(quota.quota_day(), quota.LLM)  # another process
+    scheduler.acquire(quota.LLM)
+    scheduler.acquire(quota.LLM)
+    with pytest.raises(quota.QuotaExceeded):
+        scheduler.acquire(quota.LLM)
+    assert repository.get_quota_usage(quota.quota_day(), quota.LLM)["requests"] == 3
@@ -20,6 +20,15 @@ export async function fetchCards(params?: { deck_type?: string; status?: string
   return request<import('./types').Card[]>(`/api/cards${qs ? `?${qs}` : ''}`);
 }
 
+export async function searchCards(params: { q: string; deck_type?: string; status?: string; limit?: number; offset?: number }) {
+  const sp = new URLSearchParams({ q: params.q });
+  if (params.deck_type) sp.set('deck_type', params.deck_type);
+  if (params.status) sp.set('status', params.status);
+  if (params.limit !== undefined) sp.set('limit', String(params.limit));
+  if (params.offset !== undefined) sp.set('offset', String(params.offset));
+  return request<import('./types').CardSearchResult>(`/api/cards/search?${sp.toString()}`);
+}
+
 export async function updateCardStatus(cardId: number, status: string) {
   return request<{ id: number; status: string }>(`/api/cards/${cardId}`, {
     method: 'PATCH',
@@ -27,6 +36,13 @@ export async function updateCardStatus(cardId: number, status: string) {
   });
 }
 
+export async function updateCardsStatus(statuses: Record<number, string>) {
+  return request<{ requested: number; updated: number }>('/api/cards', {
+    method: 'PATCH',
+    body: JSON.stringify({ statuses }),
+  });
+}
+
 export async function fetchMediaForCard(cardId: number) {
   return request<import('./types').FetchMediaResult>(`/api/cards/${cardId}/fetch-media`, {
     method: 'POST',
@@ -47,6 +63,40 @@ export async function generateFromArtist(data: import('./types').ArtistRequest)
   });
 }
 
+/**
+ * Open a Server-Sent Events generation stream (/api/generate/events or
+ * /api/generate/artist/events). Returns a function that closes the stream,
+ * which also stops generation on the server.
+ */
+export function streamGeneration(
+  path: string,
+  params: Record<string, string | number | boolean>,
+  handlers: import('./types').GenerateStreamHandlers,
+) {
+  const sp = new URLSearchParams();
+  for (const [key, value] of Object.entries(params)) sp.set(key, String(value));
+  const source = new EventSource(`${BASE}${path}?${sp.toString()}`);
+  const data = (e: Event) => JSON.parse((e as MessageEvent).data);
+
+  source.addEventListener('progress', (e) => handlers.onProgress?.(data(e)));
+  source.addEventListener('card', (e) => handlers.onCard(data(e)));
+  source.addEventListener('image', (e) => {
+    const { card_id, image_filename } = data(e);
+    handlers.onImage?.(card_id, image_filename);
+  });
+  source.addEventListener('done', (e) => {
+    source.close();
+    handlers.onDone(data(e));
+  });
+  source.addEventListener('error', (e) => {
+    source.close();
+    // Server "error" events carry a payload; a dropped connection does not
+    const payload = (e as MessageEvent).data;
+    handlers.onError(payload ? JSON.parse(payload).error : 'Lost connection to the server');
+  });
+  return () => source.close();
+}
+
 export async function exportCards(data: import('./types').ExportRequest) {
   const res = await fetch(`${BASE}/api/export`, {
     method: 'POST',
@@ -75,3 +125,26 @@ export async function fetchAnalytics(deck_type?: string) {
   const qs = deck_type ? `?deck_type=${deck_type}` : '';
   return request<import('./types').AnalyticsRow[]>(`/api/analytics${qs}`);
 }
+
+export async function submitJob(kind: import('./types').Job['kind'], params: Record<string, unknown>) {
+  return request<import('./types').JobSubmitted>('/api/jobs', {
+    method: 'POST',
+    body: JSON.stringify({ kind, params }),
+  });
+}
+
+export async function fetchJob(jobId: number) {
+  return request<import('./types').Job>(`/api/jobs/${jobId}`);
+}
+
+export async function fetchJobs(params?: { status?: string; kind?: string }) {
+  const sp = new URLSearchParams();
+  if (params?.status) sp.set('status', params.status);
+  if (params?.kind) sp.set('kind', params.kind);
+  const qs = sp.toString();
+  return request<import('./types').Job[]>(`/api/jobs${qs ? `?${qs}` : ''}`);
+}
+
+export async function cancelJob(jobId: number) {
+  return request<import('./types').Job>(`/api/jobs/${jobId}/cancel`, { method: 'POST' });
+}
@@ -1,6 +1,14 @@
+import { useCallback, useEffect, useRef, useState } from 'react';
 import { useQuery, useMutation, useQueryClient } from '@tanstack/react-query';
 import * as api from './client';
-import type { GenerateRequest, ArtistRequest, ExportRequest } from './types';
+import type {
+  GenerateRequest,
+  ArtistRequest,
+  ExportRequest,
+  GeneratedCard,
+  GenerateProgress,
+  GenerateSummary,
+} from './types';
 
 export function useCards(params?: { deck_type?: string; status?: string }) {
   return useQuery({
@@ -32,6 +40,14 @@ export function useUpdateCardStatus() {
   });
 }
 
+export function useUpdateCardsStatus() {
+  const qc = useQueryClient();
+  return useMutation({
+    mutationFn: (statuses: Record<number, string>) => api.updateCardsStatus(statuses),
+    onSuccess: () => qc.invalidateQueries({ queryKey: ['cards'] }),
+  });
+}
+
 export function useFetchMedia() {
   const qc = useQueryClient();
   return useMutation({
@@ -56,6 +72,58 @@ export function useGenerateFromArtist() {
   });
 }
 
+/** Generation over Server-Sent Events: cards appear as they are saved. */
+export function useGenerateStream() {
+  const qc = useQueryClient();
+  const [cards, setCards] = useState<GeneratedCard[]>([]);
+  const [progress, setProgress] = useState<GenerateProgress | null>(null);
+  const [summary, setSummary] = useState<GenerateSummary | null>(null);
+  const [error, setError] = useState<string | null>(null);
+  const [isPending, setIsPending] = useState(false);
+  const close = useRef<(() => void) | null>(null);
+
+  const stop = useCallback(() => {
+    close.current?.();
+    close.current = null;
+    setIsPending(false);
+  }, []);
+
+  const start = useCallback(
+    (path: string, params: Record<string, string | number | boolean>) => {
+      close.current?.();
+      setCards([]);
+      setProgress(null);
+      setSummary(null);
+      setError(null);
+      setIsPending(true);
+      close.current = api.streamGeneration(path, params, {
+        onProgress: setProgress,
+        onCard: (card) => setCards((prev) => [...prev, card]),
+        onImage: (cardId, imageFilename) =>
+          setCards((prev) =>
+            prev.map((c) => (c.id === cardId ? { ...c, image_filename: imageFilename } : c)),
+          ),
+        onDone: (s) => {
+          setSummary(s);
+          setIsPending(false);
+          qc.invalidateQueries({ queryKey: ['cards'] });
+        },
+        onError: (message) => {
+          setError(message);
+          setIsPending(false);
+          qc.invalidateQueries({ queryKey: ['cards'] });
+        },
+      });
+    },
+    [qc],
+  );
+
+  // Leaving the page closes the stream, which stops generation on the server
+  useEffect(() => () => close.current?.(), []);
+
+  return { start, stop, cards, progress, summary, error, isPending };
+}
+
 export function useExport() {
   return useMutation({
     mutationFn: (data: ExportRequest) => api.exportCards(data),
@@ -13,6 +13,14 @@ export interface Card {
   created_at: string | null;
 }
 
+export interface CardSearchResult {
+  query: string;
+  offset: number;
+  limit: number;
+  has_more: boolean;
+  cards: Card[];
+}
+
 export interface DeckType {
   name: string;
   fields_schema: FieldSchema[];
@@ -56,6 +64,23 @@ export interface GeneratedCard {
   image_filename?: string | null;
 }
 
+export interface GenerateProgress {
+  done: number;
+  total: number;
+  message: string;
+}
+
+/** Final event of a generation stream: the result without its card list. */
+export type GenerateSummary = Omit<GenerateResponse, 'cards'> & { cards_saved?: number };
+
+export interface GenerateStreamHandlers {
+  onProgress?: (progress: GenerateProgress) => void;
+  onCard: (card: GeneratedCard) => void;
+  onImage?: (cardId: number, imageFilename: string | null) => void;
+  onDone: (summary: GenerateSummary) => void;
+  onError: (message: string) => void;
+}
+
 export interface ExportRequest {
   card_ids: number[];
   deck_name: string;
@@ -68,10 +93,34 @@ export interface FetchMediaResult {
   search_url?: string;
 }
 
+export interface Job {
+  id: number;
+  kind: 'generate' | 'generate_artist' | 'import' | 'export';
+  params: Record<string, unknown>;
+  status: 'QUEUED' | 'RUNNING' | 'SUCCEEDED' | 'FAILED' | 'CANCELLED';
+  progress_done: number;
+  progress_total: number;
+  progress_message: string | null;
+  result: Record<string, unknown> | null;
+  error: string | null;
+  cancel_requested: boolean;
+  created_at: number | null;
+  started_at: number | null;
+  finished_at: number | null;
+}
+
+export interface JobSubmitted {
+  job_id: number;
+  status: string;
+}
+
 export interface AnalyticsRow {
-  topic: string;
+  topic: string | null;
   deck_type: string;
   total_cards: number;
   accepted: number;
   rejected: number;
+  generated: number;
+  duplicate: number;
+  exported: number;
 }
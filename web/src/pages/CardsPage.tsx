@@ -1,5 +1,5 @@
 import { useState, useCallback } from 'react';
-import { useCards, useUpdateCardStatus, useFetchMedia, useExport, useClearCards } from '../api/hooks';
+import { useCards, useUpdateCardStatus, useUpdateCardsStatus, useFetchMedia, useExport, useClearCards } from '../api/hooks';
 import CardItem from '../components/cards/CardItem';
 
 const STATUS_FILTERS = ['ALL', 'GENERATED', 'ACCEPTED', 'REJECTED', 'EXPORTED', 'DUPLICATE', 'IMPORTED'];
@@ -13,6 +13,7 @@ export default function CardsPage() {
     statusFilter === 'ALL' ? undefined : { status: statusFilter }
   );
   const updateStatus = useUpdateCardStatus();
+  const updateStatuses = useUpdateCardsStatus();
   const fetchMedia = useFetchMedia();
   const exportMut = useExport();
   const clearCards = useClearCards();
@@ -33,9 +34,7 @@ export default function CardsPage() {
   const selectNone = () => setSelected(new Set());
 
   const bulkAction = async (status: string) => {
-    for (const id of selected) {
-      await updateStatus.mutateAsync({ cardId: id, status });
-    }
+    await updateStatuses.mutateAsync(Object.fromEntries([...selected].map((id) => [id, status])));
     setSelected(new Set());
   };
 
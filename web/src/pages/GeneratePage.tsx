@@ -1,5 +1,5 @@
-import { useState } from 'react';
-import { useGenerate, useGenerateFromArtist, useUpdateCardStatus } from '../api/hooks';
+import { useEffect, useState } from 'react';
+import { useGenerateStream, useUpdateCardStatus, useUpdateCardsStatus } from '../api/hooks';
 import CardStatusBadge from '../components/cards/CardStatusBadge';
 import type { GeneratedCard } from '../api/types';
 
@@ -12,34 +12,30 @@ export default function GeneratePage() {
   const [count, setCount] = useState(5);
   const [elapsed, setElapsed] = useState(0);
 
-  const artistMut = useGenerateFromArtist();
-  const topicMut = useGenerate();
+  const generation = useGenerateStream();
   const updateStatus = useUpdateCardStatus();
+  const updateStatuses = useUpdateCardsStatus();
 
-  const isPending = artistMut.isPending || topicMut.isPending;
-  const result = mode === 'artist' ? artistMut.data : topicMut.data;
-  const error = mode === 'artist' ? artistMut.error : topicMut.error;
+  const { isPending, cards, progress, summary, error } = generation;
 
-  const handleSubmit = (e: React.FormEvent) => {
-    e.preventDefault();
-    if (mode === 'artist') {
-      artistMut.mutate({ artist_name: artistName, deck_type: 'artwork', limit: 0 });
-    } else {
-      topicMut.mutate({ topic, count, deck_type: 'artwork' });
-    }
-
-    // Elapsed timer
+  // Elapsed timer while the stream is open
+  useEffect(() => {
+    if (!isPending) return;
     setElapsed(0);
     const start = Date.now();
     const interval = setInterval(() => {
       setElapsed(Math.floor((Date.now() - start) / 1000));
     }, 1000);
-    const checkDone = setInterval(() => {
-      if (!artistMut.isPending && !topicMut.isPending) {
-        clearInterval(interval);
-        clearInterval(checkDone);
-      }
-    }, 500);
+    return () => clearInterval(interval);
+  }, [isPending]);
+
+  const handleSubmit = (e: React.FormEvent) => {
+    e.preventDefault();
+    if (mode === 'artist') {
+      generation.start('/api/generate/artist/events', { artist_name: artistName, deck_type: 'artwork', limit: 0 });
+    } else {
+      generation.start('/api/generate/events', { topic, count, deck_type: 'artwork' });
+    }
   };
 
   const handleCardAction = (card: GeneratedCard, status: string) => {
@@ -47,11 +43,9 @@ export default function GeneratePage() {
   };
 
   const handleAcceptAll = () => {
-    if (!result?.cards) return;
-    for (const card of result.cards) {
-      if (card.status === 'GENERATED') {
-        updateStatus.mutate({ cardId: card.id, status: 'ACCEPTED' });
-      }
+    const pending = cards.filter((card) => card.status === 'GENERATED');
+    if (pending.length) {
+      updateStatuses.mutate(Object.fromEntries(pending.map((card) => [card.id, 'ACCEPTED'])));
     }
   };
 
@@ -130,19 +124,26 @@ export default function GeneratePage() {
         </button>
       </form>
 
-      {/* Loading state */}
+      {/* Progress */}
       {isPending && (
         <div className="bg-blue-50 border border-blue-200 rounded-lg p-4 mb-6">
           <div className="flex items-center gap-3">
             <div className="animate-spin w-5 h-5 border-2 border-blue-600 border-t-transparent rounded-full" />
-            <div>
+            <div className="flex-1">
               <p className="text-sm font-medium">
-                Querying Wikidata & fetching images...
+                {progress?.message || 'Querying Wikidata & fetching images...'}
               </p>
               <p className="text-xs text-gray-500">
+                {progress && progress.total > 0 && `${progress.done}/${progress.total} · `}
                 {elapsed}s elapsed
               </p>
             </div>
+            <button
+              onClick={generation.stop}
+              className="text-xs px-3 py-1.5 bg-gray-200 rounded hover:bg-gray-300"
+            >
+              Stop
+            </button>
           </div>
         </div>
       )}
@@ -150,98 +151,93 @@ export default function GeneratePage() {
       {/* Error */}
       {error && (
         <div className="bg-red-50 border border-red-200 rounded-lg p-4 mb-6">
-          <p className="text-sm text-red-700">{error.message}</p>
+          <p className="text-sm text-red-700">{error}</p>
         </div>
       )}
 
       {/* Results */}
-      {result && !isPending && (
+      {summary && (
         <div>
-          {result.error && (
-            <div className="bg-yellow-50 border border-yellow-200 rounded-lg p-4 mb-4">
-              <p className="text-sm text-yellow-700">{result.error}</p>
-            </div>
-          )}
-
-          {result.message && (
-            <p className="text-sm text-gray-500 mb-4">{result.message}</p>
+          {summary.message && (
+            <p className="text-sm text-gray-500 mb-4">{summary.message}</p>
           )}
 
-          {result.total_found !== undefined && (
+          {summary.total_found !== undefined && (
             <p className="text-sm text-gray-500 mb-3">
-              Found {result.total_found} artworks — {result.skipped} already in deck, {result.new || result.cards.length} new.
+              Found {summary.total_found} artworks — {summary.skipped} already in deck, {summary.new ?? summary.cards_saved ?? 0} new.
             </p>
           )}
+        </div>
+      )}
 
-          {result.cards.length > 0 && (
-            <div className="space-y-3">
-              <div className="flex items-center justify-between">
-                <h3 className="font-medium text-sm">
-                  {result.cards.length} cards generated:
-                </h3>
-                <button
-                  onClick={handleAcceptAll}
-                  className="text-xs px-3 py-1.5 bg-green-600 text-white rounded hover:bg-green-700"
-                >
-                  Accept All
-                </button>
+      {/* Cards arrive one by one while the stream is open */}
+      {cards.length > 0 && (
+        <div className="space-y-3">
+          <div className="flex items-center justify-between">
+            <h3 className="font-medium text-sm">
+              {cards.length} cards generated{isPending ? ' so far' : ''}:
+            </h3>
+            <button
+              onClick={handleAcceptAll}
+              className="text-xs px-3 py-1.5 bg-green-600 text-white rounded hover:bg-green-700"
+            >
+              Accept All
+            </button>
+          </div>
+          {cards.map((card) => (
+            <div key={card.id} className="border rounded-lg p-3 bg-white flex gap-3">
+              {/* Image thumbnail */}
+              <div className="w-20 h-20 shrink-0 bg-gray-100 rounded overflow-hidden flex items-center justify-center">
+                {card.image_filename ? (
+                  <img
+                    src={`/media/${card.image_filename}`}
+                    alt={card.fields.Title || ''}
+                    className="w-full h-full object-cover"
+                  />
+                ) : (
+                  <span className="text-gray-400 text-xs">No img</span>
+                )}
               </div>
-              {result.cards.map((card) => (
-                <div key={card.id} className="border rounded-lg p-3 bg-white flex gap-3">
-                  {/* Image thumbnail */}
-                  <div className="w-20 h-20 shrink-0 bg-gray-100 rounded overflow-hidden flex items-center justify-center">
-                    {card.image_filename ? (
-                      <img
-                        src={`/media/${card.image_filename}`}
-                        alt={card.fields.Title || ''}
-                        className="w-full h-full object-cover"
-                      />
-                    ) : (
-                      <span className="text-gray-400 text-xs">No img</span>
+              <div className="flex-1 min-w-0">
+                <div className="flex items-start justify-between">
+                  <div className="min-w-0">
+                    <p className="font-medium text-sm truncate">{card.fields.Title || '(untitled)'}</p>
+                    {card.fields.Artist && (
+                      <p className="text-xs text-gray-500">{card.fields.Artist}</p>
+                    )}
+                    {card.fields.Date && (
+                      <p className="text-xs text-gray-400">{card.fields.Date}</p>
+                    )}
+                    {card.fields['Permanent Location'] && (
+                      <p className="text-xs text-gray-400 truncate">{card.fields['Permanent Location']}</p>
                     )}
                   </div>
-                  <div className="flex-1 min-w-0">
-                    <div className="flex items-start justify-between">
-                      <div className="min-w-0">
-                        <p className="font-medium text-sm truncate">{card.fields.Title || '(untitled)'}</p>
-                        {card.fields.Artist && (
-                          <p className="text-xs text-gray-500">{card.fields.Artist}</p>
-                        )}
-                        {card.fields.Date && (
-                          <p className="text-xs text-gray-400">{card.fields.Date}</p>
-                        )}
-                        {card.fields['Permanent Location'] && (
-                          <p className="text-xs text-gray-400 truncate">{card.fields['Permanent Location']}</p>
-                        )}
-                      </div>
-                      <div className="flex items-center gap-2 shrink-0 ml-2">
-                        <CardStatusBadge status={card.status} />
-                        {card.status === 'GENERATED' && (
-                          <>
-                            <button
-                              onClick={() => handleCardAction(card, 'ACCEPTED')}
-                              className="text-xs px-2 py-1 bg-green-600 text-white rounded"
-                            >
-                              Accept
-                            </button>
-                            <button
-                              onClick={() => handleCardAction(card, 'REJECTED')}
-                              className="text-xs px-2 py-1 bg-red-600 text-white rounded"
-                            >
-                              Reject
-                            </button>
-                          </>
-                        )}
-                      </div>
-                    </div>
-                    {card.duplicate_reason && (
-                      <p className="text-xs text-yellow-600 mt-1">Duplicate: {card.duplicate_reason}</p>
+                  <div className="flex items-center gap-2 shrink-0 ml-2">
+                    <CardStatusBadge status={card.status} />
+                    {card.status === 'GENERATED' && (
+                      <>
+                        <button
+                          onClick={() => handleCardAction(card, 'ACCEPTED')}
+                          className="text-xs px-2 py-1 bg-green-600 text-white rounded"
+                        >
+                          Accept
+                        </button>
+                        <button
+                          onClick={() => handleCardAction(card, 'REJECTED')}
+                          className="text-xs px-2 py-1 bg-red-600 text-white rounded"
+                        >
+                          Reject
+                        </button>
+                      </>
                     )}
                   </div>
                 </div>
-              ))}
+                {card.duplicate_reason && (
+                  <p className="text-xs text-yellow-600 mt-1">Duplicate: {card.duplicate_reason}</p>
+                )}
+              </div>
             </div>
-          )}
+          ))}
         </div>
       )}
     </div>